@@ -21,6 +21,14 @@ class Config:
         with open(config_path, "r", encoding="utf-8") as f:
             self._data = yaml.safe_load(f)
 
+    def override(self, section, **values):
+        """config.yaml を書き換えずに設定値を差し替える（負荷試験などで使う）
+
+        DB_PATH などモジュール読み込み時に値を取り出しているものがあるので、
+        src.engine / src.common.db_handler を import する前に呼ぶこと。
+        """
+        self._data.setdefault(section, {}).update(values)
+
     @property
     def db_path(self):
         return self._data["system"]["db_path"]
@@ -33,6 +41,32 @@ class Config:
     def retention_minutes(self):
         return self._data["system"]["retention_minutes"]
     
+    @property
+    def retention_interval(self):
+        return self._data["system"].get("retention_interval_seconds", 60)
+
+    @property
+    def retention_chunk_rows(self):
+        return self._data["system"].get("retention_chunk_rows", 5000)
+
+    @property
+    def archive_path(self):
+        """保持期間を過ぎた履歴の圧縮保存先（未設定ならアーカイブせずに削除する）"""
+        return self._data["system"].get("archive_path")
+
+    @property
+    def archive_days(self):
+        return self._data["system"].get("archive_days", 28)
+
+    @property
+    def rollup_1m_hours(self):
+        """1分ロールアップ (history_1m) を残す時間。retention_minutes より短ければ retention_minutes まで残す"""
+        return self._data["system"].get("rollup_1m_hours", 24)
+
+    @property
+    def history_partition(self):
+        return self._data["system"].get("history_partition", "hour")
+
     @property
     def web_port(self):
         return self._data["system"]["web_port"]
@@ -53,6 +87,94 @@ class Config:
     def polling_timeout(self):
         return self._data["polling"]["timeout"]
 
+    @property
+    def polling_max_gap(self):
+        return self._data["polling"].get("max_gap", 10)
+
+    @property
+    def polling_max_block_size(self):
+        return self._data["polling"].get("max_block_size", 125)
+
+    @property
+    def polling_overrun_policy(self):
+        return self._data["polling"].get("overrun_policy", "compress")
+
+    @property
+    def polling_reconnect_delay(self):
+        return self._data["polling"].get("reconnect_delay", 1)
+
+    @property
+    def polling_reconnect_delay_max(self):
+        return self._data["polling"].get("reconnect_delay_max", 60)
+
+    @property
+    def polling_offline_after(self):
+        return self._data["polling"].get("offline_after", 3)
+
+    @property
+    def polling_quarantine_retry(self):
+        return self._data["polling"].get("quarantine_retry_seconds", 10)
+
+    @property
+    def polling_quarantine_retry_max(self):
+        return self._data["polling"].get("quarantine_retry_max_seconds", 600)
+
+    @property
+    def writer_max_batch(self):
+        return self._data.get("writer", {}).get("max_batch", 5000)
+
+    @property
+    def writer_max_latency(self):
+        return self._data.get("writer", {}).get("max_latency_ms", 500) / 1000
+
+    @property
+    def writer_buffer_max_rows(self):
+        return self._data.get("writer", {}).get("buffer_max_rows", 200000)
+
+    @property
+    def writer_spill_path(self):
+        return self._data.get("writer", {}).get("spill_path")
+
+    @property
+    def live_values_path(self):
+        return self._data.get("live_values", {}).get("path")
+
+    @property
+    def live_values_capacity(self):
+        return self._data.get("live_values", {}).get("capacity", 65536)
+
+    @property
+    def live_values_snapshot_interval(self):
+        return self._data.get("live_values", {}).get("snapshot_interval_seconds", 30)
+
+    @property
+    def web_pool_readers(self):
+        return self._data.get("web_pool", {}).get("readers", 4)
+
+    @property
+    def web_pool_mmap_size_mb(self):
+        return self._data.get("web_pool", {}).get("mmap_size_mb", 256)
+
+    @property
+    def web_pool_cache_size_mb(self):
+        return self._data.get("web_pool", {}).get("cache_size_mb", 16)
+
+    @property
+    def metrics_enabled(self):
+        return self._data.get("metrics", {}).get("enabled", True)
+
+    @property
+    def metrics_host(self):
+        return self._data.get("metrics", {}).get("host", "127.0.0.1")
+
+    @property
+    def metrics_port(self):
+        return self._data.get("metrics", {}).get("port", 9108)
+
+    @property
+    def metrics_unix_socket(self):
+        return self._data.get("metrics", {}).get("unix_socket")
+
 
 # どこからでも import config で使えるようにインスタンス化しておく
-config = Config()
\ No newline at end of file
+config = Config()
@@ -1,14 +1,89 @@
 import sqlite3
 import os
 
+from src.common import history_partitions, history_rollups
 from src.common.config_loader import config
 
 # DBパスをconfigから取得
 DB_PATH = config.db_path
 
+# 設定変更として扱う列（これらが変わった時だけ config_version を加算する）
+# Pollerが毎サイクル書く last_value / status / updated_at は含めないこと
+HOST_CONFIG_COLUMNS = ["display_name", "ip_address", "port", "unit_id", "is_active", "pipeline_window", "timeout"]
+ITEM_CONFIG_COLUMNS = ["host_id", "tag_name", "address", "polling_interval", "alarm_threshold", "alarm_enabled",
+                       "deadband", "deadband_type", "swinging_door", "max_interval",
+                       "reg_type", "data_type", "word_order", "scale", "value_offset"]
+TRIGGER_CONFIG_COLUMNS = ["item_id", "name", "cond_op", "cond_thr", "problem_count",
+                          "rect_op", "rect_thr", "recovery_count", "priority"]
+
+# 旧形式の履歴を移す時に一度に読む行数
+MIGRATION_CHUNK = 50000
+
+def column_types(cursor, table):
+    """テーブルの列名 -> 宣言された型（テーブルが無ければ空）"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1]: row[2] for row in cursor.fetchall()}
+
+
+def migrate_text_history(cursor, table):
+    """時刻が文字列（ローカル時刻）の旧形式の履歴を epoch ミリ秒のパーティションへ移し、テーブルを削除する"""
+    source = cursor.connection.execute(
+        f"""SELECT item_id, CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000, value
+            FROM {table} WHERE timestamp IS NOT NULL ORDER BY rowid"""
+    )
+    created = set()
+    moved = 0
+    while rows := source.fetchmany(MIGRATION_CHUNK):
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(history_partitions.partition_name(row[1]), []).append(row)
+        for name, part in partitions.items():
+            if name not in created:
+                for sql in history_partitions.create_sql(name):
+                    cursor.execute(sql)
+                created.add(name)
+            cursor.executemany(history_partitions.insert_sql(name), part)
+        moved += len(rows)
+    cursor.execute(f"DROP TABLE {table}")
+    print(f"Moved {moved} history rows from {table} into {len(created)} partitions.")
+
+
+def migrate_history(cursor):
+    """旧形式の履歴（history テーブル、時刻が文字列のパーティション）を現在の形式へ移す"""
+    legacy = []
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history'")
+    if cursor.fetchone():
+        legacy.append("history")
+    cursor.execute(history_partitions.LIST_SQL)
+    for name in [row[0] for row in cursor.fetchall()]:
+        if "timestamp" in column_types(cursor, name):
+            # 旧パーティションはローカル時刻で区切っているので、新しいパーティション名と重ならないよう退避してから移す
+            cursor.execute(f"ALTER TABLE {name} RENAME TO legacy_{name}")
+            legacy.append(f"legacy_{name}")
+    for table in legacy:
+        migrate_text_history(cursor, table)
+
+
+def backfill_rollups(cursor):
+    """既存のパーティションからロールアップを作る（ロールアップ導入前のDB用）"""
+    cursor.execute(history_partitions.LIST_SQL)
+    names = [row[0] for row in cursor.fetchall()]
+    if names:
+        print(f"Building rollups from {len(names)} history partitions...")
+    for name in names:
+        cursor.execute(f"SELECT item_id, ts, value FROM {name}")
+        for table, params in history_rollups.aggregate(cursor.fetchall()).items():
+            cursor.executemany(history_rollups.UPSERT_SQL[table], params)
+
+
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
+    # 削除で空いたページを保持期間の処理 (src/engine/retention.py) が少しずつファイルから返せるようにする。
+    # 既存のDBで設定を変えるには VACUUM が必要（初回のみ、DBの大きさに応じて時間がかかる）
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
     conn.execute("PRAGMA journal_mode=WAL;")
     cursor = conn.cursor()
 
@@ -22,6 +97,8 @@ def init_db():
         unit_id INTEGER DEFAULT 1,
         is_active INTEGER DEFAULT 1,
         status TEXT DEFAULT 'Unknown',
+        pipeline_window INTEGER DEFAULT 1,  -- 1接続で同時に送るリクエスト数 (1=直列)
+        timeout REAL,                       -- 通信タイムアウト秒 (NULL=config.yaml の polling.timeout)
         updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
     )
     """)
@@ -38,6 +115,16 @@ def init_db():
         last_value REAL,
         alarm_threshold REAL DEFAULT 100.0,
         alarm_enabled INTEGER DEFAULT 0,
+        last_status INTEGER DEFAULT 0,  -- 0:OK, 1:CommErr, 2:AddrErr
+        deadband REAL DEFAULT 0,                -- 履歴圧縮の許容誤差 (0 = 値が変わるたびに記録)
+        deadband_type TEXT DEFAULT 'absolute',  -- 'absolute' (値) or 'percent' (直前の記録値に対する%)
+        swinging_door INTEGER DEFAULT 0,        -- 1 = Swinging Door Trending で圧縮
+        max_interval INTEGER DEFAULT 0,         -- この秒数以上記録が無ければ変化が無くても記録 (0 = 無効)
+        reg_type TEXT DEFAULT 'holding',        -- 'holding', 'input', 'coil', 'discrete'
+        data_type TEXT DEFAULT 'uint16',        -- 'uint16', 'int16', 'uint32', 'int32', 'float32', 'uint64', 'int64', 'float64'
+        word_order TEXT DEFAULT 'big',          -- 32/64bit値のワード順 'big' (上位ワードが先) or 'little'
+        scale REAL DEFAULT 1,                   -- 記録値 = 生値 * scale + value_offset
+        value_offset REAL DEFAULT 0,
         updated_at DATETIME,
         UNIQUE(host_id, tag_name),
         FOREIGN KEY(host_id) REFERENCES hosts(id)
@@ -55,24 +142,47 @@ def init_db():
         threshold_value REAL,     -- その時のしきい値
         status TEXT,              -- 'active' (継続中) or 'resolved' (復旧済み)
         acked_at TEXT,            -- 外部確認時点
-        acked_by TEXT             -- 外部確認者
+        acked_by TEXT,            -- 外部確認者
+        trigger_id INTEGER        -- 発火したトリガー (NULL = items.alarm_threshold による従来のアラート)
     )
     """)
 
-    # --- 4. historyテーブルの作成 ---
+    # --- 3-2. triggersテーブルの作成 (docs/TriggerSpec.md 6章) ---
+    # 判定状態 (OK/PROBLEM・連続一致カウント) は Poller のメモリ上で持ち、起動時は event_logs から復元する
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            item_id INTEGER NOT NULL,
-            value REAL,
-            timestamp DATETIME DEFAULT (DATETIME('now', 'localtime')),
-            FOREIGN KEY (item_id) REFERENCES items(id)
-        )
-    """)
-    # -- 検索を速くするためのインデックス
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_history_item_id_timestamp ON history(item_id, timestamp)
+    CREATE TABLE IF NOT EXISTS triggers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_id INTEGER,
+        name TEXT NOT NULL,
+        cond_op TEXT NOT NULL,            -- '>', '>=', '<', '<=', '==', '!='
+        cond_thr REAL NOT NULL,           -- 発火閾値
+        problem_count INTEGER DEFAULT 1,  -- 連続発火回数
+        rect_op TEXT,                     -- 復旧条件 (NULL = 発火条件の否定)
+        rect_thr REAL,                    -- 復旧閾値
+        recovery_count INTEGER DEFAULT 1, -- 連続復旧回数
+        priority INTEGER DEFAULT 3,       -- 優先度
+        FOREIGN KEY(item_id) REFERENCES items(id)
+    )
     """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_triggers_item_id ON triggers(item_id)")
+
+    # --- 4. history（時間パーティション） ---
+    # パーティション (history_pYYYYMMDDHH 等、(item_id, ts) が主キーの WITHOUT ROWID) は DBWriter が書き込み時に作る。
+    # 旧形式（history テーブル / 時刻が文字列のパーティション）が残っていれば、epoch ミリ秒の形式へ移す
+    migrate_history(cursor)
+
+    # --- 4-1. history のロールアップ (1分 / 1時間) ---
+    # 更新は DBWriter が履歴と同じトランザクションで行う。
+    # テーブルが無いか旧形式（区間が文字列）の場合は、既存の履歴から作り直す
+    rollup_types = column_types(cursor, "history_1m")
+    rollups_current = rollup_types.get("bucket") == "INTEGER"
+    if rollup_types and not rollups_current:
+        for table, _ in history_rollups.RESOLUTIONS.values():
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    for sql in history_rollups.create_sql():
+        cursor.execute(sql)
+    if not rollups_current:
+        backfill_rollups(cursor)
                    
     # --- X1. マイグレーション：アイテムテーブルへのカラム追加チェック ---
     cursor.execute("PRAGMA table_info(items)")
@@ -83,7 +193,17 @@ def init_db():
         ("address", "INTEGER DEFAULT 0"),
         ("alarm_threshold", "REAL DEFAULT 100.0"),
         ("alarm_enabled", "INTEGER DEFAULT 0"),  # 0=無効, 1=有効
-        ("polling_interval", "INTEGER DEFAULT 5")
+        ("polling_interval", "INTEGER DEFAULT 5"),
+        ("last_status", "INTEGER DEFAULT 0"),  # 0:OK, 1:CommErr, 2:AddrErr
+        ("deadband", "REAL DEFAULT 0"),
+        ("deadband_type", "TEXT DEFAULT 'absolute'"),
+        ("swinging_door", "INTEGER DEFAULT 0"),
+        ("max_interval", "INTEGER DEFAULT 0"),
+        ("reg_type", "TEXT DEFAULT 'holding'"),
+        ("data_type", "TEXT DEFAULT 'uint16'"),
+        ("word_order", "TEXT DEFAULT 'big'"),
+        ("scale", "REAL DEFAULT 1"),
+        ("value_offset", "REAL DEFAULT 0")
     ]
     for col_name, col_type in migrations:
         if col_name not in columns:
@@ -96,13 +216,47 @@ def init_db():
     # 必要カラムのチェックと追加
     migrations = [
         ("acked_at", "TEXT"),
-        ("acked_by", "TEXT")
+        ("acked_by", "TEXT"),
+        ("trigger_id", "INTEGER")
     ]
 
     for col_name, col_type in migrations:
         if col_name not in columns:
             print(f"Adding {col_name} column to event_logs table...")
             cursor.execute(f"ALTER TABLE event_logs ADD COLUMN {col_name} {col_type}")
+    # 継続中のイベントを探す（復旧時・起動時の状態復元）ためのインデックス
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_event_logs_status_item_id ON event_logs(status, item_id)")
+
+    # --- X3. マイグレーション：ホストテーブルへのカラム追加チェック ---
+    cursor.execute("PRAGMA table_info(hosts)")
+    columns = [row[1] for row in cursor.fetchall()]
+    migrations = [
+        ("pipeline_window", "INTEGER DEFAULT 1"),
+        ("timeout", "REAL")
+    ]
+
+    for col_name, col_type in migrations:
+        if col_name not in columns:
+            print(f"Adding {col_name} column to hosts table...")
+            cursor.execute(f"ALTER TABLE hosts ADD COLUMN {col_name} {col_type}")
+
+    # --- X4. 設定バージョン（Pollerの設定キャッシュが変更検知に使う） ---
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS config_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO config_meta (key, value) VALUES ('config_version', 0)")
+
+    # 列の追加に追従できるよう、トリガーは毎回作り直す
+    bump = "UPDATE config_meta SET value = value + 1 WHERE key = 'config_version';"
+    for table, columns in (("hosts", HOST_CONFIG_COLUMNS), ("items", ITEM_CONFIG_COLUMNS),
+                           ("triggers", TRIGGER_CONFIG_COLUMNS)):
+        for event in ("INSERT", "DELETE", f"UPDATE OF {', '.join(columns)}"):
+            name = f"trg_{table}_{event.split()[0].lower()}_config_version"
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"CREATE TRIGGER {name} AFTER {event} ON {table} BEGIN {bump} END")
 
     conn.commit()
     conn.close()
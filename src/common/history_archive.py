@@ -0,0 +1,397 @@
+# history のアーカイブ（保持期間を過ぎた履歴の圧縮保存）
+# 保持期間 (retention_minutes) を過ぎたパーティションを、SQLite から消す前に列指向の圧縮ファイルへ封印する。
+# SQLite は直近の分だけを持つので小さいまま、アーカイブ側で数週間分 (archive_days) を残せる。
+#
+# ファイル: {archive_path}/history_pYYYYMMDDHH.sega（パーティション1つにつき1ファイル。作成後は書き換えない）
+#   ヘッダ  : MAGIC, バージョン
+#   ブロック: アイテムごとに [時刻の列][値の列] を続けて置く
+#       時刻: 先頭の時刻 (64bit) の後、差分の差分 (delta-of-delta) を可変長のビット列で持つ
+#       値  : 先頭の値 (float64) の後、直前の値との XOR を Gorilla 方式で持つ（同じ値なら1bit）
+#   索引    : アイテムごとの (item_id, 件数, 最初/最後の時刻, 位置, 時刻列/値列のバイト数)
+#   フッタ  : 索引の位置, アイテム数, 期間
+# 読み出しはファイルを mmap し、索引から対象アイテムのブロックだけを、要求された期間の分まで復号する。
+import bisect
+import itertools
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from operator import itemgetter
+
+from src.common import history_partitions
+
+MAGIC = b"SEGA"
+VERSION = 1
+EXTENSION = ".sega"
+HEADER = struct.Struct("<4sB3x")
+INDEX_ENTRY = struct.Struct("<qIqqQII")   # item_id, count, first_ts, last_ts, offset, ts_bytes, value_bytes
+FOOTER = struct.Struct("<QIqq4s")         # index_offset, item_count, start, end, MAGIC
+
+MASK64 = (1 << 64) - 1
+NAN_BITS = 0x7FF8000000000000  # 値が NULL の行は NaN として持つ（読み出し時に None へ戻す）
+
+
+class BitWriter:
+    """ビット単位で書き込むバッファ（上位ビットから詰める）"""
+
+    def __init__(self):
+        self.out = bytearray()
+        self.acc = 0
+        self.nbits = 0
+
+    def write(self, value, nbits):
+        self.acc = (self.acc << nbits) | (value & ((1 << nbits) - 1))
+        self.nbits += nbits
+        if self.nbits >= 64:
+            rest = self.nbits & 7
+            self.out += (self.acc >> rest).to_bytes(self.nbits >> 3, "big")
+            self.acc &= (1 << rest) - 1
+            self.nbits = rest
+
+    def getvalue(self):
+        if not self.nbits:
+            return bytes(self.out)
+        pad = -self.nbits & 7
+        return bytes(self.out) + (self.acc << pad).to_bytes((self.nbits + pad) >> 3, "big")
+
+
+class BitReader:
+    """bytes / mmap の指定位置からビット単位で読む"""
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.pos = offset * 8
+
+    def read(self, nbits):
+        pos = self.pos
+        shift = pos & 7
+        span = (shift + nbits + 7) >> 3
+        window = int.from_bytes(self.data[pos >> 3:(pos >> 3) + span], "big")
+        self.pos = pos + nbits
+        return (window >> (span * 8 - shift - nbits)) & ((1 << nbits) - 1)
+
+
+# --- 時刻: delta-of-delta ---
+# 収集周期が一定なら差分の差分はほぼ 0 (1bit)。ミリ秒の揺らぎも 9bit に収まる
+
+def encode_timestamps(timestamps):
+    writer = BitWriter()
+    writer.write(timestamps[0] & MASK64, 64)
+    previous, delta = timestamps[0], 0
+    for ts in itertools.islice(timestamps, 1, None):
+        current = ts - previous
+        dod = current - delta
+        if dod == 0:
+            writer.write(0, 1)
+        elif -63 <= dod <= 64:
+            writer.write(0b10, 2)
+            writer.write(dod + 63, 7)
+        elif -255 <= dod <= 256:
+            writer.write(0b110, 3)
+            writer.write(dod + 255, 9)
+        elif -2047 <= dod <= 2048:
+            writer.write(0b1110, 4)
+            writer.write(dod + 2047, 12)
+        else:
+            writer.write(0b1111, 4)
+            writer.write(dod & MASK64, 64)
+        previous, delta = ts, current
+    return writer.getvalue()
+
+
+def decode_timestamps(data, offset, count, end=None):
+    """先頭から count 件を復号する（end 以上の時刻に達したらそこで止める）"""
+    reader = BitReader(data, offset)
+    read = reader.read
+    ts = read(64)
+    if ts >= 1 << 63:
+        ts -= 1 << 64
+    timestamps = [ts]
+    delta = 0
+    for _ in range(count - 1):
+        if end is not None and ts >= end:
+            break
+        if not read(1):
+            dod = 0
+        elif not read(1):
+            dod = read(7) - 63
+        elif not read(1):
+            dod = read(9) - 255
+        elif not read(1):
+            dod = read(12) - 2047
+        else:
+            dod = read(64)
+            if dod >= 1 << 63:
+                dod -= 1 << 64
+        delta += dod
+        ts += delta
+        timestamps.append(ts)
+    return timestamps
+
+
+# --- 値: Gorilla XOR ---
+
+def encode_values(values):
+    bits = struct.unpack(f">{len(values)}Q", struct.pack(
+        f">{len(values)}d", *(float("nan") if value is None else value for value in values)))
+    writer = BitWriter()
+    writer.write(bits[0], 64)
+    previous, leading, trailing = bits[0], -1, 0
+    for current in itertools.islice(bits, 1, None):
+        xor = current ^ previous
+        previous = current
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if leading >= 0 and lead >= leading and trail >= trailing:
+            # 直前と同じ範囲に収まる: 範囲の中だけを書く
+            writer.write(0b10, 2)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            significant = 64 - lead - trail
+            writer.write(0b11, 2)
+            writer.write(lead, 5)
+            writer.write(significant - 1, 6)
+            writer.write(xor >> trail, significant)
+            leading, trailing = lead, trail
+    return writer.getvalue()
+
+
+def decode_values(data, offset, count):
+    reader = BitReader(data, offset)
+    read = reader.read
+    current = read(64)
+    bits = [current]
+    leading, significant = 0, 64
+    for _ in range(count - 1):
+        if read(1):
+            if read(1):
+                leading = read(5)
+                significant = read(6) + 1
+            current ^= read(significant) << (64 - leading - significant)
+        bits.append(current)
+    values = struct.unpack(f">{len(bits)}d", struct.pack(f">{len(bits)}Q", *bits))
+    return [None if value != value else value for value in values]
+
+
+# --- ファイル ---
+
+def archive_file(archive_dir, name):
+    return os.path.join(archive_dir, name + EXTENSION)
+
+
+def list_archives(archive_dir):
+    """アーカイブ済みのパーティション名の一覧（古い順）"""
+    if not archive_dir or not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        entry[:-len(EXTENSION)] for entry in os.listdir(archive_dir)
+        if entry.startswith(history_partitions.PREFIX) and entry.endswith(EXTENSION)
+    )
+
+
+class ArchiveFile:
+    """封印済みのアーカイブファイル（mmap して索引だけを読み込む）"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = HEADER.unpack_from(self.data, 0)
+        index_offset, item_count, self.start, self.end, tail = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        if magic != MAGIC or tail != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a history archive")
+        entries = [INDEX_ENTRY.unpack_from(self.data, index_offset + i * INDEX_ENTRY.size) for i in range(item_count)]
+        self.item_ids = [entry[0] for entry in entries]  # 昇順
+        self.entries = entries
+
+    def entry(self, item_id):
+        position = bisect.bisect_left(self.item_ids, item_id)
+        if position < len(self.item_ids) and self.item_ids[position] == item_id:
+            return self.entries[position]
+        return None
+
+    def read(self, item_id, start=None, end=None):
+        """アイテムの [start, end) の行 [(ts, value), ...]"""
+        entry = self.entry(item_id)
+        if entry is None:
+            return []
+        _, count, first_ts, last_ts, offset, ts_bytes, _ = entry
+        if (start is not None and last_ts < start) or (end is not None and first_ts >= end):
+            return []
+        timestamps = decode_timestamps(self.data, offset, count, end)
+        stop = bisect.bisect_left(timestamps, end) if end is not None else len(timestamps)
+        begin = bisect.bisect_left(timestamps, start) if start is not None else 0
+        values = decode_values(self.data, offset + ts_bytes, stop)
+        return list(zip(timestamps[begin:stop], values[begin:stop]))
+
+    def items(self):
+        """全アイテムの行 {item_id: [(ts, value), ...]}（封印のやり直し用）"""
+        return {item_id: self.read(item_id) for item_id in self.item_ids}
+
+
+# 開いたアーカイブ: パス -> (ファイルの識別 (inode, mtime, サイズ), ArchiveFile)。古い順に CACHE_SIZE 個まで。
+# ファイルが消えた・置き換わったら外す（消したファイルの mmap を持ち続けると、ディスクの領域が返らない）。
+# 外した mmap は、読み出し中のスレッドが使い終わって参照が無くなった時に閉じられる
+CACHE_SIZE = 64
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _identity(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def open_archive(path):
+    identity = _identity(path)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == identity:
+            _cache.move_to_end(path)
+            return cached[1]
+    archive = ArchiveFile(path)
+    with _cache_lock:
+        _cache[path] = (identity, archive)
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return archive
+
+
+def forget(path):
+    """path のアーカイブをキャッシュから外す（削除・置き換えの後に呼ぶ）"""
+    with _cache_lock:
+        _cache.pop(path, None)
+
+
+def forget_stale():
+    """別のプロセスが削除・置き換えたファイルの分をキャッシュから外す"""
+    with _cache_lock:
+        cached = list(_cache.items())
+    for path, (identity, _) in cached:
+        try:
+            current = _identity(path)
+        except FileNotFoundError:
+            current = None
+        if current != identity:
+            forget(path)
+
+
+def read_range(archive_dir, item_id, start=None, end=None, exclude=()):
+    """アーカイブからアイテムの [start, end) の行を時刻順に返す
+
+    exclude: まだ SQLite 側に残っているパーティション名（ファイルを書いてから DROP TABLE をコミットするまでの分を二重に返さない）
+    """
+    forget_stale()
+    rows = []
+    for name in history_partitions.covering(list_archives(archive_dir), start, end):
+        if name in exclude:
+            continue
+        rows.extend(open_archive(archive_file(archive_dir, name)).read(item_id, start, end))
+    return rows
+
+
+def seal_partition(db_path, name, archive_dir, timeout=5.0):
+    """パーティションの全行をアーカイブファイルへ書き出し、パーティションを削除する: (行数, ファイルのバイト数)
+
+    SQLite とは別の接続で主キー順 (item_id, ts) に読むので、アイテムごとにそのまま圧縮できる。
+    イベントループを止めないよう asyncio.to_thread から呼ぶ。
+    読み出しから DROP TABLE までを1つの書き込みトランザクション (BEGIN IMMEDIATE) で行うので、
+    封印している間に届いた行（再送などで期限を過ぎたパーティションに入る行）は DBWriter が待たされ、
+    封印した後に書かれて封印されないまま消えることはない。ロックを取れなければ sqlite3.OperationalError。
+    同じパーティションのファイルが既にあれば（再送で行が後から届いた場合や、前回ファイルを置き換えた後
+    コミットする前に落ちた場合など）、その内容と合わせて書き直す。
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_file(archive_dir, name)
+    start, end = history_partitions.partition_range(name)
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.execute(f"SELECT item_id, ts, value FROM {name} ORDER BY item_id, ts")
+        groups = ((item_id, [(ts, value) for _, ts, value in group])
+                  for item_id, group in itertools.groupby(cursor, key=itemgetter(0)))
+        if os.path.exists(path):
+            merged = open_archive(path).items()
+            for item_id, rows in groups:
+                merged[item_id] = sorted(dict(merged.get(item_id, []) + rows).items())
+            groups = sorted(merged.items())
+
+        tmp_path = path + ".tmp"
+        total = 0
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION))
+            index = []
+            for item_id, rows in groups:
+                if not rows:
+                    continue
+                timestamps = [ts for ts, _ in rows]
+                ts_block = encode_timestamps(timestamps)
+                value_block = encode_values([value for _, value in rows])
+                index.append((item_id, len(rows), timestamps[0], timestamps[-1], f.tell(),
+                              len(ts_block), len(value_block)))
+                f.write(ts_block)
+                f.write(value_block)
+                total += len(rows)
+            index_offset = f.tell()
+            for entry in index:
+                f.write(INDEX_ENTRY.pack(*entry))
+            f.write(FOOTER.pack(index_offset, len(index), start, end, MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, path)
+        forget(path)
+        conn.execute(f"DROP TABLE {name}")
+        conn.execute("COMMIT")
+        return total, size
+    finally:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.close()
+
+
+def drop_expired(archive_dir, cutoff):
+    """期間の終わりが cutoff 以前のアーカイブファイルを削除し、削除した名前を返す"""
+    names = history_partitions.expired(list_archives(archive_dir), cutoff)
+    for name in names:
+        path = archive_file(archive_dir, name)
+        os.remove(path)
+        forget(path)
+    return names
+
+
+def set_aside(archive_dir):
+    """全アーカイブを退避用のディレクトリへ移し、その場所を返す（アーカイブが無ければ None）
+
+    設定の全置き換えで item_id が変わる時に使う。DB のコミットに成功したら discard、
+    失敗したら restore する（コミット前に消してしまうと、失敗した時に戻せない）。
+    """
+    names = list_archives(archive_dir)
+    if not names:
+        return None
+    aside = os.path.join(archive_dir, f".removed-{time.time_ns()}")
+    os.makedirs(aside)
+    for name in names:
+        path = archive_file(archive_dir, name)
+        os.replace(path, archive_file(aside, name))
+        forget(path)
+    return aside
+
+
+def restore(archive_dir, aside):
+    """set_aside で移したアーカイブを元に戻す"""
+    for name in list_archives(aside):
+        os.replace(archive_file(aside, name), archive_file(archive_dir, name))
+    os.rmdir(aside)
+
+
+def discard(aside):
+    """set_aside で移したアーカイブを削除する"""
+    shutil.rmtree(aside, ignore_errors=True)
@@ -0,0 +1,159 @@
+# history の時間パーティション
+# 時系列データは1つの history テーブルではなく、期間ごとのテーブル (history_pYYYYMMDDHH など) に分けて持つ。
+#   - 書き込み: DBWriter が行の時刻からパーティションを決め、無ければ作ってから executemany する
+#   - 読み出し: 時刻の範囲に重なるパーティションだけを読む（クエリルーター）
+#   - 保持期間: 期限を過ぎたパーティションを DROP TABLE するだけ（行単位の DELETE をしない）
+#
+# 時刻 (ts) は UTC の epoch ミリ秒の整数で持つ。比較は整数で済み、夏時間の切り替えでも順序が崩れない。
+# ローカル時刻の文字列にするのは API / 画面へ返す時だけ (local_text)。
+# 各パーティションは (item_id, ts) を主キーにした WITHOUT ROWID テーブルで、主キーの順に行が並ぶ
+# （rowid と別インデックスの二重持ちをしない）。
+#
+# パーティションの幅は config.yaml の system.history_partition (hour / day) で決める（区切りは UTC）。
+# 名前が期間を表すので、パーティションの一覧は sqlite_master から取り出す（管理テーブルは持たない）。
+import calendar
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from src.common.config_loader import config
+
+PREFIX = "history_p"
+HOUR = "hour"
+DAY = "day"
+SPAN_MS = {HOUR: 3600 * 1000, DAY: 86400 * 1000}
+NAME_FORMAT = {HOUR: "%Y%m%d%H", DAY: "%Y%m%d"}
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+LIST_SQL = f"SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB '{PREFIX}[0-9]*' ORDER BY name"
+
+
+def now_ms():
+    """現在時刻 (UTC epoch ミリ秒)"""
+    return int(time.time() * 1000)
+
+
+def epoch_ms_ago(**delta):
+    """現在から遡った時刻 (UTC epoch ミリ秒)。引数は timedelta と同じ"""
+    return int((time.time() - timedelta(**delta).total_seconds()) * 1000)
+
+
+def local_text(ts):
+    """epoch ミリ秒 -> ローカル時刻の文字列 ('YYYY-MM-DD HH:MM:SS')。API / 画面の出口で使う"""
+    return time.strftime(TIMESTAMP_FORMAT, time.localtime(ts // 1000))
+
+
+def from_local_text(text):
+    """ローカル時刻の文字列 -> epoch ミリ秒（旧形式のデータの読み込み用）"""
+    return int(datetime.strptime(text[:19], TIMESTAMP_FORMAT).timestamp() * 1000)
+
+
+@lru_cache(maxsize=256)
+def _name(key, span):
+    return PREFIX + time.strftime(NAME_FORMAT[span], time.gmtime(key * SPAN_MS[span] // 1000))
+
+
+def partition_name(ts, span=None):
+    """epoch ミリ秒の時刻が入るパーティション名"""
+    span = span or config.history_partition
+    return _name(ts // SPAN_MS[span], span)
+
+
+def partition_range(name):
+    """パーティションの期間 (開始, 終了) を epoch ミリ秒で返す（終了は含まない）"""
+    digits = name[len(PREFIX):]
+    span = HOUR if len(digits) == 10 else DAY
+    start = calendar.timegm(time.strptime(digits, NAME_FORMAT[span])) * 1000
+    return start, start + SPAN_MS[span]
+
+
+def create_sql(name):
+    """パーティションを作るSQL（既にあれば何もしない）"""
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {name} (
+            item_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,        -- UTC epoch ミリ秒
+            value REAL,
+            PRIMARY KEY (item_id, ts)
+        ) WITHOUT ROWID""",
+    ]
+
+
+def insert_sql(name):
+    # 同じアイテム・同じミリ秒の行（スピルファイルの再送など）は後から来た方で上書きする
+    return f"INSERT OR REPLACE INTO {name} (item_id, ts, value) VALUES (?, ?, ?)"
+
+
+def covering(names, start=None, end=None):
+    """時刻の範囲 [start, end) に重なるパーティションだけを返す（古い順）"""
+    selected = []
+    for name in names:
+        first, last = partition_range(name)
+        if (start is None or last > start) and (end is None or first < end):
+            selected.append(name)
+    return selected
+
+
+def expired(names, cutoff):
+    """期間の終わりが cutoff 以前のパーティション（丸ごと消してよいもの）"""
+    return [name for name in names if partition_range(name)[1] <= cutoff]
+
+
+def union_sql(names, columns="item_id, ts, value", where=None, params=()):
+    """パーティションを UNION ALL でつないだ SELECT と、そのパラメータを返す
+
+    where / params は各パーティションの SELECT にそれぞれ付ける（主キーを使わせるため）。
+    """
+    if not names:
+        return f"SELECT {columns} FROM (SELECT NULL AS item_id, NULL AS ts, NULL AS value) WHERE 0", []
+    clause = f" WHERE {where}" if where else ""
+    sql = " UNION ALL ".join(f"SELECT {columns} FROM {name}{clause}" for name in names)
+    return sql, list(params) * len(names)
+
+
+async def list_partitions(db):
+    """存在するパーティション名の一覧（古い順）"""
+    cursor = await db.execute(LIST_SQL)
+    return [row[0] for row in await cursor.fetchall()]
+
+
+async def fetch_range(db, item_id, start=None, end=None, columns="ts, value"):
+    """アイテムの [start, end) の履歴を時刻順に返す（範囲に重なるパーティションだけを読む）
+
+    パーティションどうしは期間が重ならないので、古い順に読んでつなげれば時刻順になる。
+    """
+    conditions = "item_id = ?"
+    params = [item_id]
+    if start is not None:
+        conditions += " AND ts >= ?"
+        params.append(start)
+    if end is not None:
+        conditions += " AND ts < ?"
+        params.append(end)
+    rows = []
+    for name in covering(await list_partitions(db), start, end):
+        cursor = await db.execute(f"SELECT {columns} FROM {name} WHERE {conditions} ORDER BY ts ASC", params)
+        rows.extend(await cursor.fetchall())
+    return rows
+
+
+async def fetch_recent(db, item_id, limit, columns="value, ts"):
+    """アイテムの新しい順に limit 件の履歴を返す（新しいパーティションから必要な分だけ読む）"""
+    rows = []
+    for name in reversed(await list_partitions(db)):
+        cursor = await db.execute(
+            f"SELECT {columns} FROM {name} WHERE item_id = ? ORDER BY ts DESC LIMIT ?",
+            (item_id, limit - len(rows))
+        )
+        rows.extend(await cursor.fetchall())
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+async def drop_expired(db, cutoff):
+    """cutoff (epoch ミリ秒) より前に終わるパーティションを削除し、削除した名前を返す"""
+    names = expired(await list_partitions(db), cutoff)
+    for name in names:
+        await db.execute(f"DROP TABLE IF EXISTS {name}")
+    return names
@@ -0,0 +1,177 @@
+# history のロールアップ（1分・1時間ごとの集計）
+# グラフや外部解析で長い期間を取得する時に、生の履歴を全部返さずに済むよう、
+# min / max / avg / first / last / count を 1分 (history_1m) と 1時間 (history_1h) の粒度で持つ。
+#   - 更新: DBWriter が履歴を書くのと同じトランザクションで、バッチ分を集計して UPSERT する（再計算はしない）
+#   - 読み出し: 要求された点数 (max_points) に収まる範囲で、一番細かい粒度を選ぶ（生データ → 1分 → 1時間）
+#   - 保持期間: 1分は rollup_1m_hours（生の履歴より長く残し、保持期間を過ぎた範囲のグラフにも使う）、
+#               1時間はアーカイブ (history_archive) がある間 (archive_days) 残す（1分より短くはしない）
+# avg は後から足し込めるように合計 (value_sum) と件数 (value_count) で持ち、読み出し時に割る。
+# 区間 (bucket) と first_ts / last_ts は history と同じ UTC epoch ミリ秒。
+import asyncio
+
+from src.common import history_archive, history_partitions
+from src.common.config_loader import config
+
+RAW = "raw"
+
+# 粒度 -> (テーブル名, 区間の幅 [ミリ秒])
+RESOLUTIONS = {
+    "1m": ("history_1m", 60 * 1000),
+    "1h": ("history_1h", 3600 * 1000),
+}
+
+# 1回の取得で返す点数の既定値
+DEFAULT_MAX_POINTS = 2000
+
+
+def minute_retention(retention_minutes, rollup_1m_hours):
+    """1分ロールアップを残す期間（分）: rollup_1m_hours と生の履歴の保持期間の長い方"""
+    return max(retention_minutes, rollup_1m_hours * 60)
+
+
+def bucket(ts, resolution):
+    """epoch ミリ秒の時刻が入る集計区間の開始時刻"""
+    width = RESOLUTIONS[resolution][1]
+    return ts - ts % width
+
+
+def create_sql():
+    """ロールアップテーブルを作るSQL（既にあれば何もしない）"""
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {table} (
+            item_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,    -- 集計区間の開始時刻 (UTC epoch ミリ秒)
+            value_min REAL,
+            value_max REAL,
+            value_sum REAL,
+            value_count INTEGER,
+            value_first REAL,
+            first_ts INTEGER,
+            value_last REAL,
+            last_ts INTEGER,
+            PRIMARY KEY (item_id, bucket)
+        ) WITHOUT ROWID"""
+        for table, _ in RESOLUTIONS.values()
+    ]
+
+
+def _upsert_sql(table):
+    # UPDATE の右辺は更新前の値を参照するので、first/last の比較は書き換える前の first_ts/last_ts で行われる
+    return f"""INSERT INTO {table}
+            (item_id, bucket, value_min, value_max, value_sum, value_count, value_first, first_ts, value_last, last_ts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (item_id, bucket) DO UPDATE SET
+            value_min = MIN(value_min, excluded.value_min),
+            value_max = MAX(value_max, excluded.value_max),
+            value_sum = value_sum + excluded.value_sum,
+            value_count = value_count + excluded.value_count,
+            value_first = CASE WHEN excluded.first_ts < first_ts THEN excluded.value_first ELSE value_first END,
+            first_ts = MIN(first_ts, excluded.first_ts),
+            value_last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.value_last ELSE value_last END,
+            last_ts = MAX(last_ts, excluded.last_ts)"""
+
+
+UPSERT_SQL = {table: _upsert_sql(table) for table, _ in RESOLUTIONS.values()}
+
+
+def aggregate(rows):
+    """履歴の行 [(item_id, ts, value), ...] を粒度ごとに集計する
+
+    戻り値: {テーブル名: [UPSERT のパラメータ, ...]}
+    """
+    result = {}
+    for table, width in RESOLUTIONS.values():
+        buckets = {}  # (item_id, bucket) -> [min, max, sum, count, first, first_ts, last, last_ts]
+        for item_id, ts, value in rows:
+            if value is None:
+                continue
+            key = (item_id, ts - ts % width)
+            entry = buckets.get(key)
+            if entry is None:
+                buckets[key] = [value, value, value, 1, value, ts, value, ts]
+                continue
+            if value < entry[0]:
+                entry[0] = value
+            if value > entry[1]:
+                entry[1] = value
+            entry[2] += value
+            entry[3] += 1
+            if ts < entry[5]:
+                entry[4], entry[5] = value, ts
+            if ts >= entry[7]:
+                entry[6], entry[7] = value, ts
+        if buckets:
+            result[table] = [key + tuple(entry) for key, entry in buckets.items()]
+    return result
+
+
+async def choose_resolution(db, item_id, start, max_points):
+    """start 以降を max_points 点以内で返せる一番細かい粒度
+
+    1分ロールアップの行数と件数の合計から、生データと1分粒度の点数を見積もる
+    （1分の集計は生の履歴より長く残るので、生データがアーカイブ側にある範囲もこれで見積もれる）。
+    start が1分の集計の保持期間より前の場合は、1時間の集計で生データの点数を見積もる。
+    どれも収まらなければ1時間粒度を返す。
+    """
+    minutes_kept = minute_retention(config.retention_minutes, config.rollup_1m_hours)
+    if start < history_partitions.epoch_ms_ago(minutes=minutes_kept):
+        cursor = await db.execute(
+            "SELECT TOTAL(value_count) FROM history_1h WHERE item_id = ? AND bucket >= ?",
+            (item_id, bucket(start, "1h"))
+        )
+        raw, = await cursor.fetchone()
+        return RAW if raw <= max_points else "1h"
+
+    cursor = await db.execute(
+        "SELECT COUNT(*), TOTAL(value_count) FROM history_1m WHERE item_id = ? AND bucket >= ?",
+        (item_id, bucket(start, "1m"))
+    )
+    minutes, raw = await cursor.fetchone()
+    if raw <= max_points:
+        return RAW
+    if minutes <= max_points:
+        return "1m"
+    return "1h"
+
+
+async def fetch_history(db, item_id, start, max_points=DEFAULT_MAX_POINTS):
+    """start (epoch ミリ秒) 以降の履歴を、max_points に収まる粒度で返す: (粒度, values)
+
+    生データ    : values = [[時刻, value], ...]
+    ロールアップ: values = [[区間の開始時刻, avg, min, max, first, last, count], ...]
+    どちらも先頭2列が (時刻, 代表値) なので、グラフ側は同じ扱いで描ける。時刻はローカル時刻の文字列。
+    """
+    local_text = history_partitions.local_text
+    resolution = await choose_resolution(db, item_id, start, max_points)
+    if resolution == RAW:
+        rows = await history_partitions.fetch_range(db, item_id, start=start)
+        if config.archive_path:
+            # 保持期間より前の分はアーカイブから読み、SQLite の分の前につなげる
+            live = set(await history_partitions.list_partitions(db))
+            archived = await asyncio.to_thread(
+                history_archive.read_range, config.archive_path, item_id, start, None, live)
+            rows = archived + list(rows)
+        return resolution, [[local_text(ts), value] for ts, value in rows]
+
+    table = RESOLUTIONS[resolution][0]
+    cursor = await db.execute(
+        f"""SELECT bucket, value_sum / value_count, value_min, value_max, value_first, value_last, value_count
+            FROM {table} WHERE item_id = ? AND bucket >= ? ORDER BY bucket ASC""",
+        (item_id, bucket(start, resolution))
+    )
+    return resolution, [[local_text(row[0]), *row[1:]] for row in await cursor.fetchall()]
+
+
+def prune_statements(cutoffs):
+    """粒度ごとの cutoff (epoch ミリ秒) を含む区間より前の集計を削除するSQL: [(テーブル名, sql, params), ...]
+
+    cutoffs: {"1m": cutoff, "1h": cutoff}
+    sql の最後の ? は1回に削除する行数 (LIMIT)。保持期間の処理が少しずつ繰り返し実行する。
+    """
+    return [
+        (table,
+         f"""DELETE FROM {table} WHERE (item_id, bucket) IN
+             (SELECT item_id, bucket FROM {table} WHERE bucket < ? LIMIT ?)""",
+         (bucket(cutoffs[resolution], resolution),))
+        for resolution, (table, _) in RESOLUTIONS.items()
+    ]
@@ -0,0 +1,205 @@
+# 現在値の共有メモリ表 (live values)
+# Web側が現在値を知る手段が items.last_value だけだと、Poller は毎回全アイテムの行を UPDATE することになり、
+# それが書き込みの大半を占める。そこで現在値は mmap したファイル上の固定レイアウトの表で Web側へ渡し、
+# SQLite の items.last_value / updated_at は一定間隔のスナップショットだけにする。
+#
+# ファイル: {live_values.path}（DBへ書き込むプロセス (DBWriter) だけが書き、Web側は読み取り専用で mmap する）
+#   ヘッダ: MAGIC, バージョン, スロット数, 最後に書いた時刻 (epoch ミリ秒), 更新番号 (書くたびに1増える)
+#   スロット: item_id 番目に [ロック番号, 更新番号, 値, 時刻 (epoch ミリ秒), 品質 (items.last_status と同じ), キー]
+#
+# item_id は設定の全置き換え (YAML の上書きインポート) などで別のアイテムに振り直されることがある。
+# スロットにはそのアイテムのキー（ホスト名とタグ名から作る）を持たせ、読む側は自分の知っているアイテムの
+# キーと一致する時だけ値を使う。書く側は設定を読み直すたびにキーを設定し (bind)、キーが変わったスロットは空にする。
+#
+# スロットの読み書きは seqlock で整合を取る:
+#   書く側: ロック番号を奇数にしてから中身を書き、書き終えたら偶数に戻す
+#   読む側: ロック番号が偶数で、中身を読む前後で変わっていなければその内容を使う（変わっていたら読み直す）
+# 書く側は1プロセス・1スレッドだけなので、書く側どうしのロックは不要。
+import mmap
+import os
+import struct
+import time
+import zlib
+
+MAGIC = b"SEGL"
+VERSION = 2
+HEADER = struct.Struct("<4sB3xIqQ")   # magic, version, capacity, updated_ms, sequence
+HEADER_UPDATE = struct.Struct("<qQ")  # updated_ms, sequence
+HEADER_UPDATE_OFFSET = 12
+LOCK = struct.Struct("<Q")
+BODY = struct.Struct("<QdqB3x")       # sequence, value, ts, quality
+KEY = struct.Struct("<I")             # key（BODY の直後。値の書き込みでは触らない）
+ENTRY = struct.Struct("<QdqB3xI")     # BODY + KEY（読む側はまとめて読む）
+SLOT_SIZE = LOCK.size + ENTRY.size
+NO_KEY = 0
+
+# 読む側が書き込み中のスロットに当たった時に読み直す回数。READ_SPINS 回を超えたら、
+# 書く側のプロセスが書き込みの途中で止まっている（CPU を譲られていない）とみなして CPU を譲りながら待つ
+READ_SPINS = 100
+READ_RETRIES = 10000
+
+
+def item_key(host_name, tag_name):
+    """スロットの持ち主を表すキー（0 は「未設定」なので使わない）"""
+    return zlib.crc32(f"{host_name}\0{tag_name}".encode()) or 1
+
+
+class LiveValueTable:
+    """現在値の表（item_id をそのままスロット番号にする）"""
+
+    def __init__(self, path, data, capacity, writable):
+        self.path = path
+        self.data = data
+        self.capacity = capacity
+        self.writable = writable
+        self.inode = os.stat(path).st_ino
+        self.sequence = HEADER.unpack_from(data, 0)[4]
+
+    @classmethod
+    def create(cls, path, capacity):
+        """書く側: ファイルを開く（無い・レイアウトが違う場合は作り直す）
+
+        値は再起動しても残るので、Poller の起動直後も Web側は前回の値を返せる。
+        """
+        size = HEADER.size + capacity * SLOT_SIZE
+        if not cls._compatible(path, capacity, size):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, capacity, 0, 0))
+                f.truncate(size)
+            # Web側が mmap している古いファイルは消さずに置き換える（Web側は inode の変化で開き直す）
+            os.replace(tmp_path, path)
+        with open(path, "r+b") as f:
+            data = mmap.mmap(f.fileno(), size)
+        table = cls(path, data, capacity, writable=True)
+        # 書き込み中に止まったスロットが残っていれば、ロック番号を偶数に戻す
+        for offset in range(HEADER.size, size, SLOT_SIZE):
+            lock, = LOCK.unpack_from(data, offset)
+            if lock & 1:
+                LOCK.pack_into(data, offset, lock + 1)
+        return table
+
+    @classmethod
+    def open(cls, path):
+        """読む側: 読み取り専用で開く。ファイルが無い・形式が違う場合は None"""
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None  # まだ Poller が作っていない（ValueError は空のファイル）
+        magic, version, capacity, _, _ = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION or len(data) < HEADER.size + capacity * SLOT_SIZE:
+            data.close()
+            return None
+        return cls(path, data, capacity, writable=False)
+
+    @staticmethod
+    def _compatible(path, capacity, size):
+        try:
+            with open(path, "rb") as f:
+                magic, version, existing, _, _ = HEADER.unpack(f.read(HEADER.size))
+            return (magic, version, existing) == (MAGIC, VERSION, capacity) and os.path.getsize(path) == size
+        except (OSError, struct.error):
+            return False
+
+    def close(self):
+        self.data.close()
+
+    def replaced(self):
+        """ファイルが作り直されていれば True（読む側は開き直す）"""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    # --- 書く側 ---
+
+    def _write(self, item_id, sequence, value, ts, quality):
+        offset = HEADER.size + item_id * SLOT_SIZE
+        lock, = LOCK.unpack_from(self.data, offset)
+        LOCK.pack_into(self.data, offset, lock + 1)  # 奇数: 書き込み中
+        BODY.pack_into(self.data, offset + LOCK.size, sequence, value, ts, quality)
+        LOCK.pack_into(self.data, offset, lock + 2)
+
+    def publish(self, rows, now_ms):
+        """値を書き込む: rows = [(item_id, value, ts, quality), ...]。スロットに収まらなかった件数を返す
+
+        同じアイテムが複数あれば後の行が残る。値が None の行は NaN として書く。
+        """
+        sequence = self.sequence + 1
+        skipped = 0
+        for item_id, value, ts, quality in rows:
+            if not 0 <= item_id < self.capacity:
+                skipped += 1
+                continue
+            self._write(item_id, sequence, float("nan") if value is None else value, ts, quality)
+        self._commit(sequence, now_ms)
+        return skipped
+
+    def bind(self, keys, now_ms):
+        """スロットにアイテムのキーを設定する: keys = [(item_id, key), ...]。空にしたスロット数を返す
+
+        キーが変わったスロット（別のアイテムに振り直された item_id）は、前の持ち主の値を消して空にする。
+        """
+        cleared = 0
+        sequence = self.sequence + 1
+        for item_id, key in keys:
+            if not 0 <= item_id < self.capacity:
+                continue
+            offset = HEADER.size + item_id * SLOT_SIZE
+            if KEY.unpack_from(self.data, offset + LOCK.size + BODY.size)[0] == key:
+                continue
+            lock, = LOCK.unpack_from(self.data, offset)
+            LOCK.pack_into(self.data, offset, lock + 1)
+            ENTRY.pack_into(self.data, offset + LOCK.size, 0, float("nan"), 0, 0, key)
+            LOCK.pack_into(self.data, offset, lock + 2)
+            cleared += 1
+        if cleared:
+            self._commit(sequence, now_ms)
+        return cleared
+
+    def set_quality(self, item_id, quality, now_ms):
+        """品質だけを書き換える（値と時刻は前回のまま）"""
+        if not 0 <= item_id < self.capacity:
+            return
+        current = self.read(item_id)
+        value, ts = (current[0], current[1]) if current is not None else (None, 0)
+        sequence = self.sequence + 1
+        self._write(item_id, sequence, float("nan") if value is None else value, ts, quality)
+        self._commit(sequence, now_ms)
+
+    def _commit(self, sequence, now_ms):
+        self.sequence = sequence
+        HEADER_UPDATE.pack_into(self.data, HEADER_UPDATE_OFFSET, now_ms, sequence)
+
+    # --- 読む側 ---
+
+    def header(self):
+        """(最後に書いた時刻 [epoch ミリ秒], 更新番号)"""
+        return HEADER_UPDATE.unpack_from(self.data, HEADER_UPDATE_OFFSET)
+
+    def read(self, item_id, key=None):
+        """アイテムの (値, 時刻 [epoch ミリ秒], 品質, 更新番号)。一度も書かれていなければ None
+
+        key を渡した場合、スロットのキーが違えば（別のアイテムの値なら）None
+        """
+        if not 0 <= item_id < self.capacity:
+            return None
+        offset = HEADER.size + item_id * SLOT_SIZE
+        data = self.data
+        for attempt in range(READ_RETRIES):
+            before, = LOCK.unpack_from(data, offset)
+            if not before & 1:
+                sequence, value, ts, quality, slot_key = ENTRY.unpack_from(data, offset + LOCK.size)
+                after, = LOCK.unpack_from(data, offset)
+                if before == after:
+                    break
+            if attempt >= READ_SPINS:
+                time.sleep(0)
+        else:
+            # 書く側が書き込みの途中で終了した（次に起動した時に直す）: 今ある内容を使う
+            sequence, value, ts, quality, slot_key = ENTRY.unpack_from(data, offset + LOCK.size)
+        if not sequence or (key is not None and slot_key != key):
+            return None
+        return (None if value != value else value), ts, quality, sequence
@@ -0,0 +1,108 @@
+# 履歴の圧縮 (Deadband / Swinging Door)
+# 値が少しでも変わるたびに history へ書くと、ノイズの乗ったアナログ信号は毎サイクル1行になる。
+# アイテムごとの設定に従い、SQLiteへ渡す前に「残す点」だけを選ぶ。
+#
+#   deadband       : 許容誤差。deadband_type = 'absolute' なら値そのもの、'percent' なら
+#                    直前に残した値の絶対値に対する割合(%)
+#   swinging_door  : 0 = 直前に残した値から許容誤差を超えて動いた時だけ残す (Deadband)
+#                    1 = Swinging Door Trending。残した点どうしを直線で結んだ時、途中の
+#                        実測値がすべて許容誤差以内に収まるように点を選ぶ
+#   max_interval   : この秒数以上残していなければ、変化が無くても残す (Heartbeat)。0 = 無効
+#
+# deadband = 0 かつ swinging_door = 0 の場合は従来どおり「値が変わった時だけ」残す。
+DEADBAND_ABSOLUTE = "absolute"
+DEADBAND_PERCENT = "percent"
+
+
+class ItemCompressor:
+    """1アイテム分の圧縮状態"""
+    __slots__ = ("deadband", "percent", "swinging_door", "max_interval",
+                 "archived", "held", "slope_low", "slope_high")
+
+    def __init__(self, deadband=0.0, deadband_type=DEADBAND_ABSOLUTE, swinging_door=False, max_interval=0):
+        self.deadband = deadband or 0.0
+        self.percent = deadband_type == DEADBAND_PERCENT
+        self.swinging_door = bool(swinging_door)
+        self.max_interval = max_interval or 0
+        self.archived = None   # 最後に残した点 (t, value)
+        self.held = None       # Swinging Door: まだ残すか決まっていない直近の点 (t, value, timestamp)
+        self.slope_low = None
+        self.slope_high = None
+
+    @staticmethod
+    def settings_of(row):
+        """比較用: アイテム行の圧縮設定"""
+        return (row.get("deadband"), row.get("deadband_type"), row.get("swinging_door"), row.get("max_interval"))
+
+    @classmethod
+    def from_row(cls, row):
+        deadband, deadband_type, swinging_door, max_interval = cls.settings_of(row)
+        return cls(deadband, deadband_type or DEADBAND_ABSOLUTE, swinging_door, max_interval)
+
+    def seed(self, t, value):
+        """前回までに残した値（DBの last_value）を起点にする"""
+        if value is not None:
+            self.archived = (t, value)
+
+    def tolerance(self, base):
+        if self.percent:
+            return abs(base) * self.deadband / 100.0
+        return self.deadband
+
+    def offer(self, t, value, timestamp):
+        """新しい収集値を渡す
+
+        戻り値: (先に残すべき過去の点 [(value, timestamp)], 今回の値を残すか)
+        """
+        if self.archived is None:
+            return self._archive(t, value)
+
+        at, av = self.archived
+        if self.max_interval and t - at >= self.max_interval:
+            # Heartbeat: 保留中の点があればそれも残してから、今回の値を残す
+            points = [(self.held[1], self.held[2])] if self.held else []
+            self._archive(t, value)
+            return points, True
+
+        if not self.swinging_door:
+            tolerance = self.tolerance(av)
+            if abs(value - av) > tolerance or (tolerance == 0 and value != av):
+                return self._archive(t, value)
+            return [], False
+
+        return self._swing(t, value, timestamp)
+
+    def _archive(self, t, value):
+        self.archived = (t, value)
+        self.held = None
+        self.slope_low = self.slope_high = None
+        return [], True
+
+    def _swing(self, t, value, timestamp):
+        at, av = self.archived
+        dt = t - at
+        if dt <= 0:
+            return [], False
+
+        # 起点から今回の点へ引いた直線が、これまでの点すべての許容誤差内を通るか
+        slope = (value - av) / dt
+        if self.slope_high is None or self.slope_low <= slope <= self.slope_high:
+            # まだ扉の内側: 今回の点を保留し、今回の点の許容誤差で扉を狭める
+            tolerance = self.tolerance(av)
+            high = (value + tolerance - av) / dt
+            low = (value - tolerance - av) / dt
+            if self.slope_high is not None:
+                high = min(high, self.slope_high)
+                low = max(low, self.slope_low)
+            self.slope_low, self.slope_high = low, high
+            self.held = (t, value, timestamp)
+            return [], False
+
+        # 扉が閉じた: 保留していた点を残し、そこから扉を開き直す
+        ht, hv, hts = self.held
+        self.archived = (ht, hv)
+        tolerance = self.tolerance(hv)
+        self.slope_high = (value + tolerance - hv) / (t - ht)
+        self.slope_low = (value - tolerance - hv) / (t - ht)
+        self.held = (t, value, timestamp)
+        return [(hv, hts)], False
@@ -0,0 +1,96 @@
+# ブロック読み出し結果の一括デコード
+# アイテムごとに データ型 (data_type)・ワード順 (word_order)・スケール/オフセット を持ち、
+# 1ブロック分のレジスタをまとめて値へ変換する。
+#
+# ブロックごとに一度だけ「デコーダ」を組み立てておき、サイクルごとの処理は
+#   1. operator.itemgetter でアイテムが使うワードを必要な順に並べ替えて取り出す
+#   2. struct.pack でビッグエンディアンのバイト列にする
+#   3. ブロック全体を表す1つの struct.Struct で unpack する
+#   4. スケール/オフセットが設定されたアイテムだけ後処理する
+# の4ステップで済ませる（アイテムごとの型分岐をサイクル中に行わない）。
+# float32 の値は unpack した値のまま記録する。1.1 が 1.100000023841858 と見えないよう丸めるのは表示時だけ (format_value)。
+import operator
+import struct
+
+# データ型 -> (struct のフォーマット文字, ワード数)
+DATA_TYPES = {
+    "uint16": ("H", 1),
+    "int16": ("h", 1),
+    "uint32": ("I", 2),
+    "int32": ("i", 2),
+    "float32": ("f", 2),
+    "uint64": ("Q", 4),
+    "int64": ("q", 4),
+    "float64": ("d", 4),
+}
+DEFAULT_DATA_TYPE = "uint16"
+
+# ワード順: big = 上位ワードが先 (ABCD, Modbusの標準)、little = 下位ワードが先 (CDAB)
+WORD_ORDER_BIG = "big"
+WORD_ORDER_LITTLE = "little"
+
+BIT_TYPES = ("coil", "discrete")
+
+FLOAT32 = struct.Struct("<f")
+FLOAT32_MAX = 3.4028234663852886e38
+
+
+def word_count(data_type, reg_type=None):
+    """アイテムが占めるワード（コイルならビット）数"""
+    if reg_type in BIT_TYPES:
+        return 1
+    return DATA_TYPES.get(data_type or DEFAULT_DATA_TYPE, DATA_TYPES[DEFAULT_DATA_TYPE])[1]
+
+
+class BlockDecoder:
+    """1ブロック分のデコード手順（読み出し計画を作った時に一度だけ組み立てる）"""
+    __slots__ = ("gather", "pack", "unpack", "scaled")
+
+    def __init__(self, block):
+        indexes = []
+        codes = []
+        self.scaled = []  # [(アイテムの位置, scale, offset), ...] 後処理が必要なものだけ
+        bits = block.reg_type in BIT_TYPES
+
+        for position, item in enumerate(block.items):
+            first = item.address - block.start
+            words = list(range(first, first + item.count))
+            if item.word_order == WORD_ORDER_LITTLE:
+                words.reverse()
+            indexes.extend(words)
+            codes.append("H" if bits else DATA_TYPES[item.data_type][0])
+            if item.scale != 1 or item.offset != 0:
+                self.scaled.append((position, item.scale, item.offset))
+
+        # itemgetter は要素が1つだとタプルでなく値を返すので、常にタプルになるよう揃える
+        getter = operator.itemgetter(*indexes)
+        self.gather = getter if len(indexes) > 1 else (lambda registers: (getter(registers),))
+        self.pack = struct.Struct(f">{len(indexes)}H").pack
+        self.unpack = struct.Struct(">" + "".join(codes)).unpack
+
+    def decode(self, registers):
+        """レジスタ（またはビット）のリストから、block.items と同じ順の値のリストを返す"""
+        values = self.unpack(self.pack(*self.gather(registers)))
+        if not self.scaled:
+            return values
+        values = list(values)
+        for position, scale, offset in self.scaled:
+            values[position] = values[position] * scale + offset
+        return values
+
+
+def format_value(value):
+    """画面に表示する値の文字列
+
+    float32 で表せる値は、float32 として同じ値に戻る最短の桁数で表す（1.100000023841858 -> 1.1）。
+    """
+    if value is None:
+        return "--"
+    if isinstance(value, float) and value == value and abs(value) <= FLOAT32_MAX:
+        single = FLOAT32.pack(value)
+        if FLOAT32.unpack(single)[0] == value:
+            for digits in range(1, 10):
+                text = f"{value:.{digits}g}"
+                if FLOAT32.pack(float(text)) == single:
+                    return repr(float(text))
+    return str(value)
@@ -0,0 +1,62 @@
+# ホストごとの接続状態管理 (Connection state machine)
+# docs/collection_logic.md 「5. エラーハンドリング」の通信エラー側の扱い。
+#
+#   Connecting --接続・読み出し成功--> Online <--一部のブロックだけ失敗--> Degraded
+#       ^  |                             |
+#       |  +--連続失敗が offline_after 回--+--切断--> Connecting
+#       |                                            |
+#       +---------- 待ち時間後に1回だけ試す <-- Offline (サーキットブレーカー開)
+#
+# 再接続の待ち時間は指数バックオフに揺らぎ (jitter) を加える。ネットワークの瞬断で
+# 全PLCが同時に切れても、再接続が同じ瞬間に集中しないようにするため。
+import random
+
+CONNECTING = "Connecting"
+ONLINE = "Online"
+DEGRADED = "Degraded"
+OFFLINE = "Offline"
+
+
+class HostLink:
+    """1ホスト分の接続状態と再接続のタイミング"""
+
+    def __init__(self, base_delay=1, max_delay=60, offline_after=3, rng=random):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.offline_after = offline_after
+        self.rng = rng
+        self.state = CONNECTING
+        self.failures = 0      # 連続失敗回数
+        self.retry_at = None   # 次に接続を試してよい時刻 (monotonic)
+
+    def next_delay(self):
+        """次に接続を試すまでの秒数 (Equal jitter: 待ち時間の半分から全部の間でばらつかせる)"""
+        delay = min(self.max_delay, self.base_delay * 2 ** max(0, self.failures - 1))
+        return self.rng.uniform(delay / 2, delay)
+
+    def _set(self, state):
+        """状態を変え、変わった場合は True を返す（DBへ書くのは変化した時だけ）"""
+        changed = state != self.state
+        self.state = state
+        return changed
+
+    def wait_seconds(self, now):
+        """接続を試すまでに待つ秒数"""
+        if self.retry_at is None:
+            # 起動直後の接続も少しずつずらす
+            return self.rng.uniform(0, self.base_delay)
+        return max(0.0, self.retry_at - now)
+
+    def failed(self, now):
+        """接続できなかった / 接続が切れた"""
+        self.failures += 1
+        self.retry_at = now + self.next_delay()
+        # 失敗が続いたらサーキットを開き、以後は待ち時間ごとに1回だけ試す
+        if self.failures >= self.offline_after:
+            return self._set(OFFLINE)
+        return self._set(CONNECTING)
+
+    def succeeded(self, degraded=False):
+        """接続して読み出しまで行えた（degraded: 一部のブロックが通信エラー）"""
+        self.failures = 0
+        return self._set(DEGRADED if degraded else ONLINE)
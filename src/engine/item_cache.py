@@ -0,0 +1,109 @@
+# アイテム設定キャッシュ (Config Watcher)
+# items テーブルを毎サイクル SELECT する代わりに、ホストごとのアイテム表・稼働中のホスト一覧・
+# トリガー設定をメモリに保持し、設定が変わった時だけ読み直す。
+#
+# 変更検知は2段階:
+#   1. PRAGMA data_version  … 他の接続がコミットした時だけ値が変わる（問い合わせはDBヘッダの参照のみ）
+#   2. config_meta.config_version … items/hosts/triggers の設定列が変わった時だけトリガーで加算される
+#      （Pollerが書く last_value / status の更新では加算されない）
+import aiosqlite
+
+
+class HostItemTable:
+    """1ホスト分のアイテム設定（item_id -> 行の dict）"""
+    __slots__ = ("host_id", "rows", "version")
+
+    def __init__(self, host_id):
+        self.host_id = host_id
+        self.rows = {}
+        self.version = 0  # このホストのアイテム構成が変わるたびに加算
+
+    def items(self):
+        return list(self.rows.values())
+
+
+class ItemConfigCache:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.db = None
+        self.tables = {}            # host_id -> HostItemTable
+        self.hosts = {}             # host_id -> 稼働中 (is_active = 1) のホスト行の dict
+        self.triggers = []          # triggers テーブルの行の dict
+        self.data_version = None
+        self.config_version = None
+        self.reloads = 0
+
+    async def open(self):
+        self.db = await aiosqlite.connect(self.db_path)
+        self.db.row_factory = aiosqlite.Row
+        await self.refresh()
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+    def identity_of(self, item):
+        """item_id とは別に、アイテムの実体（どのホストのどのタグ・アドレスか）を表すキー
+
+        上書きインポートでは item_id が別のアイテムに振り直されることがあるため、
+        item_id ごとに持つ状態（圧縮・トリガー判定）はこのキーが変わったら作り直す。
+        """
+        host = self.hosts.get(item["host_id"])
+        host_name = host["display_name"] if host else None
+        return (host_name, item["tag_name"], item["address"])
+
+    def get(self, host_id):
+        table = self.tables.get(host_id)
+        if table is None:
+            table = self.tables[host_id] = HostItemTable(host_id)
+        return table
+
+    async def refresh(self):
+        """設定が変わっていれば読み直す。読み直した場合は True"""
+        cursor = await self.db.execute("PRAGMA data_version")
+        data_version = (await cursor.fetchone())[0]
+        if data_version == self.data_version:
+            return False
+        self.data_version = data_version
+
+        cursor = await self.db.execute("SELECT value FROM config_meta WHERE key = 'config_version'")
+        row = await cursor.fetchone()
+        config_version = row[0] if row else None
+        if config_version is not None and config_version == self.config_version:
+            return False
+
+        await self.reload()
+        self.config_version = config_version
+        return True
+
+    async def reload(self):
+        cursor = await self.db.execute("SELECT * FROM hosts WHERE is_active = 1 ORDER BY id")
+        self.hosts = {row["id"]: dict(row) for row in await cursor.fetchall()}
+
+        cursor = await self.db.execute("SELECT * FROM triggers ORDER BY item_id, id")
+        self.triggers = [dict(row) for row in await cursor.fetchall()]
+
+        cursor = await self.db.execute("SELECT * FROM items ORDER BY host_id, id")
+        grouped = {}
+        for row in await cursor.fetchall():
+            grouped.setdefault(row["host_id"], {})[row["id"]] = dict(row)
+
+        # 変更のあったホストだけバージョンを上げる（読み出し計画の再計算を最小限にする）
+        for host_id in set(grouped) | set(self.tables):
+            rows = grouped.get(host_id, {})
+            table = self.get(host_id)
+            if self._config_of(table.rows) != self._config_of(rows):
+                table.rows = rows
+                table.version += 1
+            else:
+                table.rows = rows
+        self.reloads += 1
+
+    @staticmethod
+    def _config_of(rows):
+        """比較用: 収集値 (last_value / updated_at) を除いた設定内容"""
+        return {
+            item_id: tuple(v for k, v in row.items() if k not in ("last_value", "updated_at"))
+            for item_id, row in rows.items()
+        }
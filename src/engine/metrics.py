@@ -0,0 +1,287 @@
+# Poller の実行時メトリクス (Prometheus テキスト形式)
+# 収集ループの中で記録するので、記録側は「属性の加算」と「bisect 1回」だけで済むようにする。
+#   - ラベル付きの系列 (child) は labels() で一度取り出して保持し、ループ中は辞書を引かない
+#   - 文字列への整形はスクレイプ時 (render) にだけ行う
+# 外部ライブラリ (prometheus_client) には依存しない。
+#
+# 公開: config.yaml の metrics セクションに従い、Poller プロセスがローカルの HTTP (またはUnixソケット)
+# で /metrics を返す。--workers 指定時はスーパーバイザーが port、ワーカー i が port + 1 + i を使う。
+import asyncio
+import bisect
+import os
+
+from src.common.config_loader import config
+
+# 秒単位のヒストグラムの既定の境界（Modbus応答時間・サイクル時間・コミット時間）
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 1サイクルあたりのリクエスト数
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+class Counter:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None  # スクレイプ時に値を取る関数（他のオブジェクトが数えている場合）
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self, name, labels):
+        yield name + "_total", labels, self.function() if self.function is not None else self.value
+
+
+class Gauge:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None  # スクレイプ時に値を取る関数（キューの長さなど）
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self, name, labels):
+        yield name, labels, self.function() if self.function is not None else self.value
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最後は +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        # le (以下) の累積は render 時に計算する
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield name + "_bucket", labels + (("le", _format_value(bound)),), cumulative
+        cumulative += self.counts[-1]
+        yield name + "_bucket", labels + (("le", "+Inf"),), cumulative
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, cumulative
+
+
+class MetricFamily:
+    """名前・種類・ラベル名が同じ系列の集まり"""
+
+    def __init__(self, kind, name, help_text, label_names=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self.children = {}  # ラベル値のタプル -> Counter / Gauge / Histogram
+
+    def labels(self, *values):
+        """ラベル値に対応する系列を返す（無ければ作る）。ループの外で取り出して保持すること"""
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            if self.kind == "counter":
+                child = Counter()
+            elif self.kind == "gauge":
+                child = Gauge()
+            else:
+                child = Histogram(self.buckets)
+            self.children[key] = child
+        return child
+
+    def remove(self, **labels):
+        """指定したラベル値を含む系列を捨てる（削除されたホストなど）"""
+        positions = [(self.label_names.index(name), str(value))
+                     for name, value in labels.items() if name in self.label_names]
+        if not positions:
+            return
+        for key in [key for key in self.children if all(key[i] == value for i, value in positions)]:
+            del self.children[key]
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for key, child in list(self.children.items()):
+            labels = tuple(zip(self.label_names, key))
+            for name, sample_labels, value in child.samples(self.name, labels):
+                lines.append(f"{name}{_format_labels(sample_labels)} {_format_value(value)}")
+
+
+class Registry:
+    def __init__(self):
+        self.families = []
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def counter(self, name, help_text, label_names=()):
+        return self._add(MetricFamily("counter", name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._add(MetricFamily("gauge", name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=SECONDS_BUCKETS):
+        return self._add(MetricFamily("histogram", name, help_text, label_names, tuple(buckets)))
+
+    def remove(self, **labels):
+        for family in self.families:
+            family.remove(**labels)
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+# --- Poller が記録するメトリクス ---
+REGISTRY = Registry()
+
+MODBUS_REQUEST_SECONDS = REGISTRY.histogram(
+    "seg_modbus_request_duration_seconds", "Modbus request round-trip time", ("host",))
+MODBUS_REQUESTS = REGISTRY.counter(
+    "seg_modbus_requests", "Modbus read requests sent", ("host",))
+MODBUS_REQUESTS_PER_CYCLE = REGISTRY.histogram(
+    "seg_modbus_requests_per_cycle", "Modbus read requests per polling cycle", ("host",), buckets=COUNT_BUCKETS)
+MODBUS_FAILURES = REGISTRY.counter(
+    "seg_modbus_failures", "Failed Modbus operations (kind: connect, comm, exception)", ("host", "kind"))
+CYCLE_SECONDS = REGISTRY.histogram(
+    "seg_cycle_duration_seconds", "Time spent in one polling cycle", ("host",))
+CYCLE_OVERRUNS = REGISTRY.counter(
+    "seg_cycle_overruns", "Polling cycles that finished after their deadline", ("host",))
+ITEMS_WRITTEN = REGISTRY.counter(
+    "seg_items_written", "Item values handed to the DB writer", ("host",))
+HISTORY_ROWS = REGISTRY.counter(
+    "seg_history_rows", "History rows handed to the DB writer after compression", ("host",))
+WRITER_QUEUE_DEPTH = REGISTRY.gauge(
+    "seg_writer_queue_depth", "Messages waiting in the DB writer queue")
+WRITER_COMMIT_SECONDS = REGISTRY.histogram(
+    "seg_writer_commit_duration_seconds", "Time to write and commit one batch")
+WRITER_ROWS = REGISTRY.counter(
+    "seg_writer_rows", "Rows committed by the DB writer", ("table",))
+WRITER_ERRORS = REGISTRY.counter(
+    "seg_writer_errors", "Batches rolled back by the DB writer")
+WRITER_BUFFER_ROWS = REGISTRY.gauge(
+    "seg_writer_buffer_rows", "Rows waiting in the in-memory write buffer")
+WRITER_SPILL_BYTES = REGISTRY.gauge(
+    "seg_writer_spill_bytes", "Bytes in the spill file not yet written to the database")
+WRITER_SPILLED_ROWS = REGISTRY.counter(
+    "seg_writer_spilled_rows", "Rows moved to the spill file while the database was unavailable")
+WRITER_DROPPED_ROWS = REGISTRY.counter(
+    "seg_writer_dropped_rows", "Rows dropped because the write buffer was full with no spill file, or the database rejected them")
+RETENTION_ROWS = REGISTRY.counter(
+    "seg_retention_rows_pruned", "Rows deleted by the retention task", ("table",))
+RETENTION_PARTITIONS = REGISTRY.counter(
+    "seg_retention_partitions_dropped", "History partitions dropped by the retention task")
+RETENTION_FREED_PAGES = REGISTRY.counter(
+    "seg_retention_freed_pages", "Database pages returned to the file system by incremental vacuum")
+RETENTION_ARCHIVED_ROWS = REGISTRY.counter(
+    "seg_retention_archived_rows", "History rows sealed into archive files before their partition was dropped")
+RETENTION_ARCHIVED_BYTES = REGISTRY.counter(
+    "seg_retention_archived_bytes", "Bytes written to history archive files")
+RETENTION_SECONDS = REGISTRY.histogram(
+    "seg_retention_duration_seconds", "Time spent in one retention run")
+
+
+class HostMetrics:
+    """1ホスト分の系列をまとめて保持する（収集ループから辞書を引かずに記録するため）"""
+    __slots__ = ("host", "request_seconds", "requests", "requests_per_cycle",
+                 "connect_failures", "comm_failures", "exception_failures",
+                 "cycle_seconds", "overruns", "items_written", "history_rows")
+
+    def __init__(self, host):
+        self.host = host
+        self.request_seconds = MODBUS_REQUEST_SECONDS.labels(host)
+        self.requests = MODBUS_REQUESTS.labels(host)
+        self.requests_per_cycle = MODBUS_REQUESTS_PER_CYCLE.labels(host)
+        self.connect_failures = MODBUS_FAILURES.labels(host, "connect")
+        self.comm_failures = MODBUS_FAILURES.labels(host, "comm")
+        self.exception_failures = MODBUS_FAILURES.labels(host, "exception")
+        self.cycle_seconds = CYCLE_SECONDS.labels(host)
+        self.overruns = CYCLE_OVERRUNS.labels(host)
+        self.items_written = ITEMS_WRITTEN.labels(host)
+        self.history_rows = HISTORY_ROWS.labels(host)
+
+    def remove(self):
+        REGISTRY.remove(host=self.host)
+
+
+# --- 公開用のエンドポイント ---
+
+async def _handle(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # ヘッダは使わない
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] in (b"/metrics", b"/"):
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(slot=0):
+    """config.yaml の metrics 設定に従ってエンドポイントを開く（無効・失敗時は None）
+
+    slot: --workers 指定時のプロセス番号（0 = スーパーバイザー / 単一プロセス、i + 1 = ワーカー i）
+    """
+    if not config.metrics_enabled:
+        return None
+    try:
+        if config.metrics_unix_socket:
+            path = config.metrics_unix_socket if slot == 0 else f"{config.metrics_unix_socket}.{slot}"
+            if os.path.exists(path):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(_handle, path)
+            print(f"INFO: Metrics available on unix socket {path}")
+        else:
+            # port: 0 なら空いているポートを使う（負荷試験など）
+            port = config.metrics_port + slot if config.metrics_port else 0
+            server = await asyncio.start_server(_handle, config.metrics_host, port)
+            port = server.sockets[0].getsockname()[1]
+            print(f"INFO: Metrics available at http://{config.metrics_host}:{port}/metrics")
+    except OSError as e:
+        # メトリクスが開けなくても収集は止めない
+        print(f"WARNING: Metrics endpoint could not be opened: {e}")
+        return None
+    return server
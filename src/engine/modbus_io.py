@@ -0,0 +1,278 @@
+# Modbus読み出しの通信層
+# 読み出し計画 (ReadBlock) を実際のリクエストへ変換する。ホストごとに次のどちらかを使う。
+#   - ModbusReader          : pymodbus の AsyncModbusTcpClient（1リクエストずつ応答を待つ直列モード）
+#   - PipelinedModbusReader : Modbus TCP のトランザクションIDを使い、1接続に最大 window 個の
+#                             リクエストを同時に流すパイプラインモード
+# pymodbus 3.x のクライアントは内部ロックで1リクエストずつ処理するため、
+# パイプラインモードはMBAPフレームを直接扱う軽量な実装にしている。
+import asyncio
+import struct
+import time
+
+from pymodbus.client import AsyncModbusTcpClient
+
+# 読み出し種別 -> ファンクションコード
+FUNCTION_CODES = {
+    "coil": 1,
+    "discrete": 2,
+    "holding": 3,
+    "input": 4,
+}
+
+
+# パイプライン中だけ失敗する（直列で読み直すと成功する）ことがこの回数続いたら、直列モードへ切り替える
+PIPELINE_FALLBACK_FAILURES = 3
+# 直列モードへ切り替えてから、もう一度パイプラインを試すまでの秒数
+PIPELINE_PROBE_SECONDS = 300
+
+
+# 要求したアドレス・点数そのものが不正であることを示す例外コード（段階的切り分けの対象）
+# これ以外（0x04 機器異常, 0x06 ビジー, 0x0A/0x0B ゲートウェイ異常など）はアドレスと関係なく起きるので、
+# 切り分けずに通信エラーとして扱う
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+ADDRESS_EXCEPTION_CODES = (ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE)
+
+
+class ModbusReadError(Exception):
+    """機器が例外応答を返した（不正アドレス等）。通信自体は成立している"""
+
+    def __init__(self, exception_code):
+        super().__init__(f"Modbus exception response (code={exception_code})")
+        self.exception_code = exception_code
+
+    @property
+    def address_error(self):
+        """不正アドレス・不正な点数による例外応答か"""
+        return self.exception_code in ADDRESS_EXCEPTION_CODES
+
+
+def _reraise_if_cancelled():
+    # pymodbus はキャンセルを ModbusIOException に変換するので、停止要求は握りつぶさない
+    task = asyncio.current_task()
+    if task is not None and task.cancelling():
+        raise asyncio.CancelledError
+
+
+class ModbusReader:
+    """直列モード: pymodbus クライアントで1ブロックずつ読み出す"""
+
+    def __init__(self, host, port, unit_id=1, timeout=2.0):
+        self.unit_id = unit_id
+        # 再接続の間隔は Poller 側 (host_state.HostLink) で管理するので、pymodbus の自動再接続は切る
+        self.client = AsyncModbusTcpClient(host, port=port, timeout=timeout, reconnect_delay=0)
+        self.requests = 0
+        self.window = 1
+        self.latency = None  # 応答時間を記録するヒストグラム (metrics.HostMetrics.request_seconds)
+
+    @property
+    def connected(self):
+        return self.client.connected
+
+    async def connect(self):
+        return await self.client.connect()
+
+    def close(self):
+        self.client.close()
+
+    async def read(self, block):
+        if block.reg_type == "input":
+            method = self.client.read_input_registers
+        elif block.reg_type == "coil":
+            method = self.client.read_coils
+        elif block.reg_type == "discrete":
+            method = self.client.read_discrete_inputs
+        else:
+            method = self.client.read_holding_registers
+
+        self.requests += 1
+        started = time.perf_counter()
+        try:
+            response = await method(block.start, count=block.count, device_id=self.unit_id)
+        except Exception:
+            _reraise_if_cancelled()
+            raise
+        if self.latency is not None:
+            self.latency.observe(time.perf_counter() - started)
+        if response.isError():
+            raise ModbusReadError(getattr(response, "exception_code", 0))
+        if block.reg_type in ("coil", "discrete"):
+            return [int(bit) for bit in response.bits[:block.count]]
+        return response.registers
+
+    async def read_blocks(self, blocks):
+        """[(block, 値のリスト または 例外), ...] を返す"""
+        results = []
+        for block in blocks:
+            try:
+                results.append((block, await self.read(block)))
+            except Exception as e:
+                results.append((block, e))
+        return results
+
+
+class PipelinedModbusReader:
+    """パイプラインモード: 1つのTCP接続に最大 window 個のリクエストを同時に流す
+
+    応答はトランザクションIDで要求と突き合わせるので、順不同で返ってきても良い。
+    パイプライン中にタイムアウトや切断が起きたブロックは直列で再試行する。直列なら成功する失敗が
+    fallback_failures 回続いた機器は「パイプライン非対応」とみなして直列 (window=1) で読み出し、
+    probe_seconds 後にもう一度パイプラインを試す（一時的なタイムアウトで直列のままにしない）。
+    """
+
+    MBAP = struct.Struct(">HHHB")         # transaction id, protocol id, length, unit id
+    REQUEST = struct.Struct(">HHHBBHH")   # MBAP + function code, address, count
+
+    def __init__(self, host, port, unit_id=1, window=8, timeout=2.0,
+                 fallback_failures=PIPELINE_FALLBACK_FAILURES, probe_seconds=PIPELINE_PROBE_SECONDS):
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.timeout = timeout
+        self.requests = 0
+        self.fallbacks = 0
+        self.max_window = max(1, window)
+        self.fallback_failures = fallback_failures
+        self.probe_seconds = probe_seconds
+        self.pipeline_failures = 0  # パイプライン中だけ失敗したサイクルの連続回数
+        self.probe_at = None        # 直列モード中: パイプラインを試し直す時刻 (monotonic)
+        self.latency = None  # 応答時間を記録するヒストグラム (metrics.HostMetrics.request_seconds)
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._pending = {}  # tid -> (future, function_code, count)
+        self._next_tid = 0
+        self._set_window(window)
+
+    def _set_window(self, window):
+        self.window = max(1, window)
+        self._slots = asyncio.Semaphore(self.window)
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        self._receiver = asyncio.create_task(self._receive_loop())
+        return True
+
+    def close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending(ConnectionError("connection closed"))
+
+    def _fail_pending(self, exc):
+        for future, _, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+
+    async def _receive_loop(self):
+        try:
+            while True:
+                tid, _, length, _ = self.MBAP.unpack(await self._reader.readexactly(self.MBAP.size))
+                pdu = await self._reader.readexactly(length - 1)
+                # 取り除くのは read() 側（解析に失敗した時も _fail_pending でこの要求を失敗させられるように残す）
+                entry = self._pending.get(tid)
+                if entry is None:
+                    continue  # タイムアウト済みリクエストへの遅れた応答
+                future, function_code, count = entry
+                if future.done():
+                    continue
+                if pdu[0] & 0x80:
+                    future.set_exception(ModbusReadError(pdu[1]))
+                elif pdu[0] != function_code:
+                    future.set_exception(ConnectionError(f"unexpected function code {pdu[0]}"))
+                elif function_code in (3, 4):
+                    future.set_result(list(struct.unpack_from(f">{pdu[1] // 2}H", pdu, 2)))
+                else:
+                    data = pdu[2:2 + pdu[1]]
+                    future.set_result([(data[i >> 3] >> (i & 7)) & 1 for i in range(count)])
+        except (asyncio.IncompleteReadError, OSError) as e:
+            self._abort(ConnectionError(f"connection lost: {e}"))
+        except (IndexError, struct.error, ValueError) as e:
+            # 長さの合わない MBAP・PDU。以後のフレームの区切りも信用できないので接続ごと捨てる
+            self._abort(ConnectionError(f"malformed response: {e!r}"))
+
+    def _abort(self, exc):
+        """受信できなくなった: 応答待ちのリクエストをすべて失敗させ、接続を閉じる"""
+        self._fail_pending(exc)
+        if self._writer is not None:
+            self._writer.close()
+
+    async def read(self, block):
+        function_code = FUNCTION_CODES.get(block.reg_type, 3)
+        async with self._slots:
+            if not self.connected:
+                raise ConnectionError("not connected")
+            self._next_tid = self._next_tid + 1 if self._next_tid < 0xFFFF else 1
+            tid = self._next_tid
+            future = asyncio.get_running_loop().create_future()
+            self._pending[tid] = (future, function_code, block.count)
+            self.requests += 1
+            started = time.perf_counter()
+            self._writer.write(self.REQUEST.pack(tid, 0, 6, self.unit_id, function_code, block.start, block.count))
+            try:
+                values = await asyncio.wait_for(future, self.timeout)
+            except ModbusReadError:
+                if self.latency is not None:
+                    self.latency.observe(time.perf_counter() - started)
+                raise
+            finally:
+                self._pending.pop(tid, None)
+            if self.latency is not None:
+                self.latency.observe(time.perf_counter() - started)
+            return values
+
+    async def _read_or_error(self, block):
+        try:
+            return await self.read(block)
+        except (ModbusReadError, ConnectionError, asyncio.TimeoutError) as e:
+            return e
+
+    async def read_blocks(self, blocks):
+        """[(block, 値のリスト または 例外), ...] を返す（順序は blocks と同じ）"""
+        if self.probe_at is not None and time.monotonic() >= self.probe_at:
+            print(f"INFO: {self.host}:{self.port} でパイプライン (window={self.max_window}) を再度試します")
+            self.probe_at = None
+            self._set_window(self.max_window)
+
+        values = await asyncio.gather(*(self._read_or_error(block) for block in blocks))
+
+        if self.window > 1 and len(blocks) > 1:
+            failed = [i for i, v in enumerate(values) if isinstance(v, (ConnectionError, asyncio.TimeoutError))]
+            if not failed:
+                self.pipeline_failures = 0
+            else:
+                # パイプライン非対応の機器かどうか、直列で再試行して確かめる
+                if not self.connected:
+                    self.close()
+                    await self.connect()
+                retried = [await self._read_or_error(blocks[i]) for i in failed]
+                if not any(isinstance(v, (ConnectionError, asyncio.TimeoutError)) for v in retried):
+                    self.pipeline_failures += 1
+                    if self.pipeline_failures >= self.fallback_failures:
+                        self._fall_back()
+                # 直列でも失敗した場合は通信自体の問題なので、連続回数は変えない
+                for i, v in zip(failed, retried):
+                    values[i] = v
+
+        return list(zip(blocks, values))
+
+    def _fall_back(self):
+        print(f"WARNING: {self.host}:{self.port} はパイプライン要求に {self.pipeline_failures} 回続けて応答できなかったため、"
+              f"{self.probe_seconds} 秒間直列モードで読み出します")
+        self._set_window(1)
+        self.fallbacks += 1
+        self.pipeline_failures = 0
+        self.probe_at = time.monotonic() + self.probe_seconds
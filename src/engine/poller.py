@@ -1,204 +1,494 @@
+import argparse
 import asyncio
 import aiosqlite
-from pymodbus.client import AsyncModbusTcpClient
 from datetime import datetime
 import logging
+import time
 
 from pymodbus.logging import Log
 Log.setLevel(logging.CRITICAL)
 
 from src.common.config_loader import config
+from src.common.live_values import item_key
+from src.engine.compression import ItemCompressor
+from src.engine.host_state import CONNECTING, HostLink
+from src.engine.item_cache import ItemConfigCache
+from src.engine.metrics import HostMetrics, start_metrics_server
+from src.engine.modbus_io import ModbusReader, ModbusReadError, PipelinedModbusReader
+from src.engine.read_planner import PlanItem, ReadBlock, build_read_plan
+from src.engine.recovery import Quarantine, STATUS_ADDRESS_ERROR, STATUS_OK, step_down
+from src.engine.scheduler import CycleTimer, IntervalScheduler
+from src.engine.supervisor import PollerSupervisor
+from src.engine.triggers import STATUS_PROBLEM, TriggerDefinition, TriggerEngine, legacy_key
+from src.engine.retention import RetentionWorker
+from src.engine.writer import DBWriter
 
 # DBパスをconfigから取得
 DB_PATH = config.db_path
 
+def now_str():
+    """DBへ書き込むローカル時刻文字列 (DATETIME('now', 'localtime') と同じ形式)"""
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# 読み出しリクエスト数の統計をコンソールへ出す間隔(秒)
+STATS_REPORT_INTERVAL = 60
+
 class ModbusPoller:
-    def __init__(self):
+    def __init__(self, writer=None, host_filter=None, metrics_slot=0):
+        """writer / host_filter / metrics_slot は --workers 指定時にワーカープロセスから渡される
+
+        writer: 書き込み要求の送り先（省略時はこのプロセスで DBWriter を動かす）
+        host_filter: host_id を受け取り、このプロセスの担当なら True を返す関数
+        metrics_slot: メトリクスのエンドポイント番号（ポート番号のずらし幅）
+        """
         self.running = True
+        self.host_filter = host_filter
+        self.metrics_slot = metrics_slot
+        # host_id -> {"requests": 今回のリクエスト数, "naive": 1アイテム1リクエスト時の数, ...}
+        self.read_stats = {}
+        # 全ホスト共通のインターバル・マネージャー
+        self.scheduler = IntervalScheduler(base_interval=config.polling_interval)
+        # host_id -> HostLink（接続状態と再接続のタイミング）
+        self.host_links = {}
+        # host_id -> CycleTimer（サイクル時間・ジッタ・オーバーランの統計を持つ）
+        self.cycle_timers = {}
+        # DB書き込みはすべてこの1タスクに集約する
+        self.writer = writer or DBWriter(
+            DB_PATH,
+            max_batch=config.writer_max_batch,
+            max_latency=config.writer_max_latency,
+            buffer_max_rows=config.writer_buffer_max_rows,
+            spill_path=config.writer_spill_path,
+            live_path=config.live_values_path,
+            live_capacity=config.live_values_capacity,
+            snapshot_interval=config.live_values_snapshot_interval,
+        )
+        # アイテム設定はメモリに保持し、設定変更時だけ読み直す
+        self.item_cache = ItemConfigCache(DB_PATH)
+        # host_id -> Quarantine（不正アドレスとして一時除外中のアイテム）
+        self.quarantines = {}
+        self.quarantine_items = {}  # item_id -> PlanItem（個別再試行用）
+        # item_id -> (アイテムの実体, 圧縮設定, ItemCompressor)（履歴に残す点を選ぶ。書き込み待ちのDBより新しい状態を持つ）
+        self.compressors = {}
+        # 全アイテムのトリガー判定状態 (docs/TriggerSpec.md)
+        self.triggers = TriggerEngine()
+        # host_id -> (poll_host タスク, 起動時の接続設定)
+        self.host_tasks = {}
+        self.hosts_warned = False
 
-    async def update_host_status(self, host_id, status):
-        """ホストのOnline/Offline状態をDBに書き込む"""
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
-                "UPDATE hosts SET status = ?, updated_at = datetime('now', 'localtime') WHERE id = ?",
-                (status, host_id)
-            )
-            await db.commit()
-
-    async def fetch_hosts(self):
-        async with aiosqlite.connect(DB_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute("SELECT * FROM hosts WHERE is_active = 1")
-            return await cursor.fetchall()
-
-    async def fetch_target_items(self, host_id, active_ids):
-        """収集周期に達した、または現在アラート中のアイテムを取得"""
-        async with aiosqlite.connect(DB_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            # SQLのIN句用にIDリストを文字列化 (空の場合は存在しないID -1 を指定)
-            ids_str = ",".join(map(str, active_ids)) if active_ids else "-1"
-            
-            query = f"""
-                SELECT * FROM items 
-                WHERE host_id = ? 
-            """
-            cursor = await db.execute(query, (host_id,))
-            return await cursor.fetchall()
-
-    async def read_modbus_value(self, client, address):
-        try:
-            response = await client.read_holding_registers(address, count=1)
-            if response.isError():
-                return None
-            return response.registers[0]
-        except Exception:
-            return None
+    def update_host_status(self, host_id, status):
+        """ホストのOnline/Offline状態を書き込みキューへ送る"""
+        self.writer.submit_host_status(host_id, status, now_str())
+
+    def host_state_changed(self, host_id, host_name, link, changed):
+        """接続状態が変わった時だけ hosts.status を更新する"""
+        if changed:
+            self.update_host_status(host_id, link.state)
+            print(f"INFO: {host_name} - {link.state} (連続失敗: {link.failures})")
+
+    def trigger_definitions(self):
+        """triggers テーブルと items.alarm_threshold（従来のアラート）から判定対象を作る"""
+        definitions = []
+        items = {item_id: item for table in self.item_cache.tables.values() for item_id, item in table.rows.items()}
+        for row in self.item_cache.triggers:
+            item = items.get(row['item_id'])
+            identity = self.item_cache.identity_of(item) if item is not None else None
+            try:
+                definitions.append(TriggerDefinition.from_row(row, identity))
+            except ValueError:
+                print(f"WARNING: Trigger {row['id']} ({row['name']}) の演算子が不正なため無視します")
+        for item in items.values():
+            if item['alarm_enabled'] == 1 and item['alarm_threshold'] is not None:
+                definitions.append(TriggerDefinition.from_item(item, self.item_cache.identity_of(item)))
+        return definitions
+
+    def reload_triggers(self):
+        """トリガー設定を読み直す。設定から消えた発生中のトリガーは復旧として閉じる"""
+        removed = self.triggers.load(self.trigger_definitions())
+        timestamp = now_str()
+        self.writer.submit_events([("close", (timestamp, d.item_id, d.trigger_id)) for d in removed])
+
+    async def restore_alarms(self, host_id):
+        """event_logs の継続中イベントから、そのホストのトリガー状態を復元する"""
+        cursor = await self.item_cache.db.execute(
+            """SELECT e.item_id, e.trigger_id
+               FROM event_logs e JOIN items i ON e.item_id = i.id
+               WHERE e.status = 'active' AND i.host_id = ?""",
+            (host_id,)
+        )
+        self.triggers.restore([
+            trigger_id if trigger_id is not None else legacy_key(item_id)
+            for item_id, trigger_id in await cursor.fetchall()
+        ])
+
+    def evaluate_triggers(self, host_name, rows, fresh):
+        """1サイクル分の収集値をまとめて判定し、状態変化を一括で書き込みキューへ送る"""
+        events = []
+        for status, definition, value, timestamp in self.triggers.evaluate(fresh):
+            item = rows.get(definition.item_id)
+            tag_name = item['tag_name'] if item else definition.item_id
+            label = tag_name if definition.trigger_id is None else f"{tag_name} [{definition.name}]"
+            if status == STATUS_PROBLEM:
+                events.append(("open", (definition.item_id, definition.trigger_id, timestamp, value, definition.cond_thr)))
+                print(f"⚠️ ALARM START: {label}")
+            else:
+                events.append(("close", (timestamp, definition.item_id, definition.trigger_id)))
+                print(f"✅ ALARM RESOLVED: {label}")
+        self.writer.submit_events(events)
+
+    def bind_live_values(self):
+        """担当ホストのアイテムを現在値の表のスロットに対応付ける
+
+        item_id が別のアイテムに振り直されていれば (上書きインポートなど)、前のアイテムの値は消える。
+        """
+        hosts = self.assigned_hosts()
+        self.writer.submit_item_keys([
+            (item_id, item_key(host['display_name'], item['tag_name']))
+            for host_id, host in hosts.items()
+            for item_id, item in self.item_cache.get(host_id).rows.items()
+        ])
+
+    def assigned_hosts(self):
+        """このプロセスが収集を担当する稼働中ホスト (host_id -> ホスト行)"""
+        hosts = self.item_cache.hosts
+        if self.host_filter is not None:
+            hosts = {host_id: h for host_id, h in hosts.items() if self.host_filter(host_id)}
+        return hosts
+
+    @staticmethod
+    def connection_config(host_config):
+        """接続方法に関わる設定（変わったら poll_host を起動し直す）"""
+        return tuple(host_config.get(key) for key in
+                     ("ip_address", "port", "unit_id", "pipeline_window", "timeout"))
+
+    async def reconcile_hosts(self):
+        """稼働中の hosts 行と動いている poll_host タスクの差分を取り、タスクを起動/停止する"""
+        desired = self.assigned_hosts()
+
+        stale = []
+        for host_id, (task, conn) in list(self.host_tasks.items()):
+            host_config = desired.get(host_id)
+            if host_config is None or task.done() or self.connection_config(host_config) != conn:
+                del self.host_tasks[host_id]
+                task.cancel()
+                stale.append(task)
+                if host_config is None:
+                    if host_id in self.item_cache.hosts:
+                        print(f"INFO: Host {host_id} は他のワーカーの担当になったため収集を終了します")
+                    else:
+                        print(f"INFO: Host {host_id} は削除/停止されたため収集を終了します")
+        # 接続のクローズ (poll_host の finally) を待ってから起動し直す
+        if stale:
+            await asyncio.gather(*stale, return_exceptions=True)
+
+        for host_id, host_config in desired.items():
+            if host_id not in self.host_tasks:
+                task = asyncio.create_task(self.poll_host(host_config), name=f"poll_host-{host_id}")
+                self.host_tasks[host_id] = (task, self.connection_config(host_config))
+                print(f"INFO: {host_config['display_name']} の収集を開始します")
+
+        if not self.host_tasks and self.hosts_warned is False:
+            print("WARNING: No active hosts found. Waiting for hosts to be added.")
+        self.hosts_warned = not self.host_tasks
+
+    async def watch_config(self):
+        """設定変更を監視し、アイテムキャッシュの読み直しとホストの増減を反映する (Config Watcher)"""
+        while self.running:
+            try:
+                if await self.item_cache.refresh():
+                    print(f"INFO: Item configuration reloaded (version {self.item_cache.config_version})")
+                    self.reload_triggers()
+                    self.bind_live_values()
+                # 担当の割り当て (--workers) が変わった場合やタスクの異常終了にも追従するため毎回突き合わせる
+                await self.reconcile_hosts()
+            except Exception as e:
+                if asyncio.current_task().cancelling():
+                    raise asyncio.CancelledError
+                print(f"CONFIG WATCH ERROR: {e}")
+            await asyncio.sleep(config.polling_interval)
+
+    def compressor_for(self, item, now):
+        """アイテムの圧縮状態を返す（設定か、item_id の指すアイテムが変わっていれば作り直す）"""
+        identity = self.item_cache.identity_of(item)
+        settings = ItemCompressor.settings_of(item)
+        entry = self.compressors.get(item['id'])
+        if entry is None or entry[:2] != (identity, settings):
+            compressor = ItemCompressor.from_row(item)
+            # 前回記録した値を起点にする（再起動直後に同じ値を記録し直さない）
+            compressor.seed(now, item['last_value'])
+            entry = self.compressors[item['id']] = (identity, settings, compressor)
+        return entry[2]
+
+    def compile_read_plan(self, items):
+        """items の行から Bulk Read の読み出し計画を作る"""
+        plan_items = [PlanItem.from_row(item) for item in items]
+        return build_read_plan(
+            plan_items,
+            max_gap=config.polling_max_gap,
+            max_count=config.polling_max_block_size,
+        )
+
+    def create_reader(self, host_config):
+        """ホスト設定に応じて直列/パイプラインの読み出し方式を選ぶ"""
+        keys = host_config.keys()
+        window = (host_config['pipeline_window'] if 'pipeline_window' in keys else None) or 1
+        timeout = (host_config['timeout'] if 'timeout' in keys else None) or config.polling_timeout
+        unit_id = host_config['unit_id'] or 1
+        if window > 1:
+            return PipelinedModbusReader(host_config['ip_address'], host_config['port'], unit_id, window=window, timeout=timeout)
+        return ModbusReader(host_config['ip_address'], host_config['port'], unit_id, timeout=timeout)
+
+    async def read_with_recovery(self, client, host_name, blocks, quarantine, metrics):
+        """ブロックを読み出し、例外応答のブロックは段階的切り分けで救済する
+
+        戻り値: (読み出せた [(block, values), ...], 通信エラーで失敗したブロック数)
+        """
+        succeeded = []
+        comm_errors = 0
+        now = time.monotonic()
+
+        # 再試行時刻に達した除外アイテムは1つずつ読み直す
+        retry_blocks = [
+            ReadBlock.from_items([plan_item])
+            for item_id in quarantine.due(now)
+            if (plan_item := self.quarantine_items.get(item_id)) is not None
+        ]
+
+        # パイプラインモードのホストでは、ここで複数ブロックが同時に送信される
+        for block, values in await client.read_blocks(blocks + retry_blocks):
+            is_retry = block in retry_blocks
+            if not isinstance(values, Exception):
+                succeeded.append((block, values))
+                if is_retry:
+                    item_id = block.items[0].item_id
+                    quarantine.release(item_id)
+                    self.writer.submit_item_status(item_id, STATUS_OK)
+                    print(f"INFO: {host_name} - Address {block.start} が復旧したため除外を解除しました")
+                continue
+
+            if not (isinstance(values, ModbusReadError) and values.address_error):
+                # タイムアウト・切断や、ビジー・機器異常などアドレスと関係の無い例外応答は切り分けない
+                # （通信エラーとして数え、続けば HostLink がバックオフ・切断にする）
+                print(f"DEBUG: {host_name} の {block} の読み出しに失敗しました: {values}")
+                comm_errors += 1
+                metrics.comm_failures.inc()
+                continue
+
+            metrics.exception_failures.inc()
+
+            recovered, bad_items = await step_down(client, block) if not is_retry else ([], block.items)
+            succeeded.extend(recovered)
+            for plan_item in bad_items:
+                failures = quarantine.add(plan_item.item_id, now)
+                self.quarantine_items[plan_item.item_id] = plan_item
+                if failures == 1:
+                    self.writer.submit_item_status(plan_item.item_id, STATUS_ADDRESS_ERROR)
+                    print(f"WARNING: {host_name} - Address {plan_item.address} ({plan_item.reg_type}) を不正アドレスとして一時除外します")
+
+        return succeeded, comm_errors
+
+    def record_read_stats(self, host_name, host_id, requests, naive, timer):
+        """1サイクルのリクエスト数を記録し、一定間隔でサイクル統計と一緒にコンソールへ報告する"""
+        stats = self.read_stats.setdefault(host_id, {"cycles": 0, "total_requests": 0, "total_naive": 0, "reported_at": 0})
+        stats["requests"] = requests
+        stats["naive"] = naive
+        stats["cycles"] += 1
+        stats["total_requests"] += requests
+        stats["total_naive"] += naive
+
+        now = time.monotonic()
+        if now - stats["reported_at"] >= STATS_REPORT_INTERVAL:
+            stats["reported_at"] = now
+            print(f"INFO: {host_name} - {requests} requests/cycle (naive: {naive}, cycles: {stats['cycles']}), "
+                  f"cycle avg {timer.stats()['avg_duration'] * 1000:.1f}ms / max {timer.max_duration * 1000:.1f}ms, "
+                  f"jitter {timer.jitter * 1000:.1f}ms, overruns {timer.overruns}")
 
     async def poll_host(self, host_config):
         host_id = host_config['id']
         host_name = host_config['display_name']
-        active_alarms = {} 
-        last_host_status = None 
+        table = self.item_cache.get(host_id)
+        quarantine = self.quarantines[host_id] = Quarantine(
+            base_delay=config.polling_quarantine_retry,
+            max_delay=config.polling_quarantine_retry_max,
+        )
+
+        timer = self.cycle_timers[host_id] = CycleTimer(config.polling_interval, config.polling_overrun_policy)
+        link = self.host_links[host_id] = HostLink(
+            base_delay=config.polling_reconnect_delay,
+            max_delay=config.polling_reconnect_delay_max,
+            offline_after=config.polling_offline_after,
+        )
+        self.update_host_status(host_id, CONNECTING)
+        metrics = HostMetrics(host_name)
+
+        client = self.create_reader(host_config)
+        client.latency = metrics.request_seconds
+        try:
+            await self.restore_alarms(host_id)
+            await self._poll_loop(host_id, host_name, client, timer, table, quarantine, link, metrics)
+        finally:
+            # 削除・設定変更・停止のいずれでも接続を閉じ、スケジュールを片付ける
+            client.close()
+            self.scheduler.remove(host_id)
+            self.cycle_timers.pop(host_id, None)
+            self.host_links.pop(host_id, None)
+            self.quarantines.pop(host_id, None)
+            if host_id not in self.assigned_hosts():
+                # 担当を外れたホストの状態は、引き継いだ側が event_logs から復元する
+                self.triggers.forget(table.rows)
+                metrics.remove()
 
-        client = AsyncModbusTcpClient(host_config['ip_address'], port=host_config['port'])
+    async def _poll_loop(self, host_id, host_name, client, timer, table, quarantine, link, metrics):
+        status_cleared = set()
+        plan = []
+        plan_version = None
 
         while self.running:
-            try:
-                if not client.connected:
+            if not client.connected:
+                # 再接続はバックオフ（揺らぎ付き）の待ち時間が過ぎてから1回だけ試す
+                # （接続断の間はサイクルを刻まないので、ジッタ・オーバーランにも数えない）
+                await asyncio.sleep(link.wait_seconds(time.monotonic()))
+                try:
                     connected = await client.connect()
-                else:
-                    connected = True
-
+                except Exception as e:
+                    if asyncio.current_task().cancelling():
+                        raise asyncio.CancelledError
+                    print(f"SYSTEM ERROR: {e}")
+                    connected = False
                 if not connected:
-                    print(f"DEBUG: {host_name} への接続に失敗しています")
-                    await asyncio.sleep(5)
+                    metrics.connect_failures.inc()
+                    self.host_state_changed(host_id, host_name, link, link.failed(time.monotonic()))
                     continue
-                
-                # --- デバッグポイント1: アイテムが取得できているか ---
-                items = await self.fetch_target_items(host_id, list(active_alarms.keys()))
+                timer.resync()
+
+            timer.start()
+            read_counts = None  # 今回のサイクルの (リクエスト数, 個別に読んだ場合のリクエスト数)
+            try:
+                # アイテム構成か一時除外リストが変わった時だけ読み出し計画を作り直す
+                if (table.version, quarantine.version) != plan_version:
+                    rows = table.rows
+                    quarantine.retain(rows)
+                    plan = self.compile_read_plan([item for item in rows.values() if item['id'] not in quarantine])
+                    plan_version = (table.version, quarantine.version)
+                    self.scheduler.load(host_id, plan, tick=timer.tick)
+                rows = table.rows
 
                 poll_results = [] # 今回の更新分を溜めるリスト
+                fresh = []        # トリガー判定に渡す今回の収集値
+                recorded = 0      # poll_results のうち history に残す行数
+                timestamp = now_str()
+                now = time.time()
+                ts = int(now * 1000)  # history に書く時刻 (UTC epoch ミリ秒)
 
-                for item in items:
-                    item_id = item['id']
-                    # --- デバッグポイント2: 実際に読み出しが行われているか ---
-                    val = await self.read_modbus_value(client, item['address'])
-                    # print(f"DEBUG: 読み出し実行 - Tag: {item['tag_name']}, Address: {item['address']}, Value: {val}")
-                    
-                    if val is not None:
-                        # await self.update_item_value(item_id, val)
-                        # 後の履歴判定のために前回値(last_value)も一緒にリストへ
-                        poll_results.append((item['id'], val, item['last_value']))
-
-                        # アラート判定
-                        threshold = item['alarm_threshold']
-                        enabled = item['alarm_enabled']
-                        is_currently_alarm = (enabled == 1 and val >= threshold)
-
-                        if is_currently_alarm and item_id not in active_alarms:
-                            event_id = await self.create_event_log(item_id, val, threshold)
-                            active_alarms[item_id] = event_id
-                            print(f"⚠️ ALARM START: {item['tag_name']}")
-                        elif not is_currently_alarm and item_id in active_alarms:
-                            old_event_id = active_alarms.pop(item_id)
-                            await self.close_event_log(old_event_id)
-                            print(f"✅ ALARM RESOLVED: {item['tag_name']}")
-                    else:
-                        print(f"DEBUG: {item['tag_name']} の読み出しが None です")
+                # 今回のチックで収集周期に達したブロックだけを読み出す
+                # (オーバーランで飛ばしたチックの分は compress 設定ならここでまとめて返る)
+                due_blocks = self.scheduler.due(host_id, timer.tick, catch_up=timer.catch_up)
+
+                # --- デバッグポイント2: 実際に読み出しが行われているか ---
+                requests_before = client.requests
+                succeeded, comm_errors = await self.read_with_recovery(client, host_name, due_blocks, quarantine, metrics)
+                if comm_errors and not succeeded:
+                    # 応答が1つも無い: 接続断として扱い、バックオフ後に接続し直す
+                    client.close()
+                    self.host_state_changed(host_id, host_name, link, link.failed(time.monotonic()))
+                elif due_blocks:
+                    self.host_state_changed(host_id, host_name, link, link.succeeded(degraded=comm_errors > 0))
+
+                for block, registers in succeeded:
+                    # print(f"DEBUG: 読み出し実行 - {block}, Values: {registers}")
+                    for plan_item, val in block.decode(registers):
+                        item_id = plan_item.item_id
+                        item = rows.get(item_id)
+                        if item is None:
+                            continue  # 計画の再計算前に削除されたアイテム
+                        if item.get('last_status') and item_id not in status_cleared:
+                            # 前回起動時などに不正アドレスと記録されたアイテムが読めるようになった
+                            status_cleared.add(item_id)
+                            self.writer.submit_item_status(item_id, STATUS_OK)
+
+                        # 履歴へ残すかはアイテムごとの圧縮設定 (Deadband / Swinging Door) で決める
+                        held, record = self.compressor_for(item, now).offer(now, val, ts)
+                        for held_value, held_ts in held:
+                            poll_results.append((item_id, held_value, held_ts, True))
+                        poll_results.append((item_id, val, ts, record))
+                        recorded += len(held) + record
+
+                        fresh.append((item_id, val, timestamp))
+
+                # アラート判定（1サイクル分まとめて）
+                self.evaluate_triggers(host_name, rows, fresh)
+
+                requests = client.requests - requests_before
+                read_counts = (requests, sum(len(b.items) for b in due_blocks))
+                if due_blocks:
+                    metrics.requests.inc(requests)
+                    metrics.requests_per_cycle.observe(requests)
+                metrics.items_written.inc(len(poll_results))
+                metrics.history_rows.inc(recorded)
 
-                # 1台分のループが終わったら「一括」でDBに書き込む
-                await self.update_items_bulk(poll_results)
+                # 1台分のループが終わったら「一括」で書き込みタスクへ渡す（コミットは全ホスト分まとめて行われる）
+                self.writer.submit_values(poll_results)
                 # print(f"DEBUG: {host_name} - {len(poll_results)}件を更新しました")                
 
             except Exception as e:
+                if asyncio.current_task().cancelling():
+                    raise asyncio.CancelledError
                 print(f"SYSTEM ERROR: {e}")
                 client.close()
-            
-            await asyncio.sleep(1)
-
-
-    async def create_event_log(self, item_id, val, threshold):
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                """INSERT INTO event_logs (item_id, start_time, trigger_value, threshold_value, status) 
-                   VALUES (?, DATETIME('now', 'localtime'), ?, ?, 'active')""",
-                (item_id, val, threshold)
-            )
-            event_id = cursor.lastrowid
-            await db.commit()
-            return event_id
-
-    async def close_event_log(self, event_id):
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
-                """UPDATE event_logs 
-                   SET end_time = DATETIME('now', 'localtime'), status = 'resolved' 
-                   WHERE id = ? AND status = 'active'""",
-                (event_id,)
-            )
-            await db.commit()
+                self.host_state_changed(host_id, host_name, link, link.failed(time.monotonic()))
+
+            # 固定 sleep ではなく、次の期限 (monotonic) まで待つ
+            overruns = timer.overruns
+            delay = timer.finish()
+            metrics.cycle_seconds.observe(timer.last_duration)
+            if timer.overruns != overruns:
+                metrics.overruns.inc()
+            if read_counts is not None:
+                # サイクル時間は finish() で確定するので、今回のサイクル分を含めてから報告する
+                self.record_read_stats(host_name, host_id, *read_counts, timer)
+            await asyncio.sleep(delay)
+
 
     async def run(self):
-        hosts = await self.fetch_hosts()
-        if not hosts:
-            print("WARNING: No active hosts found.")
-            return
-            
-        tasks = [self.poll_host(h) for h in hosts]
-        await asyncio.gather(*tasks)
-
-    async def update_item_value(self, item_id, new_value):
-        async with aiosqlite.connect(DB_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # 1. DBから現在の値(前回保存された値)を取得
-            cursor = await db.execute("SELECT last_value FROM items WHERE id = ?", (item_id,))
-            row = await cursor.fetchone()
-            
-            # 前回値と異なる場合のみ履歴(history)に保存
-            if row is None or row["last_value"] != new_value:
-                # 履歴テーブルへ挿入
-                await db.execute(
-                    "INSERT INTO history (item_id, value) VALUES (?, ?)",
-                    (item_id, new_value)
-                )
-                # print(f"DEBUG: Value changed. History saved for Item ID {item_id}: {new_value}")
-
-            # 最新値の更新（これは変化に関わらず、時刻を更新するために毎回行うのが一般的）
-            await db.execute(
-                "UPDATE items SET last_value = ?, updated_at = DATETIME('now', 'localtime') WHERE id = ?",
-                (new_value, item_id)
-            )
-            await db.commit()
-
-    async def update_items_bulk(self, results):
-        """
-        results: [(item_id, val, old_val), ...] のリスト
-        """
-        if not results:
-            return
-
-        async with aiosqlite.connect(DB_PATH) as db:
-            # 高速化のための設定
-            await db.execute("PRAGMA journal_mode=WAL") # WALモードを有効化
-            await db.execute("PRAGMA synchronous=NORMAL")
-
-            for item_id, new_value, old_value in results:
-                # 値が変化した時のみ履歴へ
-                if old_value != new_value:
-                    await db.execute(
-                        "INSERT INTO history (item_id, value) VALUES (?, ?)",
-                        (item_id, new_value)
-                    )
-                # 最新値の更新
-                await db.execute(
-                    "UPDATE items SET last_value = ?, updated_at = DATETIME('now', 'localtime') WHERE id = ?",
-                    (new_value, item_id)
-                )
-            await db.commit()
+        await self.item_cache.open()
+        self.reload_triggers()
+        self.bind_live_values()
+        metrics_server = await start_metrics_server(self.metrics_slot)
+        writer_task = asyncio.create_task(self.writer.run())
+        # 保持期間の処理は DB に書き込むプロセスで1つだけ動かす（ワーカーはスーパーバイザーに任せる）
+        retention_task = None
+        if isinstance(self.writer, DBWriter):
+            retention_task = asyncio.create_task(RetentionWorker.from_config(self.writer.db_path).run())
+        try:
+            # ホストの追加・削除は watch_config が随時反映する（ホストが0台でも終了しない）
+            await self.watch_config()
+        finally:
+            tasks = [task for task, _ in self.host_tasks.values()]
+            if retention_task is not None:
+                tasks.append(retention_task)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.host_tasks.clear()
+            await self.writer.stop()
+            await writer_task
+            await self.item_cache.close()
+            if metrics_server is not None:
+                metrics_server.close()
+
 
 def main():
-    poller = ModbusPoller()
+    parser = argparse.ArgumentParser(description="Modbus data collection engine")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="number of worker processes to shard hosts across (default: 1, single process)",
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        poller = PollerSupervisor(args.workers)
+    else:
+        poller = ModbusPoller()
     try:
         asyncio.run(poller.run())
     except KeyboardInterrupt:
@@ -0,0 +1,145 @@
+# Bulk Read 読み出し計画(Read Plan)コンパイラ
+# docs/collection_logic.md 「3. 具体的なグルーピング・ロジック」の実装。
+# items の行を 周期 > ホスト > 種別 > アドレス の順で並べ、
+# MAX_GAP 以内のアドレスを1つのブロック読み出しにまとめる。
+from src.engine.decoder import DATA_TYPES, DEFAULT_DATA_TYPE, WORD_ORDER_BIG, BlockDecoder, word_count
+
+# Modbus仕様上、1リクエストで読める最大数 (ファンクションコード別)
+MODBUS_MAX_COUNT = {
+    "holding": 125,   # FC3 Read Holding Registers
+    "input": 125,     # FC4 Read Input Registers
+    "coil": 2000,     # FC1 Read Coils
+    "discrete": 2000, # FC2 Read Discrete Inputs
+}
+
+DEFAULT_REG_TYPE = "holding"
+
+
+class PlanItem:
+    """読み出し計画上の1アイテム（DBの行から必要な情報だけを抜き出したもの）"""
+    __slots__ = ("item_id", "host_id", "address", "count", "reg_type", "interval", "row",
+                 "data_type", "word_order", "scale", "offset")
+
+    def __init__(self, item_id, host_id, address, count=1, reg_type=DEFAULT_REG_TYPE, interval=1, row=None,
+                 data_type=DEFAULT_DATA_TYPE, word_order=WORD_ORDER_BIG, scale=1.0, offset=0.0):
+        self.item_id = item_id
+        self.host_id = host_id
+        self.address = address
+        self.count = count
+        self.reg_type = reg_type
+        self.interval = interval
+        self.row = row
+        self.data_type = data_type
+        self.word_order = word_order
+        self.scale = scale
+        self.offset = offset
+
+    @classmethod
+    def from_row(cls, row):
+        """items テーブルの行 (aiosqlite.Row / dict) から生成する"""
+        keys = row.keys()
+
+        def get(key, default):
+            value = row[key] if key in keys else None
+            return default if value is None or value == "" else value
+
+        reg_type = get("reg_type", DEFAULT_REG_TYPE)
+        data_type = get("data_type", DEFAULT_DATA_TYPE)
+        if data_type not in DATA_TYPES:
+            data_type = DEFAULT_DATA_TYPE
+        return cls(
+            item_id=row["id"],
+            host_id=row["host_id"],
+            address=row["address"],
+            count=word_count(data_type, reg_type),
+            reg_type=reg_type,
+            interval=row["polling_interval"] or 1,
+            row=row,
+            data_type=data_type,
+            word_order=get("word_order", WORD_ORDER_BIG),
+            scale=get("scale", 1.0),
+            offset=get("value_offset", 0.0),
+        )
+
+
+class ReadBlock:
+    """1回のModbusリクエストで読み出す連続アドレス範囲"""
+    __slots__ = ("host_id", "reg_type", "interval", "start", "count", "items", "_decoder")
+
+    def __init__(self, host_id, reg_type, interval, start):
+        self.host_id = host_id
+        self.reg_type = reg_type
+        self.interval = interval
+        self.start = start
+        self.count = 0
+        self.items = []  # PlanItem のリスト（アドレス順）
+        self._decoder = None
+
+    @property
+    def end(self):
+        """ブロックの終端アドレス（この値自体は含まない）"""
+        return self.start + self.count
+
+    @classmethod
+    def from_items(cls, items):
+        """同一ホスト・同一種別のアイテム群を1ブロックにまとめる（段階的切り分け用）"""
+        items = sorted(items, key=lambda item: item.address)
+        first = items[0]
+        block = cls(first.host_id, first.reg_type, first.interval, first.address)
+        for item in items:
+            block.add(item)
+        return block
+
+    def add(self, item):
+        self.items.append(item)
+        self.count = max(self.end, item.address + item.count) - self.start
+        self._decoder = None
+
+    def decode(self, registers):
+        """ブロック読み出し結果を、アイテムごとのデータ型・スケールに従って一括変換する
+
+        戻り値: [(PlanItem, value), ...]
+        """
+        if self._decoder is None:
+            self._decoder = BlockDecoder(self)
+        return zip(self.items, self._decoder.decode(registers))
+
+    def __repr__(self):
+        return (f"ReadBlock(host={self.host_id}, {self.reg_type}, interval={self.interval}, "
+                f"start={self.start}, count={self.count}, items={len(self.items)})")
+
+
+def sort_key(item):
+    """docs/collection_logic.md 3.1 の階層順 (Interval > Host > RegType > Address)"""
+    return (item.interval, item.host_id, item.reg_type, item.address)
+
+
+def build_read_plan(items, max_gap=0, max_count=None):
+    """PlanItem のリストを最小限のブロック読み出しへまとめる
+
+    判定式: 現在のアドレス - (直前ブロックの終端) <= max_gap なら統合。
+    ただし統合後の長さがファンクションコードの上限 (max_count) を超える場合は分割する。
+    """
+    blocks = []
+    current = None
+
+    for item in sorted(items, key=sort_key):
+        limit = MODBUS_MAX_COUNT.get(item.reg_type, 125)
+        if max_count:
+            limit = min(limit, max_count)
+
+        if (current is not None
+                and current.interval == item.interval
+                and current.host_id == item.host_id
+                and current.reg_type == item.reg_type
+                and item.address - current.end <= max_gap
+                and max(current.end, item.address + item.count) - current.start <= limit):
+            current.add(item)
+            continue
+
+        current = ReadBlock(item.host_id, item.reg_type, item.interval, item.address)
+        current.add(item)
+        blocks.append(current)
+
+    return blocks
+
@@ -0,0 +1,80 @@
+# 段階的切り分け (Step-down recovery) と不正アドレスの一時除外
+# docs/collection_logic.md 「5. エラーハンドリング」の実装。
+# ブロック読み出しが不正アドレスの例外応答 (Illegal Data Address / Value) で失敗した場合、ブロックを二分しながら
+# 読み直して原因のアイテムを特定し、そのアイテムだけを一時除外 (Quarantine) する。
+# 健全な近隣アイテムは次のサイクルからも一括読み出しの効率を維持できる。
+from src.engine.modbus_io import ModbusReadError
+from src.engine.read_planner import ReadBlock
+
+# items.last_status の値 (docs/collection_logic.md 7章)
+STATUS_OK = 0
+STATUS_COMM_ERROR = 1
+STATUS_ADDRESS_ERROR = 2
+
+
+class Quarantine:
+    """一時除外中のアイテム（指数バックオフで個別に再試行する）"""
+
+    def __init__(self, base_delay=10, max_delay=600):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.entries = {}  # item_id -> [失敗回数, 次回再試行時刻(monotonic)]
+        self.version = 0   # 除外対象が増減するたびに加算（読み出し計画の再計算に使う）
+
+    def __contains__(self, item_id):
+        return item_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, item_id, now):
+        """除外（再試行失敗時は待ち時間を倍にする）。失敗回数を返す"""
+        entry = self.entries.get(item_id)
+        failures = entry[0] + 1 if entry else 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        self.entries[item_id] = [failures, now + delay]
+        if entry is None:
+            self.version += 1
+        return failures
+
+    def release(self, item_id):
+        if self.entries.pop(item_id, None) is not None:
+            self.version += 1
+
+    def due(self, now):
+        """再試行時刻に達したアイテムID"""
+        return [item_id for item_id, (_, retry_at) in self.entries.items() if retry_at <= now]
+
+    def retain(self, item_ids):
+        """設定から消えたアイテムを除外リストからも外す"""
+        for item_id in [i for i in self.entries if i not in item_ids]:
+            self.release(item_id)
+
+
+async def step_down(reader, block):
+    """不正アドレスの例外応答で失敗したブロックを二分探索で切り分ける
+
+    戻り値: (読み出せたサブブロックと値のリスト [(ReadBlock, values), ...], 不正と判定した PlanItem のリスト)
+    通信エラー（タイムアウト・切断）や不正アドレス以外の例外応答（ビジー等）になった範囲は
+    判定できないので、どちらにも含めない。
+    """
+    recovered = []
+    bad_items = []
+    pending = [block]
+
+    while pending:
+        current = pending.pop()
+        if len(current.items) == 1:
+            bad_items.extend(current.items)
+            continue
+
+        middle = len(current.items) // 2
+        halves = [ReadBlock.from_items(current.items[:middle]), ReadBlock.from_items(current.items[middle:])]
+        # 2つの半分はパイプラインモードなら同時に送られる
+        for half, values in await reader.read_blocks(halves):
+            if isinstance(values, ModbusReadError) and values.address_error:
+                pending.append(half)
+            elif not isinstance(values, Exception):
+                recovered.append((half, values))
+
+    return recovered, bad_items
@@ -0,0 +1,174 @@
+# 保持期間 (retention) の処理
+# 保持期間 (system.retention_minutes) を過ぎたデータを、DB書き込みタスクと同じプロセスで定期的に削除する。
+# Web側のリクエストに依存しないので、画面を誰も開いていなくても削除され、プロセス数にかかわらず1か所で動く。
+#   - history      : 期限を過ぎたパーティションを丸ごと DROP TABLE する。archive_path があれば、
+#                    同じトランザクションでアーカイブファイルへ封印し (history_archive)、archive_days を過ぎたファイルを消す
+#   - ロールアップ・event_logs : chunk_rows 行ずつ DELETE してコミットし、間で DBWriter に譲る
+#   - 削除で空いたページは auto_vacuum=INCREMENTAL の incremental_vacuum で少しずつファイルから返す
+# 1回の実行ごとに削除した行数・パーティション数・解放したページ数と所要時間を記録する。
+import asyncio
+import sqlite3
+import time
+import traceback
+
+import aiosqlite
+
+from src.common import history_archive, history_partitions, history_rollups
+from src.common.config_loader import config
+from src.engine.metrics import (RETENTION_ARCHIVED_BYTES, RETENTION_ARCHIVED_ROWS, RETENTION_FREED_PAGES,
+                                RETENTION_PARTITIONS, RETENTION_ROWS, RETENTION_SECONDS)
+
+# チャンクの間で他の書き込みに譲る時間(秒)
+CHUNK_PAUSE = 0.05
+# auto_vacuum = INCREMENTAL (PRAGMA auto_vacuum の値)
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class RetentionWorker:
+    """保持期間を過ぎたデータを定期的に削除する常駐タスク"""
+
+    def __init__(self, db_path, retention_minutes, interval=60, chunk_rows=5000, vacuum_pages=1000,
+                 archive_path=None, archive_days=28, rollup_1m_hours=24):
+        self.db_path = db_path
+        self.retention_minutes = retention_minutes
+        self.rollup_1m_hours = rollup_1m_hours
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.vacuum_pages = vacuum_pages
+        self.archive_path = archive_path
+        self.archive_days = archive_days
+        self.stats = {"runs": 0, "rows": 0, "partitions": 0, "freed_pages": 0, "archived_rows": 0, "last_seconds": 0.0}
+        self.seconds = RETENTION_SECONDS.labels()
+        self.partitions = RETENTION_PARTITIONS.labels()
+        self.freed_pages = RETENTION_FREED_PAGES.labels()
+        self.archived_rows = RETENTION_ARCHIVED_ROWS.labels()
+        self.archived_bytes = RETENTION_ARCHIVED_BYTES.labels()
+
+    @classmethod
+    def from_config(cls, db_path=None):
+        return cls(
+            db_path or config.db_path,
+            config.retention_minutes,
+            interval=config.retention_interval,
+            chunk_rows=config.retention_chunk_rows,
+            archive_path=config.archive_path,
+            archive_days=config.archive_days,
+            rollup_1m_hours=config.rollup_1m_hours,
+        )
+
+    async def run(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("PRAGMA busy_timeout=5000")
+            cursor = await db.execute("PRAGMA auto_vacuum")
+            incremental = (await cursor.fetchone())[0] == AUTO_VACUUM_INCREMENTAL
+            while True:
+                try:
+                    await self.prune(db, incremental)
+                except (sqlite3.OperationalError, OSError) as e:
+                    # ロック待ちの時間切れ・アーカイブの書き込み失敗など。次の周期でやり直す
+                    await self._rollback(db)
+                    print(f"WARNING: Retention skipped: {e}")
+                except Exception as e:
+                    # 想定外の失敗でも常駐タスクは止めない（止まると削除されずにDBが肥大化し続ける）。
+                    # 停止要求 (CancelledError) は Exception ではないので、ここでは捕まえずにそのまま終了する
+                    await self._rollback(db)
+                    print(f"ERROR: Retention failed: {e!r}")
+                    traceback.print_exc()
+                await asyncio.sleep(self.interval)
+
+    async def _rollback(self, db):
+        try:
+            await db.rollback()
+        except sqlite3.Error as e:
+            print(f"WARNING: Retention rollback failed: {e}")
+
+    async def prune(self, db, incremental=True):
+        """1回分の削除。戻り値: {"rows": {テーブル: 行数}, "partitions": [...], "freed_pages": n, "seconds": s}"""
+        started = time.perf_counter()
+        cutoff = history_partitions.epoch_ms_ago(minutes=self.retention_minutes)
+        # 1分の集計は rollup_1m_hours、1時間の集計はアーカイブと同じ期間だけ残す（長い期間のグラフ用）。
+        # 1時間の集計は1分の集計より先には消さない
+        minute_cutoff = history_partitions.epoch_ms_ago(
+            minutes=history_rollups.minute_retention(self.retention_minutes, self.rollup_1m_hours))
+        hourly_cutoff = minute_cutoff
+        archived_rows = archived_bytes = 0
+        expired_archives = []
+        partitions = []
+        if self.archive_path:
+            archive_cutoff = history_partitions.epoch_ms_ago(days=self.archive_days)
+            hourly_cutoff = min(minute_cutoff, archive_cutoff)
+            for name in history_partitions.expired(await history_partitions.list_partitions(db), cutoff):
+                # 封印と DROP TABLE は seal_partition が1トランザクションで行う（間に届いた行を落とさない）
+                count, size = await asyncio.to_thread(
+                    history_archive.seal_partition, self.db_path, name, self.archive_path)
+                partitions.append(name)
+                archived_rows += count
+                archived_bytes += size
+            expired_archives = await asyncio.to_thread(history_archive.drop_expired, self.archive_path, archive_cutoff)
+
+        partitions += await history_partitions.drop_expired(db, cutoff)
+        await db.commit()
+
+        rows = {}
+        for table, sql, params in history_rollups.prune_statements({"1m": minute_cutoff, "1h": hourly_cutoff}):
+            rows[table] = await self._delete_chunked(db, sql, params)
+        rows["event_logs"] = await self._delete_chunked(
+            db,
+            "DELETE FROM event_logs WHERE id IN (SELECT id FROM event_logs WHERE start_time < ? LIMIT ?)",
+            (history_partitions.local_text(cutoff),)
+        )
+
+        freed_pages = await self._incremental_vacuum(db) if incremental else 0
+
+        seconds = time.perf_counter() - started
+        self.seconds.observe(seconds)
+        self.partitions.inc(len(partitions))
+        self.freed_pages.inc(freed_pages)
+        self.archived_rows.inc(archived_rows)
+        self.archived_bytes.inc(archived_bytes)
+        for table, count in rows.items():
+            RETENTION_ROWS.labels(table).inc(count)
+        self.stats["runs"] += 1
+        self.stats["rows"] += sum(rows.values())
+        self.stats["partitions"] += len(partitions)
+        self.stats["freed_pages"] += freed_pages
+        self.stats["archived_rows"] += archived_rows
+        self.stats["last_seconds"] = seconds
+        if partitions or any(rows.values()) or freed_pages or expired_archives:
+            archived = f"archived {archived_rows} rows ({archived_bytes} bytes), " if self.archive_path else ""
+            print(f"INFO: Retention ({self.retention_minutes} min): {archived}dropped {len(partitions)} partitions, "
+                  f"pruned {sum(rows.values())} rows {rows}, removed {len(expired_archives)} archive files, "
+                  f"freed {freed_pages} pages in {seconds:.2f}s")
+        return {"rows": rows, "partitions": partitions, "freed_pages": freed_pages, "seconds": seconds,
+                "archived_rows": archived_rows, "archived_bytes": archived_bytes, "expired_archives": expired_archives}
+
+    async def _delete_chunked(self, db, sql, params):
+        """sql (最後の ? が LIMIT) を削除する行が無くなるまで繰り返す。1チャンクごとにコミットして譲る"""
+        total = 0
+        while True:
+            cursor = await db.execute(sql, (*params, self.chunk_rows))
+            deleted = cursor.rowcount
+            await db.commit()
+            total += deleted
+            if deleted < self.chunk_rows:
+                return total
+            await asyncio.sleep(CHUNK_PAUSE)
+
+    async def _incremental_vacuum(self, db):
+        """空きページを vacuum_pages ずつファイルから返す。戻り値: 解放したページ数"""
+        freed = 0
+        cursor = await db.execute("PRAGMA freelist_count")
+        free = (await cursor.fetchone())[0]
+        while free:
+            # 結果を読み切らないと途中で止まるので fetchall する
+            cursor = await db.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+            await cursor.fetchall()
+            await db.commit()
+            cursor = await db.execute("PRAGMA freelist_count")
+            remaining = (await cursor.fetchone())[0]
+            if remaining >= free:
+                break  # 進まない（他の接続が使用中など）。次の周期に回す
+            freed += free - remaining
+            free = remaining
+            await asyncio.sleep(CHUNK_PAUSE)
+        return freed
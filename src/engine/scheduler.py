@@ -0,0 +1,230 @@
+# 収集スケジューラ (インターバル・マネージャー)
+# docs/collection_logic.md 「4. 実行エンジンのスケジューリング」の実装。
+# 読み出しブロックを周期ごとにバケット化し、ハッシュ型タイマーホイールで
+# 「このチックで期限を迎えたブロック」だけを取り出す。
+import asyncio
+import time
+
+
+class TimerWheel:
+    """ハッシュ型タイマーホイール
+
+    スロット数 size のリングに (期限チック, エントリ) を登録する。
+    期限が size チック以上先のエントリも、期限チックを比較することで正しく扱える。
+    """
+
+    def __init__(self, size=60):
+        self.size = size
+        self.slots = [[] for _ in range(size)]
+        self.count = 0
+
+    def schedule(self, entry, due_tick):
+        self.slots[due_tick % self.size].append((due_tick, entry))
+        self.count += 1
+
+    def pop_due(self, tick):
+        """期限が tick 以前のエントリをスロットから取り出す"""
+        slot = self.slots[tick % self.size]
+        if not slot:
+            return []
+        due = [entry for due_tick, entry in slot if due_tick <= tick]
+        if due:
+            slot[:] = [(due_tick, entry) for due_tick, entry in slot if due_tick > tick]
+            self.count -= len(due)
+        return due
+
+    def entries(self):
+        return [entry for slot in self.slots for _, entry in slot]
+
+
+class ScheduledBlock:
+    """ホイールに登録する1ブロック分の周期情報"""
+    __slots__ = ("block", "period", "phase")
+
+    def __init__(self, block, period, phase):
+        self.block = block
+        self.period = period  # 周期(チック数)
+        self.phase = phase    # 位相オフセット(チック数)
+
+    def next_due(self, tick):
+        """tick 以降で最初に (tick % period == phase) となるチック"""
+        return tick + (self.phase - tick) % self.period
+
+
+class IntervalScheduler:
+    """全ホストの読み出しブロックを1つのチックで多重化するスケジューラ
+
+    - ブロックは周期 (items.polling_interval) ごとにバケット化される
+    - 同じ周期のブロックには位相オフセットを割り振り、5s/10s周期のグループが
+      同じチックに集中しないよう分散させる
+    - ポーリングが遅れてチックを飛ばした場合は、飛ばした分の期限も1回にまとめて返す
+    """
+
+    def __init__(self, base_interval=1, wheel_size=60):
+        self.base_interval = base_interval
+        self.wheel_size = wheel_size
+        self._wheels = {}      # host_id -> TimerWheel
+        self._last_tick = {}   # host_id -> 最後に処理したチック
+
+    def current_tick(self, now=None):
+        """壁時計基準のチック番号（全ホスト共通の時間軸）"""
+        if now is None:
+            now = time.time()
+        return int(now // self.base_interval)
+
+    def period_ticks(self, interval):
+        return max(1, round((interval or 1) / self.base_interval))
+
+    def load(self, host_id, blocks, tick=None):
+        """ホストの読み出し計画を登録し直す（計画が変わった時に呼ぶ）"""
+        if tick is None:
+            tick = self.current_tick()
+
+        wheel = TimerWheel(self.wheel_size)
+        buckets = {}
+        for block in blocks:
+            buckets.setdefault(self.period_ticks(block.interval), []).append(block)
+
+        for period, bucket in buckets.items():
+            for index, block in enumerate(bucket):
+                # ホストIDもずらしに使い、複数PLCの同周期グループも分散させる
+                entry = ScheduledBlock(block, period, (host_id + index) % period)
+                wheel.schedule(entry, entry.next_due(tick))
+
+        self._wheels[host_id] = wheel
+        self._last_tick[host_id] = tick - 1
+
+    def remove(self, host_id):
+        self._wheels.pop(host_id, None)
+        self._last_tick.pop(host_id, None)
+
+    def due(self, host_id, tick=None, catch_up=True):
+        """tick までに期限を迎えたブロックを返し、次回の期限で登録し直す
+
+        catch_up=False の場合、飛ばしたチックで期限を迎えたブロックは返さずに
+        次の周期へ送る（今回のチックで期限のものだけを返す）。
+        """
+        wheel = self._wheels.get(host_id)
+        if wheel is None:
+            return []
+        if tick is None:
+            tick = self.current_tick()
+
+        last = self._last_tick[host_id]
+        if tick <= last:
+            return []
+
+        # 飛ばしたチックの期限もまとめて回収する（1周以上遅れたら全スロットを見る）
+        fired = []
+        for t in range(max(last + 1, tick - self.wheel_size + 1), tick + 1):
+            fired.extend(wheel.pop_due(t))
+        self._last_tick[host_id] = tick
+
+        if not catch_up:
+            missed = [entry for entry in fired if (tick - entry.phase) % entry.period != 0]
+            if missed:
+                for entry in missed:
+                    wheel.schedule(entry, entry.next_due(tick + 1))
+                fired = [entry for entry in fired if (tick - entry.phase) % entry.period == 0]
+
+        for entry in fired:
+            wheel.schedule(entry, entry.next_due(tick + 1))
+
+        # ブロックはアドレス順のまま返す
+        return [entry.block for entry in sorted(fired, key=lambda e: (e.block.reg_type, e.block.start))]
+
+
+class CycleTimer:
+    """単調時計 (time.monotonic) の期限に合わせてサイクルを刻むタイマー
+
+    固定の sleep では「周期 + 読み出し時間 + DB時間」だけ実周期が伸びていくため、
+    期限 (deadline) を周期ずつ進め、その時刻まで待つ。
+    サイクルが期限を越えた (オーバーラン) 場合は、遅れを溜め込まずに
+      - compress: 直ちに次のサイクルを開始し、飛ばしたチックの収集をまとめて行う
+      - skip    : 次の期限まで待ち、飛ばしたチックの収集は行わない
+    のどちらかで期限の格子へ戻る。
+    """
+
+    def __init__(self, interval, policy="compress"):
+        self.interval = interval
+        self.policy = policy
+        # 期限はチック番号と対応させるため、壁時計の周期境界に揃えて開始する
+        wall = time.time()
+        self.tick = int(wall // interval)
+        self.deadline = time.monotonic() - (wall % interval)
+        self.cycle_started = self.deadline
+        # 次の start() が周期の途中から始まる（初回・resync 直後）。その遅れはジッタに数えない
+        self.unaligned = True
+        # 統計
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.jitter = 0.0       # 期限からの開始遅れ (指数移動平均, 秒)
+        self.max_jitter = 0.0
+
+    @property
+    def catch_up(self):
+        return self.policy != "skip"
+
+    def start(self):
+        """サイクル開始時に呼ぶ。期限からの遅れ (ジッタ) を記録する"""
+        self.cycle_started = time.monotonic()
+        if self.unaligned:
+            self.unaligned = False
+            return
+        lateness = max(0.0, self.cycle_started - self.deadline)
+        self.jitter += (lateness - self.jitter) * 0.1
+        self.max_jitter = max(self.max_jitter, lateness)
+
+    def finish(self):
+        """サイクル終了時に呼ぶ。次に待つべき秒数を返し、チック番号を進める"""
+        now = time.monotonic()
+        duration = now - self.cycle_started
+        self.cycles += 1
+        self.last_duration = duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+
+        self.deadline += self.interval
+        self.tick += 1
+        if now > self.deadline:
+            # オーバーラン: 過ぎてしまった期限は飛ばして格子に戻す
+            late = int((now - self.deadline) // self.interval)
+            # compress は直前の期限のチックとして直ちに次を始める（飛ばしたチックの分は
+            # scheduler.due() がまとめて返す）。skip は次の期限まで待つ
+            skipped = late if self.catch_up else late + 1
+            self.overruns += 1
+            self.skipped_ticks += skipped
+            self.deadline += skipped * self.interval
+            self.tick += skipped
+        return max(0.0, self.deadline - now)
+
+    async def wait(self):
+        await asyncio.sleep(self.finish())
+
+    def resync(self):
+        """接続断などでサイクルを回していなかった後、期限を現在時刻の格子へ合わせ直す
+
+        再接続の待ち時間はサイクル時間に含めないよう、サイクルの開始時刻もここからにする。
+        接続断の間の遅れをジッタとして記録しないよう、次の start() は初回と同じく数えない。
+        """
+        wall = time.time()
+        self.tick = int(wall // self.interval)
+        self.cycle_started = time.monotonic()
+        self.deadline = self.cycle_started - (wall % self.interval)
+        self.unaligned = True
+
+    def stats(self):
+        return {
+            "cycles": self.cycles,
+            "overruns": self.overruns,
+            "skipped_ticks": self.skipped_ticks,
+            "last_duration": self.last_duration,
+            "max_duration": self.max_duration,
+            "avg_duration": self.total_duration / self.cycles if self.cycles else 0.0,
+            "jitter": self.jitter,
+            "max_jitter": self.max_jitter,
+        }
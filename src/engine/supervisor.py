@@ -0,0 +1,178 @@
+# マルチプロセス実行 (poller --workers N)
+# 1プロセスの asyncio ループでは、数千タグ規模になると値の変換・アラート判定・書き込みの
+# バッチ化で1コアを使い切る。スーパーバイザーが hosts をワーカープロセスへ分配し、
+#   - 各ワーカーは担当ホストの接続と収集を持つ
+#   - 収集結果は multiprocessing.Queue でスーパーバイザーへ送り、SQLiteへの書き込みと
+#     現在値の共有メモリ (live_values) への書き込みは、スーパーバイザーの DBWriter 1本だけが行う
+#   - 異常終了したワーカーの担当ホストは、再起動するまで残りのワーカーが引き受ける
+# という構成にする。
+import asyncio
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+
+from src.common.config_loader import config
+from src.engine.metrics import start_metrics_server
+from src.engine.retention import RetentionWorker
+from src.engine.writer import DBWriter, ForwardingWriter
+
+# 異常終了したワーカーを再起動するまでの待ち時間(秒)。連続で落ちる場合は倍々に伸ばす
+RESTART_DELAY = 1
+RESTART_DELAY_MAX = 60
+# この秒数以上動いてから落ちたワーカーは、待ち時間を初期値に戻して再起動する
+STABLE_RUN_SECONDS = 60
+
+
+def shard_of(host_id, slots):
+    """ホストの担当ワーカーを決める (Rendezvous hashing)
+
+    ワーカーが増減しても、担当が変わるのはそのワーカーに割り当てられていたホストだけになる。
+    """
+    def weight(slot):
+        digest = hashlib.blake2b(f"{slot}:{host_id}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+    return max(slots, key=weight)
+
+
+def worker_main(index, alive, results):
+    """ワーカープロセスの入口（spawn で起動されるのでモジュール直下に置く）"""
+    from src.engine.poller import ModbusPoller
+
+    def host_filter(host_id):
+        slots = [slot for slot, flag in enumerate(alive) if flag] or [index]
+        return shard_of(host_id, slots) == index
+
+    poller = ModbusPoller(writer=ForwardingWriter(results), host_filter=host_filter, metrics_slot=index + 1)
+    try:
+        asyncio.run(poller.run())
+    except KeyboardInterrupt:
+        poller.running = False
+
+
+class WorkerSlot:
+    """1ワーカー分の起動状態"""
+    __slots__ = ("index", "process", "started_at", "restart_at", "delay", "restarts")
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at = None
+        self.delay = RESTART_DELAY
+        self.restarts = 0
+
+
+class PollerSupervisor:
+    def __init__(self, workers):
+        self.workers = workers
+        self.running = True
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        # ワーカーごとの稼働フラグ（担当ホストの計算に使う。ワーカー側から参照する）
+        self.alive = self.context.Array("b", [1] * workers)
+        self.slots = [WorkerSlot(i) for i in range(workers)]
+        self.writer = DBWriter(
+            config.db_path,
+            max_batch=config.writer_max_batch,
+            max_latency=config.writer_max_latency,
+            buffer_max_rows=config.writer_buffer_max_rows,
+            spill_path=config.writer_spill_path,
+            live_path=config.live_values_path,
+            live_capacity=config.live_values_capacity,
+            snapshot_interval=config.live_values_snapshot_interval,
+        )
+
+    def start_worker(self, slot):
+        process = self.context.Process(
+            target=worker_main,
+            args=(slot.index, self.alive, self.results),
+            name=f"poller-worker-{slot.index}",
+            daemon=True,
+        )
+        process.start()
+        slot.process = process
+        slot.started_at = time.monotonic()
+        slot.restart_at = None
+        self.alive[slot.index] = 1
+        print(f"INFO: Worker {slot.index} started (pid {process.pid})")
+
+    def check_workers(self):
+        """終了したワーカーを検出し、待ち時間を置いて再起動する"""
+        now = time.monotonic()
+        for slot in self.slots:
+            if slot.restart_at is not None:
+                if now >= slot.restart_at:
+                    slot.restarts += 1
+                    self.start_worker(slot)
+                continue
+
+            exitcode = slot.process.exitcode
+            if exitcode is None:
+                continue
+            self.alive[slot.index] = 0
+            if exitcode == 0:
+                # 停止要求を受けて正常終了した
+                print(f"INFO: Worker {slot.index} exited")
+                slot.restart_at = float("inf")
+                continue
+
+            if now - slot.started_at >= STABLE_RUN_SECONDS:
+                slot.delay = RESTART_DELAY
+            print(f"WARNING: Worker {slot.index} crashed (exit code {exitcode}). Restarting in {slot.delay}s")
+            slot.restart_at = now + slot.delay
+            slot.delay = min(RESTART_DELAY_MAX, slot.delay * 2)
+
+    def forward_results(self, loop, stopped):
+        """ワーカーから届いた書き込み要求を DBWriter のキューへ移す（専用スレッドで動かす）
+
+        Queue を読み続けないとワーカーは送信バッファを吐き出せずに終了できないため、
+        停止処理中もワーカーの終了を確認するまでは読み続ける。
+        """
+        while not stopped.is_set():
+            try:
+                message = self.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            loop.call_soon_threadsafe(self.writer.accept, message)
+
+    def drain_results(self):
+        while True:
+            try:
+                self.writer.accept(self.results.get_nowait())
+            except queue.Empty:
+                return
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        # スーパーバイザーは書き込み (writer) のメトリクスを公開する
+        metrics_server = await start_metrics_server()
+        writer_task = asyncio.create_task(self.writer.run())
+        retention_task = asyncio.create_task(RetentionWorker.from_config(self.writer.db_path).run())
+        stopped = threading.Event()
+        forwarder = threading.Thread(target=self.forward_results, args=(loop, stopped), daemon=True)
+        forwarder.start()
+        for slot in self.slots:
+            self.start_worker(slot)
+        try:
+            while self.running:
+                self.check_workers()
+                await asyncio.sleep(1)
+        finally:
+            self.running = False
+            # ワーカーにも SIGINT が届いているので終了を待ち、残った結果を書き切る
+            for slot in self.slots:
+                if slot.process is not None:
+                    await loop.run_in_executor(None, slot.process.join, 5)
+                    if slot.process.is_alive():
+                        slot.process.terminate()
+            stopped.set()
+            await loop.run_in_executor(None, forwarder.join)
+            self.drain_results()
+            retention_task.cancel()
+            await asyncio.gather(retention_task, return_exceptions=True)
+            await self.writer.stop()
+            await writer_task
+            if metrics_server is not None:
+                metrics_server.close()
@@ -0,0 +1,156 @@
+# トリガー判定エンジン (Analytics Engine)
+# docs/TriggerSpec.md 「1. トリガー判定ロジック」の実装。
+#
+# - 1アイテムに複数のトリガー (triggers テーブル) を設定できる
+# - problem_count / recovery_count 回連続で条件を満たした時だけ状態を変える（チャタリング防止）
+# - 復旧条件 (rect_op / rect_thr) が未設定なら発火条件の否定で復旧する
+# - items.alarm_enabled / alarm_threshold による従来のアラートは「値 >= しきい値」の
+#   トリガーとして同じ仕組みで判定する（キーは -item_id、event_logs.trigger_id は NULL）
+#
+# 判定状態はトリガーごとの配列 (array) に詰めて持ち、1サイクル分の収集値をまとめて判定する。
+# 状態はメモリだけに持ち、起動時は event_logs の継続中 (active) イベントから復元する。
+# 上書きインポートで item_id が別のアイテムに振り直された場合は、キーが同じでも状態を引き継がない。
+import operator
+from array import array
+
+OPERATORS = [">", ">=", "<", "<=", "==", "!="]
+_COMPARE = [operator.gt, operator.ge, operator.lt, operator.le, operator.eq, operator.ne]
+_NEGATE = [3, 2, 1, 0, 5, 4]  # 各演算子の否定 ('>' の否定は '<=' ...)
+
+STATUS_OK = 0
+STATUS_PROBLEM = 1
+
+
+def legacy_key(item_id):
+    """従来のアラート (items.alarm_threshold) のトリガーキー"""
+    return -item_id
+
+
+class TriggerDefinition:
+    """判定に使う1トリガー分の設定"""
+    __slots__ = ("key", "trigger_id", "item_id", "name", "cond_op", "cond_thr",
+                 "problem_count", "rect_op", "rect_thr", "recovery_count", "identity")
+
+    def __init__(self, key, trigger_id, item_id, name, cond_op, cond_thr,
+                 problem_count=1, rect_op=None, rect_thr=None, recovery_count=1, identity=None):
+        self.key = key
+        self.trigger_id = trigger_id
+        self.item_id = item_id
+        self.name = name
+        self.cond_op = OPERATORS.index(cond_op)
+        self.cond_thr = cond_thr
+        self.problem_count = max(1, problem_count or 1)
+        if rect_op:
+            self.rect_op = OPERATORS.index(rect_op)
+            self.rect_thr = cond_thr if rect_thr is None else rect_thr
+        else:
+            self.rect_op = _NEGATE[self.cond_op]
+            self.rect_thr = cond_thr
+        self.recovery_count = max(1, recovery_count or 1)
+        self.identity = identity  # 対象アイテムの実体 (ItemConfigCache.identity_of)
+
+    @classmethod
+    def from_row(cls, row, identity=None):
+        return cls(row["id"], row["id"], row["item_id"], row["name"], row["cond_op"], row["cond_thr"],
+                   row["problem_count"], row["rect_op"], row["rect_thr"], row["recovery_count"], identity)
+
+    @classmethod
+    def from_item(cls, item, identity=None):
+        return cls(legacy_key(item["id"]), None, item["id"], item["tag_name"], ">=", item["alarm_threshold"],
+                   identity=identity)
+
+
+class TriggerEngine:
+    """全トリガーの判定状態を配列で持つ評価器"""
+
+    def __init__(self):
+        self.definitions = []      # スロット番号 -> TriggerDefinition
+        self.slots = {}            # トリガーキー -> スロット番号
+        self.by_item = {}          # item_id -> [スロット番号, ...]
+        # 判定用の配列（スロット番号で引く）
+        self.cond_op = array("b")
+        self.cond_thr = array("d")
+        self.rect_op = array("b")
+        self.rect_thr = array("d")
+        self.problem_count = array("i")
+        self.recovery_count = array("i")
+        # 判定状態
+        self.status = array("b")
+        self.counts = array("i")
+
+    def load(self, definitions):
+        """トリガー設定を読み込み直す。キーと対象アイテムが同じトリガーは判定状態を引き継ぐ
+
+        戻り値: 設定から消えたか、対象アイテムが入れ替わった PROBLEM 中のトリガー（復旧として閉じる）
+        """
+        identities = {d.key: d.identity for d in definitions}
+        previous = {d.key: (self.status[slot], self.counts[slot]) for slot, d in enumerate(self.definitions)
+                    if d.key in identities and identities[d.key] == d.identity}
+        removed = [d for slot, d in enumerate(self.definitions)
+                   if d.key not in previous and self.status[slot] == STATUS_PROBLEM]
+
+        self.definitions = list(definitions)
+        self.slots = {d.key: slot for slot, d in enumerate(self.definitions)}
+        self.by_item = {}
+        for slot, d in enumerate(self.definitions):
+            self.by_item.setdefault(d.item_id, []).append(slot)
+
+        self.cond_op = array("b", (d.cond_op for d in self.definitions))
+        self.cond_thr = array("d", (d.cond_thr for d in self.definitions))
+        self.rect_op = array("b", (d.rect_op for d in self.definitions))
+        self.rect_thr = array("d", (d.rect_thr for d in self.definitions))
+        self.problem_count = array("i", (d.problem_count for d in self.definitions))
+        self.recovery_count = array("i", (d.recovery_count for d in self.definitions))
+        state = [previous.get(d.key, (STATUS_OK, 0)) for d in self.definitions]
+        self.status = array("b", (s for s, _ in state))
+        self.counts = array("i", (c for _, c in state))
+        return removed
+
+    def restore(self, active_keys):
+        """event_logs で継続中のイベントを PROBLEM 状態として復元する"""
+        for key in active_keys:
+            slot = self.slots.get(key)
+            if slot is not None:
+                self.status[slot] = STATUS_PROBLEM
+                self.counts[slot] = 0
+
+    def forget(self, item_ids):
+        """担当を外れたアイテムの判定状態を OK に戻す（別プロセスへ移った時など）"""
+        for item_id in item_ids:
+            for slot in self.by_item.get(item_id, ()):
+                self.status[slot] = STATUS_OK
+                self.counts[slot] = 0
+
+    def evaluate(self, values):
+        """1サイクル分の収集値 [(item_id, value, timestamp), ...] をまとめて判定する
+
+        戻り値: 状態が変わったトリガー [(STATUS_PROBLEM/STATUS_OK, TriggerDefinition, value, timestamp), ...]
+        """
+        transitions = []
+        by_item = self.by_item
+        status = self.status
+        counts = self.counts
+        for item_id, value, timestamp in values:
+            slots = by_item.get(item_id)
+            if not slots or value is None:
+                continue
+            for slot in slots:
+                if status[slot] == STATUS_OK:
+                    if _COMPARE[self.cond_op[slot]](value, self.cond_thr[slot]):
+                        counts[slot] += 1
+                        if counts[slot] >= self.problem_count[slot]:
+                            status[slot] = STATUS_PROBLEM
+                            counts[slot] = 0
+                            transitions.append((STATUS_PROBLEM, self.definitions[slot], value, timestamp))
+                    else:
+                        counts[slot] = 0
+                else:
+                    if _COMPARE[self.rect_op[slot]](value, self.rect_thr[slot]):
+                        counts[slot] += 1
+                        if counts[slot] >= self.recovery_count[slot]:
+                            status[slot] = STATUS_OK
+                            counts[slot] = 0
+                            transitions.append((STATUS_OK, self.definitions[slot], value, timestamp))
+                    else:
+                        counts[slot] = 0
+        return transitions
@@ -0,0 +1,225 @@
+# DBWriter の書き込み待ちバッファ (Store and forward)
+# Web側の一括削除やインポートで SQLite がロックされている間も、収集ループは止めずに結果を溜め、
+# ロックが解けたら届いた順にまとめて書き込む。
+#
+#   - メモリ上のリングバッファ（max_rows 行まで）。put_nowait は待ちもディスクI/Oも発生しない
+#   - spill_path を設定した場合、上限を超えた古いメッセージは DBWriter が追記専用のファイルへ
+#     退避する（JSON Lines）。ファイルの分を先に、メモリの分を後に書き込むので順序は保たれる
+#   - spill_path が無い場合、上限を超えると古い収集値 (values) から捨てる
+#     （イベント・状態の変化は件数が少なく失うと整合が取れなくなるので捨てない）
+# ファイルは DB に書き込めた所まで読み出し位置 (.offset) を進め、全部書き終えたら削除する。
+# Poller を停止・再起動しても、残っていた分は次の起動時に書き込まれる。
+# ファイルの先頭行には作成ごとに変わる世代 (generation) を書く。DBWriter はコミットと同じ
+# トランザクションで「どの世代のどこまで書いたか」を DB に残し、.offset の更新前に落ちても
+# 次の起動時にそこから読み直す（同じバッチを二重に書かない）。
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+
+def message_rows(message):
+    """メッセージの行数（バッファの上限・バッチの大きさの計算に使う）"""
+    kind, payload = message
+    return len(payload) if kind in ("values", "events") else 1
+
+
+class SpillFile:
+    """追記専用の退避ファイル（1行 = 1メッセージの JSON）
+
+    read / append / consume はファイルI/Oを伴うので、DBWriter から asyncio.to_thread で呼ぶ。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.size = 0
+        self.read_offset = 0
+        self.generation = None  # ファイルの世代（先頭行。世代の無い旧形式のファイルは None）
+        if os.path.exists(path):
+            self._recover()
+
+    def _recover(self):
+        """前回の続きから読めるようにする（書きかけの最終行は捨てる）"""
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+        self.size = end
+        try:
+            header = json.loads(data[:data.find(b"\n") + 1] or b"null")
+        except ValueError:
+            header = None
+        if isinstance(header, dict):
+            self.generation = header.get("generation")
+        try:
+            with open(self.offset_path, encoding="utf-8") as f:
+                self.read_offset = min(int(f.read().strip() or 0), self.size)
+        except (OSError, ValueError):
+            self.read_offset = 0
+
+    @property
+    def pending(self):
+        return self.read_offset < self.size
+
+    def append(self, messages):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        lines = [json.dumps(message, separators=(",", ":")) + "\n" for message in messages]
+        if self.size == 0:
+            # 新しいファイル: 世代を先頭行に書く（読み出し時は読み飛ばす）
+            self.generation = f"{time.time_ns():x}"
+            lines.insert(0, json.dumps({"generation": self.generation}) + "\n")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+            self.size = f.tell()
+
+    def read(self, max_rows):
+        """読み出し位置から max_rows 行分のメッセージを返す: (messages, 読み終えた位置)"""
+        messages = []
+        rows = 0
+        with open(self.path, "rb") as f:
+            f.seek(self.read_offset)
+            offset = self.read_offset
+            while rows < max_rows and offset < self.size:
+                line = f.readline()
+                offset += len(line)
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    print(f"WARNING: {self.path} の壊れた行を読み飛ばします (offset {offset - len(line)})")
+                    continue
+                if isinstance(message, dict):
+                    continue  # 先頭行の世代
+                messages.append(message)
+                rows += message_rows(message)
+        return messages, offset
+
+    def consume(self, offset):
+        """offset までを書き込み済みにする。全部書き終えたらファイルを消す"""
+        self.read_offset = offset
+        if self.read_offset >= self.size:
+            for path in (self.path, self.offset_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.size = self.read_offset = 0
+            self.generation = None
+            return
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(self.read_offset))
+        os.replace(tmp_path, self.offset_path)
+
+
+class WriteBuffer:
+    """DBWriter の入力キュー（asyncio.Queue の代わり。put_nowait / qsize は同じ使い方）"""
+
+    def __init__(self, max_rows=200000, spill_path=None):
+        self.max_rows = max_rows
+        self.spill = SpillFile(spill_path) if spill_path else None
+        self.messages = deque()
+        self.rows = 0
+        self.closed = False
+        self.dropped_rows = 0
+        self.spilled_rows = 0
+        self._ready = asyncio.Event()
+
+    def qsize(self):
+        return len(self.messages)
+
+    def put_nowait(self, message):
+        """収集ループから呼ばれる。待たない・ディスクに触らない"""
+        if message is None:
+            # 停止要求: ここまでに届いた分を書き切ったら終了する
+            self.closed = True
+        else:
+            self.messages.append(message)
+            self.rows += message_rows(message)
+            if self.spill is None and self.rows > self.max_rows:
+                self._drop_oldest_values()
+        self._ready.set()
+
+    def _drop_oldest_values(self):
+        """上限に収まるまで古い収集値を捨てる（今届いた最新のメッセージは残す）"""
+        index = 0
+        while self.rows > self.max_rows and index < len(self.messages) - 1:
+            message = self.messages[index]
+            if message[0] != "values":
+                index += 1
+                continue
+            del self.messages[index]
+            rows = message_rows(message)
+            self.rows -= rows
+            self.dropped_rows += rows
+
+    def take(self, max_rows):
+        """先頭から max_rows 行分までのメッセージを取り出す"""
+        batch = []
+        rows = 0
+        while self.messages and rows < max_rows:
+            message = self.messages.popleft()
+            batch.append(message)
+            rows += message_rows(message)
+        self.rows -= rows
+        if not self.messages:
+            self._ready.clear()
+        return batch, rows
+
+    async def wait(self):
+        """メッセージが届くか停止要求が来るまで待つ"""
+        while not self.messages and not self.closed:
+            self._ready.clear()
+            await self._ready.wait()
+
+    async def next_batch(self, max_rows, max_latency):
+        """次に書き込むバッチを返す: (messages, 退避ファイルの読み終えた位置 または None)
+
+        退避ファイルに未書き込みの分があればそれを先に返す。停止要求後に全部書き終えたら None。
+        """
+        if self.spill is not None and self.spill.pending:
+            return await asyncio.to_thread(self.spill.read, max_rows)
+
+        await self.wait()
+        if not self.messages:
+            return None  # 停止要求が来て、残りも無い
+
+        # フラッシュ窓: max_rows に達するか max_latency が過ぎるまで溜める
+        deadline = time.monotonic() + max_latency
+        while self.rows < max_rows and not self.closed:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        batch, _ = self.take(max_rows)
+        return batch, None
+
+    async def spill_overflow(self, batch=()):
+        """上限を超えた分（と、書き込めなかった batch）を退避ファイルへ移す
+
+        batch はバッファの先頭より古いので、先に書く。退避先が無ければ何もしない。
+        """
+        if self.spill is None:
+            return False
+        overflow = list(batch)
+        while self.rows > self.max_rows and self.messages:
+            message = self.messages.popleft()
+            overflow.append(message)
+            self.rows -= message_rows(message)
+        if overflow:
+            await asyncio.to_thread(self.spill.append, overflow)
+            self.spilled_rows += sum(message_rows(message) for message in overflow)
+        return True
+
+    def drain(self):
+        """残っている全メッセージを取り出す（停止処理用）"""
+        batch = list(self.messages)
+        self.messages.clear()
+        self.rows = 0
+        return batch
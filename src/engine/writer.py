@@ -0,0 +1,470 @@
+# DB書き込み専用タスク (Single Writer)
+# 全ホストの poll_host から届く収集結果・イベント・ホスト状態を WriteBuffer で受け取り、
+# 1本の常駐コネクションで「フラッシュ窓ごとに1トランザクション」にまとめて書き込む。
+# 現在値は受け取った時点で共有メモリの表 (live_values) に書き、items.last_value は一定間隔でだけ書く。
+#
+# バッチをコミットする時は、同じトランザクションで writer_state に目印（どのバッチか）を残す。
+# コミットの完了と停止 (キャンセル)・異常終了が入れ違っても、目印を見ればコミット済みかが分かるので、
+# 同じバッチを二重に書かない（event_logs の発生や、足し込みで更新するロールアップが重複しない）。
+import asyncio
+import itertools
+import sqlite3
+import time
+
+import aiosqlite
+
+from src.common import history_partitions, history_rollups
+from src.common.live_values import LiveValueTable
+from src.engine.metrics import (
+    WRITER_BUFFER_ROWS, WRITER_COMMIT_SECONDS, WRITER_DROPPED_ROWS, WRITER_ERRORS, WRITER_QUEUE_DEPTH,
+    WRITER_ROWS, WRITER_SPILL_BYTES, WRITER_SPILLED_ROWS,
+)
+from src.engine.recovery import STATUS_OK
+from src.engine.write_buffer import WriteBuffer, message_rows
+
+# DBへ書き込めなかった時の再試行間隔(秒)。続けて失敗するたびに倍にする
+RETRY_DELAY = 0.5
+RETRY_DELAY_MAX = 10
+
+# コミットの目印: key = "batch"（メモリから書いたバッチ "<起動ごとのID>:<連番>"）
+#                     / "spill"（退避ファイルから書いたバッチ "<ファイルの世代>:<読み終えた位置>"）
+WRITER_STATE_SQL = """CREATE TABLE IF NOT EXISTS writer_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)"""
+MARK_SQL = "INSERT INTO writer_state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+
+
+class WriteSubmitter:
+    """書き込み要求の投入側インターフェース（poll_host から呼ぶ。待ちは発生しない）
+
+    メッセージの送り先はサブクラスの _put で決まる。
+    """
+
+    def _put(self, message):
+        raise NotImplementedError
+
+    def submit_values(self, rows):
+        """rows: [(item_id, value, ts, record_history), ...]  ts は UTC epoch ミリ秒"""
+        if rows:
+            self._put(("values", rows))
+
+    def submit_host_status(self, host_id, status, timestamp):
+        self._put(("host_status", (host_id, status, timestamp)))
+
+    def submit_item_status(self, item_id, status):
+        """items.last_status (0:OK, 1:CommErr, 2:AddrErr) の変化を書き込む"""
+        self._put(("item_status", (status, item_id)))
+
+    def submit_item_keys(self, keys):
+        """現在値の表のスロットとアイテムの対応を送る（設定を読み直した時）
+
+        keys: [(item_id, live_values.item_key(...)), ...]  DBには書かない
+        """
+        if keys:
+            self._put(("item_keys", keys))
+
+    def submit_events(self, events):
+        """トリガーの状態変化をまとめて送る
+
+        events: [("open", (item_id, trigger_id, timestamp, value, threshold)),
+                 ("close", (timestamp, item_id, trigger_id)), ...]
+        """
+        if events:
+            self._put(("events", events))
+
+
+class DBWriter(WriteSubmitter):
+    """常駐コネクションを1本だけ持つ書き込みタスク
+
+    - 値 (history / items.last_value) は executemany でまとめて書き込む
+    - max_batch 行たまるか、最初のメッセージから max_latency 秒経過したらコミットする
+    - DBがロックされていて書けない間はバッチを捨てずに再試行する。その間に届いた分は
+      WriteBuffer（メモリ上限 buffer_max_rows 行 + 任意の退避ファイル spill_path）に溜める
+    - live_path があれば、現在値と品質は受け取った時点で共有メモリの表へ書き、
+      items.last_value / updated_at は snapshot_interval 秒ごと（と停止時）にだけ書き込む
+    """
+
+    def __init__(self, db_path, max_batch=5000, max_latency=0.5, buffer_max_rows=200000, spill_path=None,
+                 live_path=None, live_capacity=65536, snapshot_interval=30):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.queue = WriteBuffer(buffer_max_rows, spill_path)
+        self.retry_delay = RETRY_DELAY
+        self.inflight = None  # 書き込み中のバッチ (messages, 退避ファイルの位置, 目印)。停止時に取りこぼさないため
+        self.run_id = None    # 起動ごとのID（目印を前回の起動のものと区別する）
+        self.batches = 0      # この起動で書き込んだバッチの連番
+        self.live = LiveValueTable.create(live_path, live_capacity) if live_path else None
+        self.live_skipped = 0
+        self.snapshot_interval = snapshot_interval
+        self.snapshot = {}        # item_id -> (value, ts) まだ items へ書いていない現在値
+        self.next_snapshot = 0.0  # 次に items へ書く時刻 (monotonic)
+        self.stats = {"flushes": 0, "rows": 0, "history_rows": 0, "errors": 0, "last_commit_ms": 0.0}
+        # メトリクス（キューの長さなどはスクレイプ時に読む）
+        WRITER_QUEUE_DEPTH.labels().set_function(self.queue.qsize)
+        WRITER_BUFFER_ROWS.labels().set_function(lambda: self.queue.rows)
+        WRITER_SPILL_BYTES.labels().set_function(
+            lambda: self.queue.spill.size - self.queue.spill.read_offset if self.queue.spill else 0)
+        WRITER_SPILLED_ROWS.labels().set_function(lambda: self.queue.spilled_rows)
+        WRITER_DROPPED_ROWS.labels().set_function(lambda: self.queue.dropped_rows)
+        self.commit_seconds = WRITER_COMMIT_SECONDS.labels()
+        self.items_committed = WRITER_ROWS.labels("items")
+        self.history_committed = WRITER_ROWS.labels("history")
+        self.errors = WRITER_ERRORS.labels()
+
+    def _put(self, message):
+        self.accept(message)
+
+    def accept(self, message):
+        """メッセージを受け取る（スーパーバイザーがワーカーから届いた分を渡す時もここを通す）"""
+        if self.live is not None:
+            self._publish(message)
+        if message[0] != "item_keys":
+            self.queue.put_nowait(message)
+
+    def _publish(self, message):
+        """現在値と品質を共有メモリの表へ書く（DBへのコミットを待たずに Web側から見える）"""
+        kind, payload = message
+        if kind == "values":
+            skipped = self.live.publish(
+                [(item_id, value, ts, STATUS_OK) for item_id, value, ts, _ in payload],
+                history_partitions.now_ms()
+            )
+            if skipped and not self.live_skipped:
+                print(f"WARNING: item_id が live_values.capacity ({self.live.capacity}) 以上のアイテムは "
+                      f"共有メモリに載らないため、現在値は items テーブルのスナップショットだけになります")
+            self.live_skipped += skipped
+        elif kind == "item_status":
+            status, item_id = payload
+            self.live.set_quality(item_id, status, history_partitions.now_ms())
+        elif kind == "item_keys":
+            self.live.bind(payload, history_partitions.now_ms())
+
+    async def stop(self):
+        """キューに残っている分を書き切って終了させる（書けない分は退避ファイルへ移す）"""
+        self.queue.put_nowait(None)
+
+    # --- 書き込み側 ---
+
+    async def run(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute("PRAGMA synchronous=NORMAL")
+            await db.execute("PRAGMA busy_timeout=5000")
+            await db.execute(WRITER_STATE_SQL)
+            await db.commit()
+            self.run_id = f"{time.time_ns():x}"
+            await self._resume_spill(db)
+
+            try:
+                await self._loop(db)
+            except asyncio.CancelledError:
+                # 停止時(Ctrl+C等)は残っている分だけ書き切る。書けなければ退避ファイルへ
+                # 書き込み中だったバッチは、目印が無ければ（コミットされていなければ）書き直す。
+                # キャンセルが COMMIT の完了と入れ違うことがあるので、in_transaction では判断しない
+                # （ロールバックと目印の確認は、実行中の COMMIT が終わってから順に行われる）。
+                # 退避ファイルの分はファイルに残っていて、次の起動時に目印を見て続きから書く
+                await db.rollback()
+                pending = self.queue.drain()
+                if self.inflight is not None:
+                    batch, spill_offset, mark = self.inflight
+                    if spill_offset is None and not await self._committed(db, mark):
+                        pending = batch + pending
+                self.inflight = None
+                self.next_snapshot = 0.0
+                if (pending or self.snapshot) and not await self.flush(db, pending):
+                    await self._give_up(pending)
+                raise
+            # 停止要求: 書き込んでいない現在値をスナップショットとして残す
+            if self.snapshot:
+                self.next_snapshot = 0.0
+                await self.flush(db, [])
+
+    async def _loop(self, db):
+        while True:
+            if self.queue.rows > self.queue.max_rows:
+                await self.queue.spill_overflow()
+            batch = await self.queue.next_batch(self.max_batch, self.max_latency)
+            if batch is None:
+                return  # 停止要求までの分を書き終えた
+            if not await self._write(db, *batch):
+                return
+
+    async def _write(self, db, batch, spill_offset):
+        """1バッチを書き込む。DBが使えない間は間隔を伸ばしながら再試行する
+
+        spill_offset: 退避ファイルから読んだバッチなら読み終えた位置（書けたらそこまで消化する）
+        戻り値: 停止要求中に書けず、書き込みを諦めた場合は False
+
+        inflight はコミットするか、バッチを退避ファイル・_give_up へ渡すまで残す
+        （途中でキャンセルされたら、run() が目印を見てコミットされていなければ書き直す）。
+        """
+        self.batches += 1
+        spill = self.queue.spill
+        if spill_offset is None:
+            mark = ("batch", f"{self.run_id}:{self.batches}")
+        elif spill.generation is not None:
+            mark = ("spill", f"{spill.generation}:{spill_offset}")
+        else:
+            mark = None  # 世代の無い旧形式の退避ファイル
+        self.inflight = (batch, spill_offset, mark)
+        while not await self.flush(db, batch, mark):
+            if self.queue.closed:
+                # 停止要求中: 残りは退避ファイルに移して（無ければ諦めて）終了する
+                self.inflight = None
+                await self._give_up((batch if spill_offset is None else []) + self.queue.drain())
+                return False
+            if self.queue.spill is not None and spill_offset is None:
+                # 退避ファイルへ移し、以後はファイルの先頭から順に書き込む
+                await self.queue.spill_overflow(batch)
+                self.inflight = None
+                await self._backoff()
+                return True
+            await self.queue.spill_overflow()
+            await self._backoff()
+        self.inflight = None
+        self.retry_delay = RETRY_DELAY
+        if spill_offset is not None:
+            # ここで落ちても、次の起動時に _resume_spill が目印の位置まで進める
+            await asyncio.to_thread(self.queue.spill.consume, spill_offset)
+        return True
+
+    async def _committed(self, db, mark):
+        """目印 (key, value) のバッチがコミット済みか"""
+        if mark is None:
+            return False
+        cursor = await db.execute("SELECT value FROM writer_state WHERE key = ?", (mark[0],))
+        row = await cursor.fetchone()
+        return row is not None and row[0] == mark[1]
+
+    async def _resume_spill(self, db):
+        """退避ファイルの読み出し位置を、DB に残した目印（コミット済みの位置）まで進める
+
+        前回、コミットしてから .offset を更新するまでの間に落ちた場合に、同じバッチを書き直さない。
+        """
+        spill = self.queue.spill
+        if spill is None or spill.generation is None:
+            return
+        cursor = await db.execute("SELECT value FROM writer_state WHERE key = 'spill'")
+        row = await cursor.fetchone()
+        if row is None:
+            return
+        generation, _, offset = row[0].rpartition(":")
+        if generation == spill.generation and int(offset) > spill.read_offset:
+            print(f"INFO: {spill.path} の書き込み済みの位置 ({offset}) から再開します")
+            await asyncio.to_thread(spill.consume, int(offset))
+
+    async def _backoff(self):
+        print(f"WARNING: DBへ書き込めないため {self.retry_delay:.1f}秒後に再試行します "
+              f"(待機中 {self.queue.rows}行, 退避 {self.queue.spilled_rows}行, 破棄 {self.queue.dropped_rows}行)")
+        await asyncio.sleep(self.retry_delay)
+        self.retry_delay = min(RETRY_DELAY_MAX, self.retry_delay * 2)
+
+    async def _give_up(self, messages):
+        if not messages:
+            return
+        if self.queue.spill is not None:
+            await self.queue.spill_overflow(messages)
+            print(f"INFO: 書き込めなかった {len(messages)} 件を {self.queue.spill.path} へ退避しました（次回起動時に書き込みます）")
+        else:
+            print(f"ERROR: 書き込めなかった {len(messages)} 件を破棄しました")
+
+    async def flush(self, db, batch, mark=None):
+        """溜まったメッセージを1トランザクションで書き込む
+
+        mark: 同じトランザクションで writer_state に残す目印 (key, value)
+        戻り値: 書き込めた（またはデータ自体の不正で捨てた）なら True、
+                DBがロック中などで後から再試行すべきなら False
+        データ自体の不正 (OperationalError 以外) で書けなかった場合は、メッセージごとにセーブポイントを
+        置いて書き直し、書けないメッセージだけを捨てる（seg_writer_dropped_rows に数える）。
+        書き直しも1トランザクションなので、途中で再試行が必要になってもバッチの一部だけがコミットされることはない。
+        """
+        try:
+            await self._commit_batch(db, batch, mark)
+            return True
+        except Exception as e:
+            if not await self._rollback(db, e):
+                return False
+
+        if len(batch) > 1:
+            print(f"WARNING: {len(batch)} 件のバッチを書き込めないため、1件ずつ書き直します")
+        try:
+            await self._commit_batch(db, batch, mark, isolate=True)
+        except Exception as e:
+            if not await self._rollback(db, e):
+                return False
+            # 1件ずつでも書けない（目印・現在値のスナップショットなど）: バッチごと捨てる
+            for message in batch:
+                self._reject(message, e)
+        return True
+
+    async def _rollback(self, db, error):
+        """書き込みの失敗を記録してロールバックする。データ自体の不正なら True（再試行しても書けない）"""
+        self.stats["errors"] += 1
+        self.errors.inc()
+        print(f"WRITER ERROR: {error}")
+        try:
+            await db.rollback()
+        except sqlite3.Error:
+            pass
+        # ロック・ディスク等の一時的な問題 (OperationalError) なら再試行する
+        return not isinstance(error, sqlite3.OperationalError)
+
+    def _reject(self, message, error):
+        """書き込めないメッセージを捨てる"""
+        rows = message_rows(message)
+        self.queue.dropped_rows += rows
+        print(f"ERROR: DBに書き込めない {message[0]} ({rows}行) を破棄しました: {error}")
+
+    async def _commit_batch(self, db, batch, mark=None, isolate=False):
+        """メッセージを1トランザクションで書き込む（失敗時の例外はそのまま送出する）
+
+        mark: 同じトランザクションで writer_state に残す目印 (key, value)
+        isolate: メッセージごとにセーブポイントを置き、書けないメッセージ (OperationalError 以外) だけを捨てる
+        """
+        started = time.perf_counter()
+        rejected = []
+        if isolate:
+            if not db.in_transaction:
+                await db.execute("BEGIN")
+            latest = {}
+            history_rows = 0
+            for message in batch:
+                await db.execute("SAVEPOINT message")
+                try:
+                    written = await self._apply(db, [message])
+                except sqlite3.OperationalError:
+                    raise
+                except Exception as e:
+                    await db.execute("ROLLBACK TO message")
+                    rejected.append((message, e))
+                else:
+                    latest.update(written[0])
+                    history_rows += written[1]
+                await db.execute("RELEASE message")
+        else:
+            latest, history_rows = await self._apply(db, batch)
+
+        # 共有メモリの表があれば、items の現在値は snapshot_interval ごとにまとめて書く
+        # （self.snapshot はコミットできてから更新する。書けずに捨てたバッチの値を後から書かない）
+        snapshot = {}
+        if self.live is None or time.monotonic() >= self.next_snapshot:
+            snapshot = {**self.snapshot, **latest}
+        if snapshot:
+            # items.updated_at は画面・APIでそのまま表示するのでローカル時刻の文字列で持つ
+            # （同じサイクルの値は同じ時刻なので、変換は時刻ごとに1回だけ）
+            texts = {ts: history_partitions.local_text(ts) for ts in {ts for _, ts in snapshot.values()}}
+            await db.executemany(
+                "UPDATE items SET last_value = ?, updated_at = ? WHERE id = ?",
+                [(value, texts[ts], item_id) for item_id, (value, ts) in snapshot.items()]
+            )
+        if mark is not None:
+            await db.execute(MARK_SQL, mark)
+        await db.commit()
+
+        for message, error in rejected:
+            self._reject(message, error)
+        if snapshot:
+            self.snapshot = {}
+            self.next_snapshot = time.monotonic() + self.snapshot_interval
+        else:
+            self.snapshot.update(latest)
+        self.stats["flushes"] += 1
+        self.stats["rows"] += len(snapshot)
+        self.stats["history_rows"] += history_rows
+        elapsed = time.perf_counter() - started
+        self.stats["last_commit_ms"] = elapsed * 1000
+        self.commit_seconds.observe(elapsed)
+        self.items_committed.inc(len(snapshot))
+        self.history_committed.inc(history_rows)
+
+    async def _apply(self, db, batch):
+        """メッセージを現在のトランザクションに書き込む（items の現在値以外）
+
+        戻り値: (item_id -> (value, ts) 最後の値, history に書いた行数)
+        """
+        history_rows = []
+        latest = {}  # item_id -> (value, ts) 同一窓内は最後の値だけ反映すれば良い
+        host_status = {}
+        item_status = {}
+        events = []  # 発生/復旧は順序が意味を持つので届いた順に実行する
+
+        for kind, payload in batch:
+            if kind == "values":
+                for item_id, value, ts, record_history in payload:
+                    if ts.__class__ is str:
+                        # 旧バージョンが退避ファイルに残したローカル時刻の文字列
+                        ts = history_partitions.from_local_text(ts)
+                    if record_history:
+                        history_rows.append((item_id, ts, value))
+                    latest[item_id] = (value, ts)
+            elif kind == "host_status":
+                host_id, status, timestamp = payload
+                host_status[host_id] = (status, timestamp)
+            elif kind == "item_status":
+                status, item_id = payload
+                item_status[item_id] = status
+            elif kind == "events":
+                events.extend(payload)
+
+        # history は時刻ごとのパーティションへ振り分けて書く（無ければここで作る）
+        partitions = {}
+        for row in history_rows:
+            partitions.setdefault(history_partitions.partition_name(row[1]), []).append(row)
+        for name, rows in partitions.items():
+            for sql in history_partitions.create_sql(name):
+                await db.execute(sql)
+            await db.executemany(history_partitions.insert_sql(name), rows)
+        # 1分 / 1時間のロールアップは、このバッチ分を集計して足し込む
+        # （同じバッチを二重に足し込まないよう、コミット済みかは writer_state の目印で判断する）
+        for table, params in history_rollups.aggregate(history_rows).items():
+            await db.executemany(history_rollups.UPSERT_SQL[table], params)
+        # 同じ種類が続く区間ごとに executemany する（発生→復旧の順序は保つ）
+        for kind, group in itertools.groupby(events, key=lambda event: event[0]):
+            params = [payload for _, payload in group]
+            if kind == "open":
+                await db.executemany(
+                    """INSERT INTO event_logs (item_id, trigger_id, start_time, trigger_value, threshold_value, status)
+                       VALUES (?, ?, ?, ?, ?, 'active')""",
+                    params
+                )
+            else:
+                await db.executemany(
+                    """UPDATE event_logs
+                       SET end_time = ?, status = 'resolved'
+                       WHERE item_id = ? AND trigger_id IS ? AND status = 'active'""",
+                    params
+                )
+        if item_status:
+            await db.executemany(
+                "UPDATE items SET last_status = ? WHERE id = ?",
+                [(status, item_id) for item_id, status in item_status.items()]
+            )
+        if host_status:
+            await db.executemany(
+                "UPDATE hosts SET status = ?, updated_at = ? WHERE id = ?",
+                [(status, timestamp, host_id) for host_id, (status, timestamp) in host_status.items()]
+            )
+        return latest, len(history_rows)
+
+
+class ForwardingWriter(WriteSubmitter):
+    """ワーカープロセス用: 書き込み要求を multiprocessing.Queue でスーパーバイザーへ転送する
+
+    SQLiteへ書き込むのはスーパーバイザー側の DBWriter 1本だけになる。
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._stopped = asyncio.Event()
+
+    def _put(self, message):
+        self.queue.put(message)
+
+    async def run(self):
+        # 転送は _put で完了しているので、ここでは停止を待つだけ
+        await self._stopped.wait()
+
+    async def stop(self):
+        self._stopped.set()
@@ -0,0 +1,221 @@
+# Poller 負荷試験 (End-to-end benchmark)
+# src.tools.modbus_sim の仮想PLCを別プロセスで立ち上げ、一時DBにホスト・アイテムを登録して
+# ModbusPoller をそのまま動かし、次の値を計測する。
+#
+#   - tags/s           : 収集して書き込みキューへ渡した値の数
+#   - cycle p50/p99    : ホストごとの1サイクル（読み出し〜キュー投入）にかかった時間
+#   - DB write rate    : items / history へ書いた行数、コミット回数とコミット時間
+#   - CPU              : Poller プロセス（書き込みスレッドを含む）の CPU 使用率
+#
+# 実行時コマンド例
+# uv run python -m src.tools.bench_poller --plcs 20 --registers 1000 --duration 30 --latency-ms 5 --jitter-ms 2
+import argparse
+import asyncio
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import time
+
+from src.common.config_loader import config
+from src.engine.decoder import DATA_TYPES, word_count
+from src.tools.modbus_sim import add_simulator_arguments, serve, simulator_from_args
+
+
+def percentile(samples, fraction):
+    """最近傍順位法のパーセンタイル（サンプルが無ければ 0）"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_simulator(args):
+    """シミュレータ用プロセスの入口（spawn で起動されるのでモジュール直下に置く）"""
+    try:
+        asyncio.run(serve(simulator_from_args(args)))
+    except KeyboardInterrupt:
+        pass
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def populate(db_path, args):
+    """仮想PLCの台数・タグ数どおりにホストとアイテムを登録する"""
+    words = word_count(args.data_type)
+    conn = sqlite3.connect(db_path)
+    for index in range(args.plcs):
+        cursor = conn.execute(
+            "INSERT INTO hosts (display_name, ip_address, port, unit_id, pipeline_window) VALUES (?, '127.0.0.1', ?, 1, ?)",
+            (f"SIM{index:03d}", args.port + index, args.pipeline_window)
+        )
+        host_id = cursor.lastrowid
+        conn.executemany(
+            """INSERT INTO items (host_id, tag_name, address, polling_interval, alarm_enabled, data_type)
+               VALUES (?, ?, ?, ?, 0, ?)""",
+            [(host_id, f"SIM{index:03d}_T{tag:05d}", tag * words, args.interval, args.data_type)
+             for tag in range(args.tags)]
+        )
+    conn.commit()
+    conn.close()
+
+
+async def measure(args):
+    # DB_PATH などを差し替えた後に読み込む
+    from src.engine.poller import ModbusPoller
+    from src.engine.writer import DBWriter
+
+    class BenchWriter(DBWriter):
+        """書き込み要求の件数とコミット時間を記録する DBWriter"""
+
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.values = 0
+            self.commit_ms = []
+
+        def submit_values(self, rows):
+            self.values += len(rows)
+            super().submit_values(rows)
+
+        async def flush(self, db, batch, mark=None):
+            started = time.perf_counter()
+            written = await super().flush(db, batch, mark)
+            self.commit_ms.append((time.perf_counter() - started) * 1000)
+            return written
+
+    class BenchPoller(ModbusPoller):
+        """サイクルごとの所要時間とリクエスト数を記録する ModbusPoller"""
+
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.cycle_seconds = []
+            self.requests = 0
+
+        def record_read_stats(self, host_name, host_id, requests, naive, timer):
+            super().record_read_stats(host_name, host_id, requests, naive, timer)
+            self.requests += requests
+            # CycleTimer.finish() の後に呼ばれるので、last_duration は今回のサイクル
+            self.cycle_seconds.append(timer.last_duration)
+
+    writer = BenchWriter(config.db_path, max_batch=config.writer_max_batch, max_latency=config.writer_max_latency,
+                         buffer_max_rows=config.writer_buffer_max_rows)
+    poller = BenchPoller(writer=writer)
+    task = asyncio.create_task(poller.run())
+
+    await asyncio.sleep(args.warmup)
+    # ウォームアップ（接続・初回の計画作成）の分は捨てる
+    poller.cycle_seconds.clear()
+    poller.requests = 0
+    writer.values = 0
+    writer.commit_ms.clear()
+    rows, history_rows, flushes = writer.stats["rows"], writer.stats["history_rows"], writer.stats["flushes"]
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    await asyncio.sleep(args.duration)
+
+    elapsed = time.perf_counter() - wall
+    result = {
+        "elapsed": elapsed,
+        "cpu_percent": (time.process_time() - cpu) / elapsed * 100,
+        "values": writer.values,
+        "requests": poller.requests,
+        "cycles": list(poller.cycle_seconds),
+        "overruns": sum(timer.overruns for timer in poller.cycle_timers.values()),
+        "host_states": [link.state for link in poller.host_links.values()],
+        "rows": writer.stats["rows"] - rows,
+        "history_rows": writer.stats["history_rows"] - history_rows,
+        "flushes": writer.stats["flushes"] - flushes,
+        "commit_ms": list(writer.commit_ms),
+        "queue_depth": writer.queue.qsize(),
+        "write_errors": writer.stats["errors"],
+    }
+
+    poller.running = False
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return result
+
+
+def report(args, result):
+    elapsed = result["elapsed"]
+    cycles = result["cycles"]
+    online = sum(1 for state in result["host_states"] if state in ("Online", "Degraded"))
+    print(f"=== {args.plcs} PLCs x {args.tags} tags ({args.data_type}), interval {args.interval}s, "
+          f"pipeline window {args.pipeline_window}, {elapsed:.1f}s measured ===")
+    print(f"tags/s          : {result['values'] / elapsed:,.0f}  (expected {args.plcs * args.tags / args.interval:,.0f})")
+    print(f"requests/s      : {result['requests'] / elapsed:,.1f}")
+    print(f"cycle           : n={len(cycles)} p50 {percentile(cycles, 0.5) * 1000:.1f}ms "
+          f"p99 {percentile(cycles, 0.99) * 1000:.1f}ms max {max(cycles, default=0) * 1000:.1f}ms, "
+          f"overruns {result['overruns']}")
+    print(f"DB write        : {result['rows'] / elapsed:,.0f} items rows/s, {result['history_rows'] / elapsed:,.0f} history rows/s, "
+          f"{result['flushes'] / elapsed:.1f} commits/s")
+    print(f"commit          : p50 {percentile(result['commit_ms'], 0.5):.1f}ms p99 {percentile(result['commit_ms'], 0.99):.1f}ms, "
+          f"queue depth {result['queue_depth']}, errors {result['write_errors']}")
+    print(f"CPU (poller)    : {result['cpu_percent']:.1f}%")
+    print(f"hosts online    : {online}/{len(result['host_states'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ModbusPoller benchmark against virtual PLCs")
+    add_simulator_arguments(parser)
+    parser.add_argument("--tags", type=int, default=None, help="items per PLC (default: as many as fit in --registers)")
+    parser.add_argument("--data-type", choices=list(DATA_TYPES), default="uint16", help="data type of every item")
+    parser.add_argument("--interval", type=int, default=1, help="polling interval of every item in seconds (default: 1)")
+    parser.add_argument("--pipeline-window", type=int, default=1, help="hosts.pipeline_window (default: 1, serial)")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds (default: 30)")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds discarded before measuring (default: 5)")
+    parser.add_argument("--db", default=None, help="SQLite file to create (default: temporary, removed afterwards)")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="port of the poller metrics endpoint (default: 0, any free port)")
+    parser.add_argument("--external", action="store_true", help="use an already running modbus_sim instead of starting one")
+    args = parser.parse_args()
+
+    capacity = args.registers // word_count(args.data_type)
+    if args.tags is None:
+        args.tags = capacity
+    if args.tags > capacity:
+        parser.error(f"--tags {args.tags} does not fit in {args.registers} registers as {args.data_type}")
+
+    if args.db is not None and os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+    # アーカイブなど DB 以外に書くファイルも一時ディレクトリに置き、本番の data/ には触れない
+    workdir = tempfile.mkdtemp(prefix="bench_poller_")
+    db_path = args.db or os.path.join(workdir, "bench.sqlite")
+
+    config.override("system", db_path=db_path, archive_path=os.path.join(workdir, "archive"))
+    config.override("polling", interval_seconds=args.interval)
+    # 動いている Poller とメトリクスのポートがぶつからないようにする
+    config.override("metrics", port=args.metrics_port, unix_socket=None)
+    from src.common.db_handler import init_db
+    init_db()
+    populate(db_path, args)
+
+    simulator = None
+    if not args.external:
+        simulator = multiprocessing.get_context("spawn").Process(target=run_simulator, args=(args,), daemon=True)
+        simulator.start()
+    try:
+        if not wait_for_port(args.port + args.plcs - 1):
+            raise SystemExit(f"ERROR: simulator is not listening on port {args.port + args.plcs - 1}")
+        result = asyncio.run(measure(args))
+        report(args, result)
+    finally:
+        if simulator is not None:
+            simulator.terminate()
+            simulator.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# 負荷試験用 Modbus TCP シミュレータ
+# SimplePLCSim (Windows) の代わりに、Linux 上でも動く asyncio だけの Modbus TCP サーバーを
+# N 台分立ち上げる。1台ごとに別ポートで待ち受け、M 個のレジスタ（コイル）を持つ。
+#
+#   - FC1/FC2 (コイル/入力ステータス)、FC3/FC4 (保持/入力レジスタ) の読み出しに応答する
+#   - レジスタ値は時刻とアドレスから決まる正弦波（毎秒変化する）
+#   - 範囲外のアドレスは例外応答 (0x02 Illegal Data Address) を返す
+#   - 応答遅延 (latency) と揺らぎ (jitter)、エラー注入を設定できる
+#       timeout_rate    : 応答を返さない（Poller側ではタイムアウトになる）
+#       exception_rate  : 例外応答 (0x04 Server Device Failure) を返す
+#       disconnect_rate : 接続を切る
+#   - 1接続に複数のリクエストが同時に届いても（パイプライン）、それぞれ遅延後に応答する
+#
+# 実行時コマンド例
+# uv run python -m src.tools.modbus_sim --plcs 10 --registers 1000 --port 15020 --latency-ms 5 --jitter-ms 2
+import argparse
+import asyncio
+import math
+import random
+import struct
+import time
+
+# MBAPヘッダ: トランザクションID, プロトコルID, 長さ, ユニットID
+MBAP = struct.Struct(">HHHB")
+READ_REQUEST = struct.Struct(">HH")
+
+EXCEPTION_ILLEGAL_FUNCTION = 0x01
+EXCEPTION_ILLEGAL_ADDRESS = 0x02
+EXCEPTION_DEVICE_FAILURE = 0x04
+
+# 1リクエストで読める最大数 (Modbus仕様)
+MAX_REGISTERS = 125
+MAX_BITS = 2000
+
+# 正弦波の周期(秒)
+WAVE_PERIOD = 60
+
+
+class VirtualPLC:
+    """1台分の仮想PLC（ポート1つ）"""
+
+    def __init__(self, index, port, registers, latency=0.0, jitter=0.0,
+                 timeout_rate=0.0, exception_rate=0.0, disconnect_rate=0.0, rng=None):
+        self.index = index
+        self.port = port
+        self.registers = registers
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.exception_rate = exception_rate
+        self.disconnect_rate = disconnect_rate
+        self.rng = rng or random.Random(index)
+        self.server = None
+        # 統計
+        self.requests = 0
+        self.injected = {"timeout": 0, "exception": 0, "disconnect": 0}
+
+    async def start(self, host="127.0.0.1"):
+        self.server = await asyncio.start_server(self.handle, host, self.port)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    def values(self, function_code, start, count, now):
+        """読み出し対象の値（時刻とアドレスから決まる正弦波。PLCごとに位相をずらす）"""
+        phase = now * 2 * math.pi / WAVE_PERIOD + self.index
+        if function_code in (1, 2):
+            return [1 if math.sin(phase + address) > 0 else 0 for address in range(start, start + count)]
+        return [int(32768 + 30000 * math.sin(phase + address * 0.1)) for address in range(start, start + count)]
+
+    def respond(self, function_code, pdu):
+        """リクエストPDUに対する応答PDU"""
+        if function_code not in (1, 2, 3, 4):
+            return bytes((function_code | 0x80, EXCEPTION_ILLEGAL_FUNCTION))
+        start, count = READ_REQUEST.unpack_from(pdu, 1)
+        limit = MAX_BITS if function_code in (1, 2) else MAX_REGISTERS
+        if count < 1 or count > limit or start + count > self.registers:
+            return bytes((function_code | 0x80, EXCEPTION_ILLEGAL_ADDRESS))
+
+        values = self.values(function_code, start, count, time.time())
+        if function_code in (1, 2):
+            packed = bytearray((count + 7) // 8)
+            for i, bit in enumerate(values):
+                if bit:
+                    packed[i // 8] |= 1 << (i % 8)
+            return bytes((function_code, len(packed))) + bytes(packed)
+        return bytes((function_code, count * 2)) + struct.pack(f">{count}H", *values)
+
+    async def reply(self, writer, transaction_id, unit_id, function_code, pdu):
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if writer.is_closing():
+            return
+
+        draw = self.rng.random()
+        if draw < self.disconnect_rate:
+            self.injected["disconnect"] += 1
+            writer.close()
+            return
+        draw -= self.disconnect_rate
+        if draw < self.timeout_rate:
+            self.injected["timeout"] += 1
+            return
+        draw -= self.timeout_rate
+        if draw < self.exception_rate:
+            self.injected["exception"] += 1
+            response = bytes((function_code | 0x80, EXCEPTION_DEVICE_FAILURE))
+        else:
+            response = self.respond(function_code, pdu)
+        writer.write(MBAP.pack(transaction_id, 0, len(response) + 1, unit_id) + response)
+
+    async def handle(self, reader, writer):
+        pending = set()
+        try:
+            while True:
+                header = await reader.readexactly(MBAP.size)
+                transaction_id, _, length, unit_id = MBAP.unpack(header)
+                pdu = await reader.readexactly(length - 1)
+                self.requests += 1
+                # 応答待ちの間も次のリクエストを受け付ける（パイプライン対応）
+                task = asyncio.create_task(self.reply(writer, transaction_id, unit_id, pdu[0], pdu))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+
+class Simulator:
+    """N台の仮想PLC (ポートは port, port+1, ...)"""
+
+    def __init__(self, plcs, registers, port=15020, seed=None, **options):
+        rng = random.Random(seed)
+        self.plcs = [
+            VirtualPLC(index, port + index, registers, rng=random.Random(rng.random()), **options)
+            for index in range(plcs)
+        ]
+
+    async def start(self, host="127.0.0.1"):
+        for plc in self.plcs:
+            await plc.start(host)
+
+    def close(self):
+        for plc in self.plcs:
+            plc.close()
+
+    def stats(self):
+        injected = {"timeout": 0, "exception": 0, "disconnect": 0}
+        for plc in self.plcs:
+            for key, count in plc.injected.items():
+                injected[key] += count
+        return {"requests": sum(plc.requests for plc in self.plcs), "injected": injected}
+
+
+def add_simulator_arguments(parser):
+    """シミュレータの設定項目（ベンチマークコマンドと共通）"""
+    parser.add_argument("--plcs", type=int, default=4, help="number of virtual PLCs (default: 4)")
+    parser.add_argument("--registers", type=int, default=1000, help="registers per PLC (default: 1000)")
+    parser.add_argument("--port", type=int, default=15020, help="port of the first PLC; others follow (default: 15020)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="response delay per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- variation of the response delay")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of requests left unanswered")
+    parser.add_argument("--exception-rate", type=float, default=0.0, help="fraction answered with exception 0x04")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="fraction that close the connection")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for jitter and error injection")
+
+
+def simulator_from_args(args):
+    return Simulator(
+        args.plcs, args.registers, port=args.port, seed=args.seed,
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+        timeout_rate=args.timeout_rate, exception_rate=args.exception_rate,
+        disconnect_rate=args.disconnect_rate,
+    )
+
+
+async def serve(simulator, host="127.0.0.1"):
+    await simulator.start(host)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        simulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual Modbus TCP PLCs for load testing")
+    add_simulator_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1", help="listen address (default: 127.0.0.1)")
+    args = parser.parse_args()
+
+    simulator = simulator_from_args(args)
+    print(f"INFO: {args.plcs} PLCs x {args.registers} registers on ports {args.port}-{args.port + args.plcs - 1}")
+    try:
+        asyncio.run(serve(simulator, args.host))
+    except KeyboardInterrupt:
+        print(f"INFO: stopped ({simulator.stats()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,111 +1,163 @@
-from fastapi import FastAPI, Request, Form, UploadFile, File
+from fastapi import FastAPI, Request, Form, UploadFile, File, Depends
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response
 import aiosqlite
 import os
 import yaml
 from fastapi.responses import StreamingResponse
 import io
-import time
+import asyncio
+from contextlib import asynccontextmanager
 
 # from src.web import api_v1
-from src.web import api_v1
-
-app = FastAPI()
-app.include_router(api_v1.router)
-templates = Jinja2Templates(directory="src/web/templates")
+from src.web import api_v1, fragment_cache
+from src.web.db_pool import WEB_REGISTRY, ConnectionPool, read_db, write_db
+from src.web.live_stream import ChangeFeed
+from src.web.live_view import LiveView, is_alarm
 
+from src.common import history_archive, history_partitions, history_rollups
 from src.common.config_loader import config
+from src.engine.decoder import DATA_TYPES, format_value
+from src.engine.read_planner import MODBUS_MAX_COUNT
 
 # DBパスをconfigから取得
 DB_PATH = config.db_path
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # DB接続はリクエストごとに開かず、起動時にプールを作って使い回す
+    pool = ConnectionPool(
+        DB_PATH,
+        readers=config.web_pool_readers,
+        mmap_size_mb=config.web_pool_mmap_size_mb,
+        cache_size_mb=config.web_pool_cache_size_mb,
+    )
+    await pool.open()
+    app.state.db_pool = pool
+    # 現在値は設定のキャッシュと共有メモリの表から返す（リクエストごとの SQL を無くす）
+    live_view = LiveView(pool, config.live_values_path)
+    await live_view.refresh()
+    app.state.live_view = live_view
+    # ダッシュボードへは変化したアイテムだけを配信する (/api/dashboard_stream)
+    change_feed = ChangeFeed(live_view)
+    app.state.change_feed = change_feed
+    tasks = [asyncio.create_task(live_view.run()), asyncio.create_task(change_feed.run())]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(api_v1.router)
+templates = Jinja2Templates(directory="src/web/templates")
+# 値の表示（float32 の値は有効桁に丸めて表示する。記録する値は丸めない）
+templates.env.filters["value_text"] = format_value
+
 RETENTION_MINUTES = config.retention_minutes
-last_cleanup_time = 0  # 前回の実行時間を保持するグローバル変数
+
+# ダッシュボードの表は閲覧者ごと・数秒ごとに描画されるので、テンプレートは起動時に1回だけコンパイルする
+DASHBOARD_FRAGMENT = templates.get_template("dashboard_fragment.html")
+dashboard_cache = fragment_cache.FragmentCache()
 
 @app.get("/")
 async def index(request: Request):
-    # 最新値キャッシュ(items)を取得
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT tag_name, last_value, updated_at FROM items")
-        items = await cursor.fetchall()
+    # 最新値は共有メモリの表から（SQL は実行しない）
+    items = request.app.state.live_view.rows()
     
     return templates.TemplateResponse("index.html", {"request": request, "items": items})
 
 @app.post("/update_config")
-async def update_config(tag_name: str = Form(...), new_threshold: float = Form(...)):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE items SET threshold = ? WHERE tag_name = ?",
-            (new_threshold, tag_name)
-        )
-        await db.commit()
+async def update_config(tag_name: str = Form(...), new_threshold: float = Form(...), db: aiosqlite.Connection = Depends(write_db)):
+    await db.execute(
+        "UPDATE items SET threshold = ? WHERE tag_name = ?",
+        (new_threshold, tag_name)
+    )
+    await db.commit()
     # ここでDBが更新されると、別プロセスのWatcherが検知する流れ
     return RedirectResponse(url="/", status_code=303)
 
 @app.get("/hosts")
-async def list_hosts(request: Request):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute("SELECT * FROM hosts")
-        hosts = await cursor.fetchall()
+async def list_hosts(request: Request, db: aiosqlite.Connection = Depends(read_db)):
+    cursor = await db.execute("SELECT * FROM hosts")
+    hosts = await cursor.fetchall()
     return templates.TemplateResponse("hosts.html", {"request": request, "hosts": hosts})
 
 @app.post("/add_host")
-async def add_host(display_name: str = Form(...), ip_address: str = Form(...), port: int = Form(502)):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO hosts (display_name, ip_address, port) VALUES (?, ?, ?)",
-            (display_name, ip_address, port)
-        )
-        await db.commit()
+async def add_host(
+    display_name: str = Form(...),
+    ip_address: str = Form(...),
+    port: int = Form(502),
+    unit_id: int = Form(1),
+    pipeline_window: int = Form(1),   # 1接続で同時に送るリクエスト数 (1=直列)
+    timeout: float | None = Form(None),
+    db: aiosqlite.Connection = Depends(write_db)
+):
+    await db.execute(
+        "INSERT INTO hosts (display_name, ip_address, port, unit_id, pipeline_window, timeout) VALUES (?, ?, ?, ?, ?, ?)",
+        (display_name, ip_address, port, unit_id, max(1, pipeline_window), timeout)
+    )
+    await db.commit()
     return RedirectResponse(url="/hosts", status_code=303)
 
 @app.post("/delete_host/{host_id}")
-async def delete_host(host_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        # 1. 紐づく監視項目(items)を先に削除
-        await db.execute("DELETE FROM items WHERE host_id = ?", (host_id,))
-        # 2. PLC本体(hosts)を削除
-        await db.execute("DELETE FROM hosts WHERE id = ?", (host_id,))
-        await db.commit()
+async def delete_host(host_id: int, db: aiosqlite.Connection = Depends(write_db)):
+    # 1. 紐づく監視項目(items)とそのトリガーを先に削除
+    await db.execute("DELETE FROM triggers WHERE item_id IN (SELECT id FROM items WHERE host_id = ?)", (host_id,))
+    await db.execute("DELETE FROM items WHERE host_id = ?", (host_id,))
+    # 2. PLC本体(hosts)を削除
+    await db.execute("DELETE FROM hosts WHERE id = ?", (host_id,))
+    await db.commit()
     
     return RedirectResponse(url="/hosts", status_code=303)
 
 @app.get("/hosts/{host_id}/items")
-async def list_host_items(request: Request, host_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        # PLC情報の取得
-        cursor = await db.execute("SELECT * FROM hosts WHERE id = ?", (host_id,))
-        host = await cursor.fetchone()
-        # そのPLCに紐づくアイテム一覧の取得
-        cursor = await db.execute("SELECT * FROM items WHERE host_id = ?", (host_id,))
-        items = await cursor.fetchall()
+async def list_host_items(request: Request, host_id: int, db: aiosqlite.Connection = Depends(read_db)):
+    # PLC情報の取得
+    cursor = await db.execute("SELECT * FROM hosts WHERE id = ?", (host_id,))
+    host = await cursor.fetchone()
+    # そのPLCに紐づくアイテム一覧の取得
+    cursor = await db.execute("SELECT * FROM items WHERE host_id = ?", (host_id,))
+    items = await cursor.fetchall()
         
     return templates.TemplateResponse("host_items.html", {
         "request": request, 
         "host": host, 
-        "items": items
+        "items": items,
+        "reg_types": list(MODBUS_MAX_COUNT),
+        "data_types": list(DATA_TYPES)
     })
 
 @app.post("/hosts/{host_id}/add_item")
-async def add_item(host_id: int, tag_name: str = Form(...), address: int = Form(...), alarm_threshold: float = Form(...), polling_interval: int = Form(...) ):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO items (tag_name, address, host_id, alarm_threshold, alarm_enabled, polling_interval) VALUES (?, ?, ?, ?, ?, ?)",
-            (tag_name, address, host_id, alarm_threshold, 1, polling_interval)
-        )
-        await db.commit()
+async def add_item(
+    host_id: int, tag_name: str = Form(...), address: int = Form(...), alarm_threshold: float = Form(...), polling_interval: int = Form(...),
+    deadband: float = Form(0.0), deadband_type: str = Form("absolute"), swinging_door: int = Form(0), max_interval: int = Form(0),
+    reg_type: str = Form("holding"), data_type: str = Form("uint16"), word_order: str = Form("big"),
+    scale: float = Form(1.0), value_offset: float = Form(0.0),
+    db: aiosqlite.Connection = Depends(write_db)
+):
+    await db.execute(
+        """INSERT INTO items (tag_name, address, host_id, alarm_threshold, alarm_enabled, polling_interval,
+                              deadband, deadband_type, swinging_door, max_interval,
+                              reg_type, data_type, word_order, scale, value_offset)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (tag_name, address, host_id, alarm_threshold, 1, polling_interval,
+         deadband, deadband_type, swinging_door, max_interval,
+         reg_type, data_type, word_order, scale, value_offset)
+    )
+    await db.commit()
     return RedirectResponse(url=f"/hosts/{host_id}/items", status_code=303)
 
 @app.post("/hosts/{host_id}/delete_item/{item_id}")
-async def delete_item(host_id: int, item_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM items WHERE id = ?", (item_id,))
-        await db.commit()
+async def delete_item(host_id: int, item_id: int, db: aiosqlite.Connection = Depends(write_db)):
+    await db.execute("DELETE FROM triggers WHERE item_id = ?", (item_id,))
+    await db.execute("DELETE FROM items WHERE id = ?", (item_id,))
+    await db.commit()
     return RedirectResponse(url=f"/hosts/{host_id}/items", status_code=303)
 
 @app.post("/hosts/{host_id}/update_item/{item_id}")
@@ -116,21 +168,34 @@ async def update_item(
     address: int = Form(...),
     alarm_threshold: float = Form(0.0),
     alarm_enabled: int = Form(0),
-    polling_interval: int = Form(5) # ← 追加
+    polling_interval: int = Form(5), # ← 追加
+    deadband: float = Form(0.0),
+    deadband_type: str = Form("absolute"),
+    swinging_door: int = Form(0),
+    max_interval: int = Form(0),
+    reg_type: str = Form("holding"),
+    data_type: str = Form("uint16"),
+    word_order: str = Form("big"),
+    scale: float = Form(1.0),
+    value_offset: float = Form(0.0),
+    db: aiosqlite.Connection = Depends(write_db)
 ):
     # --- デバッグ用プリント (intervalも追加) ---
     print("--- DEBUG: update_item received ---")
     print(f"Item ID: {item_id}, Interval: {polling_interval}")
     print("-----------------------------------")
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """UPDATE items 
-               SET tag_name = ?, address = ?, alarm_threshold = ?, alarm_enabled = ?, polling_interval = ? 
-               WHERE id = ?""",
-            (tag_name, address, alarm_threshold, alarm_enabled, polling_interval, item_id) # ← 引数追加
-        )
-        await db.commit()
+    await db.execute(
+        """UPDATE items 
+           SET tag_name = ?, address = ?, alarm_threshold = ?, alarm_enabled = ?, polling_interval = ?,
+               deadband = ?, deadband_type = ?, swinging_door = ?, max_interval = ?,
+               reg_type = ?, data_type = ?, word_order = ?, scale = ?, value_offset = ?
+           WHERE id = ?""",
+        (tag_name, address, alarm_threshold, alarm_enabled, polling_interval,
+         deadband, deadband_type, swinging_door, max_interval,
+         reg_type, data_type, word_order, scale, value_offset, item_id) # ← 引数追加
+    )
+    await db.commit()
     return RedirectResponse(url=f"/hosts/{host_id}/items", status_code=303)
 
 @app.get("/api/dashboard_fragment")
@@ -139,32 +204,47 @@ async def get_dashboard_fragment(
     host_filter: str = "",
     search: str = "",
     only_positive: bool = False,  # 0以上のアイテムのみ
-    only_alarm: bool = False      # アラート中のみ
+    only_alarm: bool = False,     # アラート中のみ
 ):
-    
-    # ダッシュボード更新のリクエストが来るたびにチェック（実際には1分に1回だけ動く）
-    await cleanup_old_data()
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-
-        # --- 1. 統計情報の取得（前回と同じ） ---
-        cursor = await db.execute("""
-            SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN alarm_enabled = 1 AND last_value >= alarm_threshold THEN 1 ELSE 0 END) as alarms,
-                SUM(CASE WHEN last_value IS NULL THEN 1 ELSE 0 END) as no_data
-            FROM items
-        """)
-        stats = await cursor.fetchone()
-
-        # --- 2. メインクエリ構築 ---
-        query = """
+    # 表はデータの版（ChangeFeed の連番と、スパークラインの履歴のコミットの目印）と絞り込み条件で決まる。
+    # 変わっていなければ 304 を返し、同じ条件の閲覧者には描画済みの結果を返す
+    change_feed = request.app.state.change_feed
+    version = (change_feed.epoch, change_feed.sequence, request.app.state.live_view.data_version)
+    key = (host_filter, search, only_positive, only_alarm)
+    tag = fragment_cache.etag(version, key)
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}
+    if fragment_cache.matches(request.headers.get("if-none-match"), tag):
+        dashboard_cache.count("not_modified")
+        return Response(status_code=304, headers=headers)
+
+    content = await dashboard_cache.get(
+        version, key,
+        lambda: render_dashboard_fragment(request.app, host_filter, search, only_positive, only_alarm),
+    )
+    return HTMLResponse(content=content, headers=headers)
+
+
+async def render_dashboard_fragment(app, host_filter, search, only_positive, only_alarm):
+    # --- 1. 統計情報（現在値は共有メモリの表から。SQL は実行しない） ---
+    live_view = app.state.live_view
+    current = live_view.rows()
+    stats = {
+        "total": len(current),
+        "alarms": sum(1 for item in current if is_alarm(item)),
+        "no_data": sum(1 for item in current if item['last_value'] is None),
+    }
+
+    # --- 2. メインクエリ構築 ---
+    async with app.state.db_pool.reader() as db:
+        # スパークライン用の直近の値は、新しい2つのパーティションだけから取る
+        recent_history, _ = history_partitions.union_sql(
+            (await history_partitions.list_partitions(db))[-2:], "value, ts", "item_id = items.id"
+        )
+        query = f"""
             SELECT items.*, hosts.display_name as host_name, hosts.status as host_status,
             (SELECT GROUP_CONCAT(value) FROM (
-                SELECT value FROM history 
-                WHERE item_id = items.id 
-                ORDER BY timestamp DESC LIMIT 10
+                SELECT value FROM ({recent_history})
+                ORDER BY ts DESC LIMIT 10
             )) as recent_values
             FROM items 
             JOIN hosts ON items.host_id = hosts.id
@@ -182,144 +262,57 @@ async def get_dashboard_fragment(
             query += " AND items.tag_name LIKE ?"
             params.append(f"%{search}%")
 
-        if only_positive:
-            query += " AND items.last_value > 0"
-        
-        if only_alarm:
-            # アラート有効かつ、閾値を超えているもの
-            query += " AND items.alarm_enabled = 1 AND items.last_value >= items.alarm_threshold"
-
         query += " ORDER BY hosts.display_name, items.tag_name"
         
         cursor = await db.execute(query, params)
-        items = await cursor.fetchall()
-
-    # --- 3. サマリーHTML構築 ---
-    # 統計値に基づいて色を決定
-    alarm_color = "#d32f2f" if stats['alarms'] > 0 else "#888"
-    alarm_bg = "rgba(211,47,47,0.1)" if stats['alarms'] > 0 else "transparent"
-
-    summary_html = f"""
-    <div style="display: flex; gap: 1.5rem; margin-bottom: 1rem; padding: 0.5rem 1rem; background: rgba(255,255,255,0.03); border-radius: 8px; align-items: center;">
-        <div style="font-size: 0.85rem;">
-            <span style="color: #888; margin-right: 0.5rem;">Total:</span>
-            <strong style="font-size: 1.1rem;">{stats['total']}</strong>
-        </div>
-        <div style="font-size: 0.85rem; padding: 2px 12px; border-radius: 20px; background: {alarm_bg}; border: 1px solid {alarm_color if stats['alarms'] > 0 else '#444'};">
-            <span style="color: {alarm_color}; margin-right: 0.5rem;">{'⚠️' if stats['alarms'] > 0 else '✅'} Alarms:</span>
-            <strong style="font-size: 1.1rem; color: {alarm_color};">{stats['alarms']}</strong>
-        </div>
-        <div style="font-size: 0.85rem;">
-            <span style="color: #888; margin-right: 0.5rem;">Offline/No Data:</span>
-            <strong style="font-size: 1.1rem;">{stats['no_data'] or 0}</strong>
-        </div>
-        <div style="flex-grow: 1; text-align: right;">
-            <small style="color: #555; font-size: 0.7rem;">Retention: {RETENTION_MINUTES}min</small>
-        </div>
-    </div>
-    """
-
-    # --- 4. メインダッシュボードHTML構築 ---
-    table_html = """
-    <table role="grid" class="compact-table">
-        <thead>
-            <tr>
-                <th style="width: 80px;">状態</th>
-                <th>ホスト名</th>
-                <th>タグ名</th>
-                <th style="text-align: center;">最新値</th>
-                <th>アラート設定</th>
-                <th>周期</th>
-                <th style="width: 120px; text-align: center;">トレンド</th>
-                <th>最終更新</th>
-                <th>操作</th>
-            </tr>
-        </thead>
-        <tbody>
-    """
+        rows = await cursor.fetchall()
+    # 現在値は共有メモリの表の値に置き換えてから、値による絞り込みをする
+    texts = {}
+    items = [live_view.overlay(row, texts) for row in rows]
+
+    if only_positive:
+        items = [item for item in items if item['last_value'] is not None and item['last_value'] > 0]
     
     for item in items:
-        # --- 変数の定義開始 ---
-        val = item['last_value'] if item['last_value'] is not None else "--"
-        alarm_enabled = item['alarm_enabled'] == 1
-        threshold = item['alarm_threshold']
-        
-        # アラーム判定
-        is_alarm = (alarm_enabled and 
-                    item['last_value'] is not None and 
-                    item['last_value'] >= threshold)
-        
-        host_offline = item['host_status'] == 'Offline'
-        
-        # row_class の定義 (これが漏れていました)
-        row_class = "row-alarm" if is_alarm else ""
-        
-        # 状態ラベル
-        if host_offline:
-            status_label = '<span class="badge" style="background-color: #757575;">通信断</span>'
-        elif is_alarm:
-            status_label = '<span class="badge alarm">異常</span>'
-        else:
-            status_label = '<span class="badge normal">正常</span>'
+        item['alarm'] = is_alarm(item)
+        item['offline'] = item['host_status'] == 'Offline'
 
-        # アラート設定とスタイル
-        if alarm_enabled:
-            alert_cfg_html = f'<span style="color: var(--primary); font-size: 0.8rem;">🔔 ON (>= {threshold})</span>'
-            val_style = "font-size: 1.2rem; color: var(--h1-color);"
-        else:
-            alert_cfg_html = '<span style="color: #666; font-size: 0.8rem;">🔕 OFF</span>'
-            val_style = "font-size: 1.2rem; color: #666; opacity: 0.5;"
-
-        history_data = item['recent_values'] or ""
-        # --- 変数の定義終了 ---
-
-        table_html += f"""
-        <tr class="{row_class}">
-            <td>{status_label}</td>
-            <td><strong>{item['host_name']}</strong></td>
-            <td><code>{item['tag_name']}</code></td>
-            <td style="font-family: monospace; font-weight: bold; text-align: center; {val_style}">
-                {val}
-            </td>
-            <td>{alert_cfg_html}</td>
-            <td><small>{item['polling_interval']}s</small></td>
-            
-            <td style="vertical-align: middle; text-align: center; background: rgba(255,255,255,0.05);">
-                <canvas class="sparkline-canvas" 
-                        data-values="{history_data}" 
-                        width="100" height="25"></canvas>
-            </td>
-
-            <td><small>{item['updated_at'] or '-'}</small></td>
-            <td>
-                <a href="/items/{item['id']}/history" role="button" class="outline secondary" 
-                   style="font-size: 0.7rem; padding: 2px 8px; margin-bottom: 0;">
-                    📈 履歴
-                </a>
-            </td>
-        </tr>
-        """
-    
-    table_html += "</tbody></table>"
-    return HTMLResponse(content=summary_html + table_html)
+    if only_alarm:
+        # アラート有効かつ、閾値を超えているもの
+        items = [item for item in items if item['alarm']]
+
+    # --- 3. HTML構築（コンパイル済みのテンプレートで1回だけ文字列を組み立てる） ---
+    return DASHBOARD_FRAGMENT.render(stats=stats, items=items, retention_minutes=RETENTION_MINUTES)
+
+@app.get("/api/dashboard_stream")
+async def dashboard_stream(request: Request, since: str | None = None):
+    # 変化したアイテムの値とアラームの発生/解除を Server-Sent Events で送る
+    # 再接続時はブラウザが送る Last-Event-ID（または since）より後の分だけを送る
+    last_event_id = request.headers.get("last-event-id") or since
+    return StreamingResponse(
+        request.app.state.change_feed.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/alerts")
-async def list_alerts(request: Request):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        # event_logs と items, hosts を結合して、詳細な情報を取得
-        cursor = await db.execute("""
-            SELECT 
-                e.*, 
-                i.tag_name, 
-                h.display_name as host_name
-            FROM event_logs e
-            JOIN items i ON e.item_id = i.id
-            JOIN hosts h ON i.host_id = h.id
-            ORDER BY e.start_time DESC
-            LIMIT 50
-        """)
-        alerts = await cursor.fetchall()
+async def list_alerts(request: Request, db: aiosqlite.Connection = Depends(read_db)):
+    # event_logs と items, hosts を結合して、詳細な情報を取得
+    cursor = await db.execute("""
+        SELECT 
+            e.*, 
+            i.tag_name, 
+            h.display_name as host_name,
+            t.name as trigger_name,
+            t.cond_op
+        FROM event_logs e
+        JOIN items i ON e.item_id = i.id
+        JOIN hosts h ON i.host_id = h.id
+        LEFT JOIN triggers t ON e.trigger_id = t.id
+        ORDER BY e.start_time DESC
+        LIMIT 50
+    """)
+    alerts = await cursor.fetchall()
         
     return templates.TemplateResponse("alerts.html", {
         "request": request,
@@ -333,15 +326,15 @@ async def add_item(
     address: int = Form(...),
     alarm_threshold: float = Form(100.0), # デフォルト値
     alarm_enabled: int = Form(0),          # デフォルトOFF
-    polling_interval: int = Form(5)
+    polling_interval: int = Form(5),
+    db: aiosqlite.Connection = Depends(write_db)
 ):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """INSERT INTO items (tag_name, address, host_id, alarm_threshold, alarm_enabled, polling_interval) 
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (tag_name, address, host_id, alarm_threshold, alarm_enabled, polling_interval)
-        )
-        await db.commit()
+    await db.execute(
+        """INSERT INTO items (tag_name, address, host_id, alarm_threshold, alarm_enabled, polling_interval) 
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (tag_name, address, host_id, alarm_threshold, alarm_enabled, polling_interval)
+    )
+    await db.commit()
     return RedirectResponse(url=f"/hosts/{host_id}/items", status_code=303)
 
 @app.post("/hosts/{host_id}/update_item/{item_id}")
@@ -351,75 +344,60 @@ async def update_item(
     tag_name: str = Form(...), 
     address: int = Form(...),
     alarm_threshold: float = Form(0.0),
-    alarm_enabled: int = Form(0)
+    alarm_enabled: int = Form(0),
+    db: aiosqlite.Connection = Depends(write_db)
 ):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """UPDATE items 
-               SET tag_name = ?, address = ?, alarm_threshold = ?, alarm_enabled = ? 
-               WHERE id = ?""",
-            (tag_name, address, alarm_threshold, alarm_enabled, item_id)
-        )
-        await db.commit()
+    await db.execute(
+        """UPDATE items 
+           SET tag_name = ?, address = ?, alarm_threshold = ?, alarm_enabled = ? 
+           WHERE id = ?""",
+        (tag_name, address, alarm_threshold, alarm_enabled, item_id)
+    )
+    await db.commit()
     return RedirectResponse(url=f"/hosts/{host_id}/items", status_code=303)
 
 @app.get("/history/{tag_name}")
-async def get_item_history(tag_name: str, hours: int = 24):
+async def get_item_history(tag_name: str, hours: int = 24, max_points: int = history_rollups.DEFAULT_MAX_POINTS, db: aiosqlite.Connection = Depends(read_db)):
     """SCADA向け：特定タグの過去履歴を取得"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        
-        # 1. まずtag_nameからitem_idを特定
-        cursor = await db.execute("SELECT id FROM items WHERE tag_name = ?", (tag_name,))
-        item = await cursor.fetchone()
-        if not item:
-            return {"error": f"Tag '{tag_name}' not found"}, 404
-            
-        # 2. 指定された時間分の履歴を取得
-        cursor = await db.execute("""
-            SELECT timestamp, value 
-            FROM history 
-            WHERE item_id = ? 
-              AND timestamp >= DATETIME('now', 'localtime', ?)
-            ORDER BY timestamp ASC
-        """, (item["id"], f"-{hours} hours"))
-        
-        rows = await cursor.fetchall()
-        
-        # SCADAのグラフライブラリ(Chart.js等)が扱いやすい形式に整形
-        values = [[row["timestamp"], row["value"]] for row in rows]
+    
+    # 1. まずtag_nameからitem_idを特定
+    cursor = await db.execute("SELECT id FROM items WHERE tag_name = ?", (tag_name,))
+    item = await cursor.fetchone()
+    if not item:
+        return {"error": f"Tag '{tag_name}' not found"}, 404
         
-        return {
-            "tag": tag_name,
-            "count": len(values),
-            "values": values
-        }
+    # 2. 指定された時間分の履歴を取得（max_points 点に収まるよう、必要なら1分/1時間の集計を返す）
+    # SCADAのグラフライブラリ(Chart.js等)が扱いやすいよう、各点の先頭2列は [時刻, 値]
+    resolution, values = await history_rollups.fetch_history(
+        db, item["id"], history_partitions.epoch_ms_ago(hours=hours), max(1, max_points)
+    )
+    
+    return {
+        "tag": tag_name,
+        "resolution": resolution,
+        "count": len(values),
+        "values": values
+    }
 
 @app.get("/items/{item_id}/history")
-async def item_history_view(request: Request, item_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        
-        # 1. アイテム名とホスト名を取得（画面のタイトル用）
-        cursor = await db.execute("""
-            SELECT i.*, h.display_name as host_name 
-            FROM items i JOIN hosts h ON i.host_id = h.id 
-            WHERE i.id = ?
-        """, (item_id,))
-        item = await cursor.fetchone()
-        
-        if not item:
-            return HTMLResponse(content="Item not found", status_code=404)
-
-        # 2. 直近50件の履歴を取得
-        cursor = await db.execute("""
-            SELECT value, timestamp 
-            FROM history 
-            WHERE item_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT 50
-        """, (item_id,))
-        history = await cursor.fetchall()
+async def item_history_view(request: Request, item_id: int, db: aiosqlite.Connection = Depends(read_db)):
+    
+    # 1. アイテム名とホスト名を取得（画面のタイトル用）
+    cursor = await db.execute("""
+        SELECT i.*, h.display_name as host_name 
+        FROM items i JOIN hosts h ON i.host_id = h.id 
+        WHERE i.id = ?
+    """, (item_id,))
+    item = await cursor.fetchone()
+    
+    if not item:
+        return HTMLResponse(content="Item not found", status_code=404)
+
+    # 2. 直近50件の履歴を取得
+    history = [
+        {"value": value, "timestamp": history_partitions.local_text(ts)}
+        for value, ts in await history_partitions.fetch_recent(db, item_id, 50)
+    ]
         
     return templates.TemplateResponse("history_detail.html", {
         "request": request,
@@ -434,36 +412,60 @@ async def settings_page(request: Request):
 
 # --- エクスポート機能 ---
 @app.get("/settings/export/yaml")
-async def export_yaml():
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        # 1. ホスト一覧を取得
-        cursor = await db.execute("SELECT * FROM hosts")
-        hosts = await cursor.fetchall()
-        
-        config_data = {"hosts": []}
-        
-        for host in hosts:
-            host_dict = {
-                "display_name": host["display_name"],
-                "ip_address": host["ip_address"],
-                "port": host["port"],
-                "unit_id": host["unit_id"],
-                "is_active": bool(host["is_active"]),
-                "items": []
-            }
-            # 2. そのホストに紐づくアイテムを取得
-            item_cursor = await db.execute("SELECT * FROM items WHERE host_id = ?", (host["id"],))
-            items = await item_cursor.fetchall()
-            for item in items:
-                host_dict["items"].append({
-                    "tag_name": item["tag_name"],
-                    "address": item["address"],
-                    "alarm_threshold": item["alarm_threshold"],
-                    "alarm_enabled": bool(item["alarm_enabled"]),
-                    "polling_interval": item["polling_interval"]
-                })
-            config_data["hosts"].append(host_dict)
+async def export_yaml(db: aiosqlite.Connection = Depends(read_db)):
+    # 1. ホスト一覧を取得
+    cursor = await db.execute("SELECT * FROM hosts")
+    hosts = await cursor.fetchall()
+    
+    config_data = {"hosts": []}
+    
+    for host in hosts:
+        host_dict = {
+            "display_name": host["display_name"],
+            "ip_address": host["ip_address"],
+            "port": host["port"],
+            "unit_id": host["unit_id"],
+            "is_active": bool(host["is_active"]),
+            "pipeline_window": host["pipeline_window"],
+            "timeout": host["timeout"],
+            "items": []
+        }
+        # 2. そのホストに紐づくアイテムを取得
+        item_cursor = await db.execute("SELECT * FROM items WHERE host_id = ?", (host["id"],))
+        items = await item_cursor.fetchall()
+        for item in items:
+            trigger_cursor = await db.execute("SELECT * FROM triggers WHERE item_id = ? ORDER BY id", (item["id"],))
+            triggers = [
+                {
+                    "name": t["name"],
+                    "cond_op": t["cond_op"],
+                    "cond_thr": t["cond_thr"],
+                    "problem_count": t["problem_count"],
+                    "rect_op": t["rect_op"],
+                    "rect_thr": t["rect_thr"],
+                    "recovery_count": t["recovery_count"],
+                    "priority": t["priority"]
+                }
+                for t in await trigger_cursor.fetchall()
+            ]
+            host_dict["items"].append({
+                "tag_name": item["tag_name"],
+                "address": item["address"],
+                "alarm_threshold": item["alarm_threshold"],
+                "alarm_enabled": bool(item["alarm_enabled"]),
+                "polling_interval": item["polling_interval"],
+                "deadband": item["deadband"],
+                "deadband_type": item["deadband_type"],
+                "swinging_door": bool(item["swinging_door"]),
+                "max_interval": item["max_interval"],
+                "reg_type": item["reg_type"],
+                "data_type": item["data_type"],
+                "word_order": item["word_order"],
+                "scale": item["scale"],
+                "value_offset": item["value_offset"],
+                "triggers": triggers
+            })
+        config_data["hosts"].append(host_dict)
 
     yaml_str = yaml.dump(config_data, allow_unicode=True, sort_keys=False, default_flow_style=False)
     
@@ -477,7 +479,8 @@ async def export_yaml():
 @app.post("/settings/import/yaml")
 async def import_yaml(
     file: UploadFile = File(...), 
-    overwrite_all: bool = Form(False)  # ★フォームから値を受け取る
+    overwrite_all: bool = Form(False),  # ★フォームから値を受け取る
+    db: aiosqlite.Connection = Depends(write_db)
 ):
     # print("yaml import: start")
     content = await file.read()
@@ -489,66 +492,114 @@ async def import_yaml(
     host_count = len(data.get("hosts", []))
     item_count = sum(len(h.get("items", [])) for h in data.get("hosts", []))
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        # --- ★全削除モードの処理 ---
-        if overwrite_all:
-            # 外部キー制約がある場合は削除順序に注意（items -> hosts）
-            # print("yaml import: Delete Start")
-
-            await db.execute("DELETE FROM items")
-            await db.execute("DELETE FROM hosts")
-            await db.execute("DELETE FROM event_logs")
-            await db.execute("DELETE FROM history")
-            # IDをリセットしたい場合は SQLiteのシーケンスもクリア
-            await db.execute("DELETE FROM sqlite_sequence WHERE name IN ('items', 'hosts', 'event_logs', 'history')")
-            # print("yaml import: Delete End")
-
-
-        for h in data.get("hosts", []):
-            # print(f"yaml import: host > {h['display_name']} Start")
-
-            # ホストの登録 (名前で存在確認)
+    # --- ★全削除モードの処理 ---
+    if overwrite_all:
+        # 外部キー制約がある場合は削除順序に注意（items -> hosts）
+        # print("yaml import: Delete Start")
+
+        await db.execute("DELETE FROM triggers")
+        await db.execute("DELETE FROM items")
+        await db.execute("DELETE FROM hosts")
+        await db.execute("DELETE FROM event_logs")
+        for name in await history_partitions.list_partitions(db):
+            await db.execute(f"DROP TABLE {name}")
+        for table, _ in history_rollups.RESOLUTIONS.values():
+            await db.execute(f"DELETE FROM {table}")
+        # IDをリセットしたい場合は SQLiteのシーケンスもクリア
+        await db.execute("DELETE FROM sqlite_sequence WHERE name IN ('items', 'hosts', 'event_logs', 'history', 'triggers')")
+        # print("yaml import: Delete End")
+
+
+    for h in data.get("hosts", []):
+        # print(f"yaml import: host > {h['display_name']} Start")
+
+        # ホストの登録 (名前で存在確認)
+        cursor = await db.execute(
+            "SELECT id FROM hosts WHERE display_name = ?", (h['display_name'],)
+        )
+        host_row = await cursor.fetchone()
+        
+        if host_row:
+            host_id = host_row[0]
+            # 既存ホストの設定を更新する場合
+            await db.execute(
+                "UPDATE hosts SET ip_address=?, port=?, unit_id=?, is_active=?, pipeline_window=?, timeout=? WHERE id=?",
+                (h['ip_address'], h['port'], h.get('unit_id', 1), 1 if h.get('is_active', True) else 0,
+                 h.get('pipeline_window', 1), h.get('timeout'), host_id)
+            )
+        else:
             cursor = await db.execute(
-                "SELECT id FROM hosts WHERE display_name = ?", (h['display_name'],)
+                "INSERT INTO hosts (display_name, ip_address, port, unit_id, is_active, pipeline_window, timeout) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (h['display_name'], h['ip_address'], h['port'], h.get('unit_id', 1), 1 if h.get('is_active', True) else 0,
+                 h.get('pipeline_window', 1), h.get('timeout'))
             )
-            host_row = await cursor.fetchone()
-            
-            if host_row:
-                host_id = host_row[0]
-                # 既存ホストの設定を更新する場合
-                await db.execute(
-                    "UPDATE hosts SET ip_address=?, port=?, unit_id=?, is_active=? WHERE id=?",
-                    (h['ip_address'], h['port'], h.get('unit_id', 1), 1 if h.get('is_active', True) else 0, host_id)
-                )
-            else:
+            host_id = cursor.lastrowid
+        
+        # アイテムの登録
+        for i in h.get("items", []):
+            # print(f"yaml import: host > {h['display_name']} - Item > {i['tag_name']} Start")
+            # タグ名重複時は更新(UPSERT)
+            await db.execute(
+                """INSERT INTO items 
+                   (tag_name, address, host_id, alarm_threshold, alarm_enabled, polling_interval,
+                    deadband, deadband_type, swinging_door, max_interval,
+                    reg_type, data_type, word_order, scale, value_offset) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(host_id, tag_name) DO UPDATE SET
+                   address=excluded.address,
+                   host_id=excluded.host_id,
+                   alarm_threshold=excluded.alarm_threshold,
+                   alarm_enabled=excluded.alarm_enabled,
+                   polling_interval=excluded.polling_interval,
+                   deadband=excluded.deadband,
+                   deadband_type=excluded.deadband_type,
+                   swinging_door=excluded.swinging_door,
+                   max_interval=excluded.max_interval,
+                   reg_type=excluded.reg_type,
+                   data_type=excluded.data_type,
+                   word_order=excluded.word_order,
+                   scale=excluded.scale,
+                   value_offset=excluded.value_offset""",
+                (i['tag_name'], i['address'], host_id, 
+                 i['alarm_threshold'], 1 if i.get('alarm_enabled', True) else 0, i['polling_interval'],
+                 i.get('deadband') or 0, i.get('deadband_type') or 'absolute',
+                 1 if i.get('swinging_door') else 0, i.get('max_interval') or 0,
+                 i.get('reg_type') or 'holding', i.get('data_type') or 'uint16', i.get('word_order') or 'big',
+                 1.0 if i.get('scale') is None else i['scale'], i.get('value_offset') or 0)
+            )
+
+            # トリガーは YAML に書かれている場合だけ、そのアイテムの分を置き換える
+            if "triggers" in i:
                 cursor = await db.execute(
-                    "INSERT INTO hosts (display_name, ip_address, port, unit_id, is_active) VALUES (?, ?, ?, ?, ?)",
-                    (h['display_name'], h['ip_address'], h['port'], h.get('unit_id', 1), 1 if h.get('is_active', True) else 0)
+                    "SELECT id FROM items WHERE host_id = ? AND tag_name = ?", (host_id, i['tag_name'])
                 )
-                host_id = cursor.lastrowid
-            
-            # アイテムの登録
-            for i in h.get("items", []):
-                # print(f"yaml import: host > {h['display_name']} - Item > {i['tag_name']} Start")
-                # タグ名重複時は更新(UPSERT)
-                await db.execute(
-                    """INSERT INTO items 
-                       (tag_name, address, host_id, alarm_threshold, alarm_enabled, polling_interval) 
-                       VALUES (?, ?, ?, ?, ?, ?)
-                       ON CONFLICT(host_id, tag_name) DO UPDATE SET
-                       address=excluded.address,
-                       host_id=excluded.host_id,
-                       alarm_threshold=excluded.alarm_threshold,
-                       alarm_enabled=excluded.alarm_enabled,
-                       polling_interval=excluded.polling_interval""",
-                    (i['tag_name'], i['address'], host_id, 
-                     i['alarm_threshold'], 1 if i.get('alarm_enabled', True) else 0, i['polling_interval'])
-                )
-                # print(f"yaml import: host > {h['display_name']} - Item > {i['tag_name']} End")
-
-            # print(f"yaml import: host > {h} - Item End")
-
+                item_id = (await cursor.fetchone())[0]
+                await db.execute("DELETE FROM triggers WHERE item_id = ?", (item_id,))
+                for t in i["triggers"] or []:
+                    await db.execute(
+                        """INSERT INTO triggers
+                           (item_id, name, cond_op, cond_thr, problem_count, rect_op, rect_thr, recovery_count, priority)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        (item_id, t['name'], t['cond_op'], t['cond_thr'], t.get('problem_count', 1),
+                         t.get('rect_op'), t.get('rect_thr'), t.get('recovery_count', 1), t.get('priority', 3))
+                    )
+            # print(f"yaml import: host > {h['display_name']} - Item > {i['tag_name']} End")
+
+        # print(f"yaml import: host > {h} - Item End")
+
+    # item_id が振り直されるので、アーカイブも残せない。
+    # ただし消すのはコミットできてから（コミット前に脇へ移し、失敗したら元に戻す）
+    archives_aside = None
+    if overwrite_all:
+        archives_aside = await asyncio.to_thread(history_archive.set_aside, config.archive_path)
+    try:
         await db.commit()
+    except Exception:
+        if archives_aside is not None:
+            await asyncio.to_thread(history_archive.restore, config.archive_path, archives_aside)
+        raise
+    if archives_aside is not None:
+        await asyncio.to_thread(history_archive.discard, archives_aside)
     
     # URLパラメータに結果を付けてリダイレクト
     return RedirectResponse(
@@ -556,34 +607,11 @@ async def import_yaml(
         status_code=303
     )
 
-async def cleanup_old_data():
-    """設定された分数を経過したデータを削除する。1分に1回だけ実行。"""
-    global last_cleanup_time
-    now = time.time()
-    
-    # 前回の実行から60秒経過していなければ何もしない
-    if now - last_cleanup_time < 60:
-        return
-
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            # 分単位で古いデータを削除
-            await db.execute(
-                "DELETE FROM history WHERE timestamp < DATETIME('now', 'localtime', ?)",
-                (f"-{RETENTION_MINUTES} minutes",)
-            )
-            # アラートログも同様にクリーンアップする場合（必要に応じて）
-            await db.execute(
-                "DELETE FROM event_logs WHERE start_time < DATETIME('now', 'localtime', ?)",
-                (f"-{RETENTION_MINUTES} minutes",)
-            )
-            await db.commit()
-            last_cleanup_time = now
-            print(f"DEBUG: Cleaned up data older than {RETENTION_MINUTES} minutes.")
-    except Exception as e:
-        print(f"Cleanup Error: {e}")
-
 @app.get("/api_docs", response_class=HTMLResponse)
 async def api_docs_page(request: Request):
     return templates.TemplateResponse("api_docs.html", {"request": request})
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def web_metrics():
+    # Web プロセスのメトリクス（DB接続プールの待ち時間など）。Poller 側は metrics.port で公開している
+    return PlainTextResponse(WEB_REGISTRY.render(), media_type="text/plain; version=0.0.4")
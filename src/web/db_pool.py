@@ -0,0 +1,122 @@
+# Web側の SQLite 接続プール
+# ルートごとに aiosqlite.connect すると、接続ごとにスレッドの起動と PRAGMA の設定が走り、
+# /api/v1/latest のような小さなクエリでは接続の準備が応答時間の大半になる。
+# そこで FastAPI の lifespan で接続を開いておき、リクエストには依存性 (Depends) で貸し出す。
+#   - 読み取り用: readers 本。開く時に1回だけ WAL / query_only / mmap_size / cache_size を設定する
+#   - 書き込み用: 1本だけ。ロックで直列化する（Web側の書き込みどうしが busy で待ち合うのを避ける）
+#   - 監視用: 1本だけ。PRAGMA data_version（他の接続がコミットするたびに変わる。値は接続ごと）を
+#     同じ接続で見比べるために LiveView が使う
+# 貸し出しまでの待ち時間と使用中の本数はメトリクス (/metrics) で見られる。
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+from fastapi import Request
+
+from src.engine.metrics import Registry
+
+# Web プロセスのメトリクス（Poller の REGISTRY とは別）
+WEB_REGISTRY = Registry()
+POOL_WAIT_SECONDS = WEB_REGISTRY.histogram(
+    "seg_web_db_pool_wait_seconds", "Time a request waited for a database connection", ("kind",))
+POOL_IN_USE = WEB_REGISTRY.gauge(
+    "seg_web_db_pool_in_use", "Database connections currently lent to requests", ("kind",))
+POOL_SIZE = WEB_REGISTRY.gauge(
+    "seg_web_db_pool_size", "Database connections held by the pool", ("kind",))
+
+
+class ConnectionPool:
+    def __init__(self, db_path, readers=4, mmap_size_mb=256, cache_size_mb=16, busy_timeout_ms=5000):
+        self.db_path = db_path
+        self.size = readers
+        self.mmap_size = mmap_size_mb * 1024 * 1024
+        self.cache_size = cache_size_mb * 1024
+        self.busy_timeout_ms = busy_timeout_ms
+        self.idle = asyncio.Queue()
+        self.connections = []
+        self.write_connection = None
+        self.monitor_connection = None
+        self.write_lock = asyncio.Lock()
+        self.read_wait = POOL_WAIT_SECONDS.labels("read")
+        self.write_wait = POOL_WAIT_SECONDS.labels("write")
+        self.read_in_use = POOL_IN_USE.labels("read")
+        self.write_in_use = POOL_IN_USE.labels("write")
+        POOL_SIZE.labels("read").set_function(lambda: len(self.connections))
+        POOL_SIZE.labels("write").set_function(lambda: 1 if self.write_connection is not None else 0)
+
+    async def _connect(self, read_only):
+        db = await aiosqlite.connect(self.db_path)
+        db.row_factory = aiosqlite.Row
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        await db.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        await db.execute(f"PRAGMA cache_size=-{self.cache_size}")  # 負の値は KiB 単位
+        if read_only:
+            await db.execute("PRAGMA query_only=ON")
+        return db
+
+    async def open(self):
+        for _ in range(self.size):
+            db = await self._connect(read_only=True)
+            self.connections.append(db)
+            self.idle.put_nowait(db)
+        self.write_connection = await self._connect(read_only=False)
+        self.monitor_connection = await self._connect(read_only=True)
+
+    async def close(self):
+        for db in self.connections:
+            await db.close()
+        self.connections.clear()
+        if self.write_connection is not None:
+            await self.write_connection.close()
+            self.write_connection = None
+        if self.monitor_connection is not None:
+            await self.monitor_connection.close()
+            self.monitor_connection = None
+
+    @asynccontextmanager
+    async def reader(self):
+        started = time.perf_counter()
+        db = await self.idle.get()
+        self.read_wait.observe(time.perf_counter() - started)
+        self.read_in_use.value += 1
+        try:
+            yield db
+        finally:
+            self.read_in_use.value -= 1
+            self.idle.put_nowait(db)
+
+    async def data_version(self):
+        """監視用の接続から見た PRAGMA data_version（他の接続・プロセスがコミットするたびに変わる）"""
+        cursor = await self.monitor_connection.execute("PRAGMA data_version")
+        row = await cursor.fetchone()
+        return row[0]
+
+    @asynccontextmanager
+    async def writer(self):
+        started = time.perf_counter()
+        async with self.write_lock:
+            self.write_wait.observe(time.perf_counter() - started)
+            self.write_in_use.value += 1
+            try:
+                yield self.write_connection
+            finally:
+                # コミットされずに終わった変更（途中で例外になった場合など）を次のリクエストへ持ち越さない
+                if self.write_connection.in_transaction:
+                    await self.write_connection.rollback()
+                self.write_in_use.value -= 1
+
+
+# --- 依存性 (Depends) ---
+
+async def read_db(request: Request):
+    """読み取り専用の接続を1本借りる"""
+    async with request.app.state.db_pool.reader() as db:
+        yield db
+
+
+async def write_db(request: Request):
+    """書き込み用の接続を借りる（同時に1リクエストだけ）"""
+    async with request.app.state.db_pool.writer() as db:
+        yield db
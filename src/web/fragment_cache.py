@@ -0,0 +1,69 @@
+# ダッシュボードの表 (/api/dashboard_fragment) の描画結果のキャッシュ
+# 表は「データの版 × 絞り込み条件」で決まるので、同じ条件で開いている閲覧者には1回描画した結果を使い回す。
+#   - データの版: ChangeFeed の (起動時刻, 連番) と DB のコミットの目印 (LiveView.data_version)。
+#     連番は値・アラーム・設定・接続状態が変わるたびに進む。スパークラインは履歴から描くので、
+#     値が変わらなくても履歴がコミットされたら版を変える
+#   - 版が変わったら全件捨てる（古い版の結果は二度と使わない）
+#   - 描画中に同じ条件のリクエストが来たら、同じ描画の完了を待つ（SQL と描画を1回にする）
+# ブラウザ向けには同じ版と条件から ETag を作り、変わっていなければ 304 を返す（app.py）。
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+from src.web.db_pool import WEB_REGISTRY
+
+# 保持する絞り込み条件の数（検索語の入力途中などで増えた分は古いものから捨てる）
+LIMIT = 64
+
+FRAGMENT_RESPONSES = WEB_REGISTRY.counter(
+    "seg_web_fragment_responses", "Dashboard fragment responses by cache result", ("result",))
+
+
+def etag(version, key):
+    """版と絞り込み条件の ETag"""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+    return '"{}-{}"'.format("-".join(map(str, version)), digest)
+
+
+def matches(if_none_match, tag):
+    """If-None-Match に tag が含まれるか（弱い比較）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in if_none_match.split(","))
+
+
+class FragmentCache:
+    def __init__(self, limit=LIMIT):
+        self.limit = limit
+        self.version = None
+        self.entries = OrderedDict()  # 絞り込み条件 -> 描画のタスク（完了後は結果を持つ）
+        self.results = {result: FRAGMENT_RESPONSES.labels(result) for result in ("hit", "miss", "not_modified")}
+
+    def count(self, result):
+        self.results[result].inc()
+
+    async def get(self, version, key, render):
+        """version・key の描画結果。無ければ render() で描画する"""
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+        task = self.entries.get(key)
+        if task is None:
+            self.count("miss")
+            task = asyncio.ensure_future(render())
+            self.entries[key] = task
+            while len(self.entries) > self.limit:
+                self.entries.popitem(last=False)
+        else:
+            self.count("hit")
+            self.entries.move_to_end(key)
+        try:
+            # 待っているリクエストが切断されても、描画は他のリクエストのために続ける
+            return await asyncio.shield(task)
+        except Exception:
+            # 失敗した結果は残さない（次のリクエストで描画し直す）
+            if self.entries.get(key) is task:
+                del self.entries[key]
+            raise
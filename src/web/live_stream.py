@@ -0,0 +1,179 @@
+# ダッシュボードへの現在値の配信 (Server-Sent Events)
+# ダッシュボードが数秒ごとに表全体を取り直すと、サーバーの負荷は「閲覧者数 × アイテム数 × 更新頻度」になる。
+# そこで変化の検出は ChangeFeed の1タスクだけが行い、閲覧者には前回から変わったアイテムだけを送る。
+#   - ChangeFeed: interval 秒ごとに現在値 (LiveView) を前回と比べ、値・品質・アラーム状態が変わったアイテムと
+#                 アラームの発生/解除を1つのメッセージにまとめる（JSON への変換もここで1回だけ）
+#   - メッセージには連番を振り、直近 history 件を保持する。再接続したクライアントは最後に受け取った番号
+#     (Last-Event-ID) 以降の分だけを受け取る。保持分より古い・Web を再起動した場合は全アイテム分を送り直す
+#   - アイテム・ホストの設定やホストの接続状態が変わった場合は reload を送り、クライアントは表を取り直す
+import asyncio
+import json
+from collections import deque
+
+from src.common import history_partitions
+from src.engine.decoder import format_value
+from src.web.db_pool import WEB_REGISTRY
+from src.web.live_view import is_alarm
+
+# 現在値を見比べる間隔(秒)
+POLL_INTERVAL = 0.5
+# 再接続したクライアントに送り直せるメッセージ数
+HISTORY = 256
+# 変化が無い間も接続を保つためにコメント行を送る間隔(秒)
+KEEPALIVE = 15
+
+STREAM_CLIENTS = WEB_REGISTRY.gauge("seg_web_stream_clients", "Dashboards connected to the value stream")
+STREAM_MESSAGES = WEB_REGISTRY.counter(
+    "seg_web_stream_messages", "Value stream messages built (once per change set, shared by all clients)", ("event",))
+STREAM_CHANGES = WEB_REGISTRY.counter("seg_web_stream_changes", "Item changes detected by the value stream")
+
+
+def encode(event, event_id, payload):
+    """SSE の1メッセージ"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def item_state(item):
+    """配信する1アイテム分の内容（行の書き換えに使う）"""
+    value = item["last_value"]
+    return {
+        "id": item["id"],
+        "value": value,
+        "text": format_value(value),
+        "updated_at": item["updated_at"],
+        "status": item["last_status"],
+        "alarm": is_alarm(item),
+    }
+
+
+class ChangeFeed:
+    def __init__(self, live_view, interval=POLL_INTERVAL, history=HISTORY):
+        self.live_view = live_view
+        self.interval = interval
+        # Web を再起動すると連番が振り直されるので、ID に起動時刻を付けて区別する
+        self.epoch = history_partitions.now_ms()
+        self.sequence = 0
+        self.items = None     # item_id -> item_state（最後に配信した内容）
+        self.config_version = None
+        self.host_version = None
+        self.stats = {"total": 0, "alarms": 0, "no_data": 0}
+        self.source = None    # 前回見比べた時の (設定の一覧, 共有メモリの更新番号)。変わっていなければ見比べない
+        self.log = deque(maxlen=history)  # (連番, SSE のテキスト)
+        self.changed = asyncio.Condition()
+        self.clients = STREAM_CLIENTS.labels()
+        self.changes = STREAM_CHANGES.labels()
+        self.messages = {event: STREAM_MESSAGES.labels(event) for event in ("delta", "reload")}
+        self.poll()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.poll():
+                async with self.changed:
+                    self.changed.notify_all()
+
+    def event_id(self, sequence=None):
+        return f"{self.epoch}:{self.sequence if sequence is None else sequence}"
+
+    def poll(self):
+        """現在値を前回と見比べ、変化があればメッセージを追加する。追加した場合は True"""
+        live_view = self.live_view
+        table = live_view.table
+        # 設定の一覧も共有メモリの更新番号も前回のままなら、見比べるまでもない
+        source = (live_view.items, table.header()[1] if table is not None else None, live_view.host_version)
+        if self.source is not None and source[0] is self.source[0] and source[1:] == self.source[1:]:
+            return False
+        self.source = source
+
+        previous_items = self.items or {}
+        items = {}
+        changes = []
+        alarms = []
+        for row in live_view.rows():
+            state = item_state(row)
+            items[row["id"]] = state
+            previous = previous_items.get(row["id"])
+            if previous is None:
+                continue
+            if (state["value"], state["status"], state["alarm"]) != (previous["value"], previous["status"], previous["alarm"]):
+                # previous: 値による絞り込み中のクライアントが、表示対象に入ったかを判断するのに使う
+                changes.append({**state, "previous": {"value": previous["value"], "alarm": previous["alarm"]}})
+            if state["alarm"] != previous["alarm"]:
+                alarms.append({"id": row["id"], "tag": row["tag_name"], "host": row["host_name"], "alarm": state["alarm"]})
+        first = self.items is None
+        # タグ名の変更・通信断の表示などは行の書き換えでは追いつかないので、表ごと取り直してもらう
+        reload = (items.keys() != previous_items.keys() or live_view.config_version != self.config_version
+                  or live_view.host_version != self.host_version)
+        self.items = items
+        self.config_version = live_view.config_version
+        self.host_version = live_view.host_version
+        self.stats = {
+            "total": len(items),
+            "alarms": sum(1 for state in items.values() if state["alarm"]),
+            "no_data": sum(1 for state in items.values() if state["value"] is None),
+        }
+        if first or not (reload or changes):
+            return False
+
+        self.sequence += 1
+        if reload:
+            event, payload = "reload", {"stats": self.stats}
+        else:
+            event = "delta"
+            payload = {"changes": changes, "alarms": alarms, "stats": self.stats,
+                       "updated_at": history_partitions.local_text(history_partitions.now_ms())}
+            self.changes.inc(len(changes))
+        self.messages[event].inc()
+        self.log.append((self.sequence, encode(event, self.event_id(), payload)))
+        return True
+
+    def snapshot(self):
+        """全アイテム分の内容（接続直後・送り直し用）"""
+        return encode("snapshot", self.event_id(), {"changes": list((self.items or {}).values()), "stats": self.stats})
+
+    def backlog(self, last_event_id):
+        """last_event_id より後のメッセージ。送り直せない場合は None"""
+        epoch, _, sequence = (last_event_id or "").partition(":")
+        if epoch != str(self.epoch) or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence > self.sequence:
+            return None
+        if sequence == self.sequence:
+            return []
+        if not self.log or self.log[0][0] > sequence + 1:
+            return None  # 保持している分より古い
+        return [text for number, text in self.log if number > sequence]
+
+    async def wait(self, sequence):
+        """連番が sequence から進むまで待つ"""
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.sequence != sequence)
+
+    async def stream(self, last_event_id=None):
+        """1クライアント分の SSE を生成する"""
+        self.clients.value += 1
+        try:
+            pending = self.backlog(last_event_id)
+            sequence = self.sequence
+            if pending is None:
+                yield self.snapshot()
+            else:
+                for text in pending:
+                    yield text
+            while True:
+                try:
+                    await asyncio.wait_for(self.wait(sequence), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                pending = self.backlog(self.event_id(sequence))
+                sequence = self.sequence
+                if pending is None:
+                    # 遅れて保持分からあふれた
+                    yield self.snapshot()
+                    continue
+                for text in pending:
+                    yield text
+        finally:
+            self.clients.value -= 1
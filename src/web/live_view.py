@@ -0,0 +1,111 @@
+# Web側の現在値 (live view)
+# /api/v1/latest・トップページ・ダッシュボードの値は、リクエストごとに SQL を実行せずに組み立てる。
+#   - アイテムとホストの設定（タグ名・ホスト名・閾値など）: メモリに持ち、config_version が変わった時だけ読み直す
+#   - 現在値・時刻・品質: Poller が書く共有メモリの表 (live_values) から読む
+#   - DBのコミットの目印: PRAGMA data_version。履歴など共有メモリの表に無いものを使う表示の版に含める
+# 共有メモリの表が無い場合（Poller が未起動、live_values.path を設定していない）は、
+# items テーブルのスナップショットを interval 秒ごとに読み直して使う。
+import asyncio
+import sqlite3
+
+from src.common import history_partitions
+from src.common.live_values import LiveValueTable, item_key
+
+ITEMS_SQL = """
+    SELECT i.id, i.tag_name, i.host_id, i.alarm_enabled, i.alarm_threshold, i.polling_interval,
+           i.last_value, i.updated_at, i.last_status, h.display_name AS host_name
+    FROM items i
+    JOIN hosts h ON i.host_id = h.id
+    ORDER BY i.id
+"""
+
+
+def is_alarm(item):
+    """アラート有効かつ、現在値が閾値以上か"""
+    return (item["alarm_enabled"] == 1 and
+            item["last_value"] is not None and item["alarm_threshold"] is not None and
+            item["last_value"] >= item["alarm_threshold"])
+
+
+class LiveView:
+    def __init__(self, pool, path, interval=1.0):
+        self.pool = pool
+        self.path = path
+        self.interval = interval
+        self.items = []  # 設定の dict（item_id 順）。last_value などは読み込んだ時点のスナップショット
+        self.keys = {}   # item_id -> 共有メモリの表のキー（キーが違うスロットは別のアイテムの値なので使わない）
+        self.config_version = None
+        self.host_status = {}  # host_id -> hosts.status（接続状態。変化した時だけ書かれるので毎回読み直す）
+        self.host_version = 0  # host_status が変わるたびに加算
+        self.data_version = None  # 最後に見た PRAGMA data_version（Poller が履歴をコミットするたびに変わる）
+        self.loaded = False
+        self.table = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except sqlite3.Error as e:
+                print(f"WARNING: Live view refresh failed: {e}")
+
+    def attach(self):
+        """共有メモリの表を開く（Poller がファイルを作り直していれば開き直す）"""
+        if self.table is not None and self.table.replaced():
+            self.table.close()
+            self.table = None
+        if self.table is None and self.path:
+            self.table = LiveValueTable.open(self.path)
+
+    async def refresh(self):
+        """設定が変わっていれば読み直す（共有メモリの表が無ければ、スナップショットの値を毎回読み直す）"""
+        self.attach()
+        self.data_version = await self.pool.data_version()
+        async with self.pool.reader() as db:
+            cursor = await db.execute("SELECT id, status FROM hosts")
+            host_status = {row[0]: row[1] for row in await cursor.fetchall()}
+            if host_status != self.host_status:
+                self.host_status = host_status
+                self.host_version += 1
+
+            cursor = await db.execute("SELECT value FROM config_meta WHERE key = 'config_version'")
+            row = await cursor.fetchone()
+            config_version = row[0] if row else None
+            if (self.loaded and self.table is not None
+                    and config_version is not None and config_version == self.config_version):
+                return
+            cursor = await db.execute(ITEMS_SQL)
+            self.items = [dict(row) for row in await cursor.fetchall()]
+        self.keys = {item["id"]: item_key(item["host_name"], item["tag_name"]) for item in self.items}
+        self.config_version = config_version
+        self.loaded = True
+
+    def overlay(self, item, texts):
+        """設定の行に現在値 (last_value / updated_at / last_status) を重ねた dict
+
+        texts: 時刻 -> 文字列 の変換結果（同じサイクルの値は同じ時刻なので、呼び出し側で使い回す）
+        """
+        row = dict(item)
+        key = self.keys.get(item["id"])
+        entry = self.table.read(item["id"], key) if self.table is not None and key is not None else None
+        if entry is not None:
+            value, ts, quality, _ = entry
+            text = texts.get(ts)
+            if text is None and ts:
+                text = texts[ts] = history_partitions.local_text(ts)
+            row["last_value"] = value
+            row["updated_at"] = text
+            row["last_status"] = quality
+        return row
+
+    def rows(self):
+        """全アイテムの現在値（item_id 順）"""
+        texts = {}
+        return [self.overlay(item, texts) for item in self.items]
+
+    def last_update(self):
+        """Poller が最後に現在値を書いた時刻 (epoch ミリ秒)。共有メモリの表が無ければ None"""
+        if self.table is None:
+            return None
+        updated_ms, _ = self.table.header()
+        return updated_ms or None
@@ -16,7 +16,9 @@ def main():
         host=webhost, 
         port=webport, 
         reload=webreload,
-        log_level=loglv.lower()
+        log_level=loglv.lower(),
+        # ダッシュボードの配信 (Server-Sent Events) の接続は自分からは閉じないので、停止時は待ちすぎずに切る
+        timeout_graceful_shutdown=5,
     )
 
 if __name__ == "__main__":
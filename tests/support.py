@@ -0,0 +1,36 @@
+# テスト共通の下準備
+import contextlib
+import io
+import os
+import sqlite3
+from unittest import mock
+
+from src.common import db_handler
+
+
+def create_db(directory, hosts=(), items=()):
+    """directory に init_db() 済みのDBを作ってパスを返す
+
+    hosts: [(display_name, ip_address, port), ...]  id は 1 から順に振られる
+    items: [(host_id, tag_name, address), ...]
+    """
+    path = os.path.join(directory, "gateway.sqlite")
+    with mock.patch.object(db_handler, "DB_PATH", path), contextlib.redirect_stdout(io.StringIO()):
+        db_handler.init_db()
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO hosts (display_name, ip_address, port) VALUES (?, ?, ?)", hosts)
+    conn.executemany("INSERT INTO items (host_id, tag_name, address) VALUES (?, ?, ?)", items)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def execute(path, sql, params=()):
+    """別の接続で1文実行してコミットする（Web 側の設定変更の代わり）"""
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
@@ -0,0 +1,95 @@
+# 履歴の圧縮 (src/engine/compression.py) のテスト
+import unittest
+
+from src.engine.compression import DEADBAND_PERCENT, ItemCompressor
+
+
+def archived(compressor, points):
+    """[(t, value), ...] を順に渡し、残すと判定された (t, value) を返す"""
+    kept = []
+    for t, value in points:
+        earlier, keep = compressor.offer(t, value, t)
+        kept.extend((timestamp, past) for past, timestamp in earlier)
+        if keep:
+            kept.append((t, value))
+    return kept
+
+
+class DeadbandTest(unittest.TestCase):
+    def test_no_deadband_keeps_changes_only(self):
+        points = [(0, 1.0), (1, 1.0), (2, 2.0), (3, 2.0), (4, 1.0)]
+        self.assertEqual(archived(ItemCompressor(), points), [(0, 1.0), (2, 2.0), (4, 1.0)])
+
+    def test_absolute_deadband(self):
+        points = [(0, 10.0), (1, 10.4), (2, 10.5), (3, 10.6), (4, 9.0)]
+        # 最後に残した 10.0 から 0.5 を超えて動いた時だけ残す
+        self.assertEqual(archived(ItemCompressor(0.5), points), [(0, 10.0), (3, 10.6), (4, 9.0)])
+
+    def test_percent_deadband_is_relative_to_last_archived(self):
+        compressor = ItemCompressor(10, DEADBAND_PERCENT)
+        points = [(0, 100.0), (1, 109.0), (2, 111.0), (3, 121.0), (4, 123.0)]
+        self.assertEqual(archived(compressor, points), [(0, 100.0), (2, 111.0), (4, 123.0)])
+
+    def test_seed_uses_previous_value(self):
+        compressor = ItemCompressor(1.0)
+        compressor.seed(0, 5.0)
+        self.assertEqual(archived(compressor, [(1, 5.5), (2, 6.5)]), [(2, 6.5)])
+
+    def test_seed_none_keeps_first_value(self):
+        compressor = ItemCompressor(1.0)
+        compressor.seed(0, None)
+        self.assertEqual(archived(compressor, [(1, 5.0)]), [(1, 5.0)])
+
+    def test_heartbeat(self):
+        compressor = ItemCompressor(1.0, max_interval=10)
+        points = [(0, 1.0), (5, 1.0), (9, 1.0), (10, 1.0), (15, 1.0), (20, 1.0)]
+        self.assertEqual(archived(compressor, points), [(0, 1.0), (10, 1.0), (20, 1.0)])
+
+    def test_from_row(self):
+        compressor = ItemCompressor.from_row(
+            {"deadband": 2.0, "deadband_type": None, "swinging_door": 1, "max_interval": None})
+        self.assertEqual((compressor.deadband, compressor.percent, compressor.swinging_door, compressor.max_interval),
+                         (2.0, False, True, 0))
+
+
+class SwingingDoorTest(unittest.TestCase):
+    def test_straight_line_is_held(self):
+        compressor = ItemCompressor(0.5, swinging_door=True)
+        self.assertEqual(archived(compressor, [(t, float(t)) for t in range(10)]), [(0, 0.0)])
+        self.assertEqual(compressor.held[:2], (9, 9.0))
+
+    def test_turn_archives_held_point(self):
+        compressor = ItemCompressor(0.5, swinging_door=True)
+        points = [(0, 0.0), (1, 1.0), (2, 2.0), (3, 0.0)]
+        self.assertEqual(archived(compressor, points), [(0, 0.0), (2, 2.0)])
+        self.assertEqual(compressor.archived, (2, 2.0))
+        self.assertEqual(compressor.held[:2], (3, 0.0))
+
+    def test_noise_within_tolerance_is_dropped(self):
+        compressor = ItemCompressor(0.5, swinging_door=True)
+        points = [(0, 10.0), (1, 10.3), (2, 9.8), (3, 10.2), (4, 9.9)]
+        self.assertEqual(archived(compressor, points), [(0, 10.0)])
+
+    def test_every_dropped_point_stays_within_tolerance(self):
+        compressor = ItemCompressor(0.5, swinging_door=True)
+        points = [(t, (t % 7) * 0.4 + (t // 7) * 1.5) for t in range(60)]
+        kept = archived(compressor, points) + [compressor.held[:2]]
+        for (t0, v0), (t1, v1) in zip(kept, kept[1:]):
+            for t, value in points:
+                if t0 < t < t1:
+                    expected = v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+                    self.assertLessEqual(abs(value - expected), 0.5 + 1e-9)
+
+    def test_same_timestamp_is_ignored(self):
+        compressor = ItemCompressor(0.5, swinging_door=True)
+        archived(compressor, [(0, 0.0)])
+        self.assertEqual(compressor.offer(0, 5.0, 0), ([], False))
+
+    def test_heartbeat_flushes_held_point(self):
+        compressor = ItemCompressor(0.5, swinging_door=True, max_interval=5)
+        points = [(0, 0.0), (1, 1.0), (2, 2.0), (5, 5.0)]
+        self.assertEqual(archived(compressor, points), [(0, 0.0), (2, 2.0), (5, 5.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# DB の初期化とマイグレーション (src/common/db_handler.py init_db) のテスト
+import contextlib
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from src.common import history_partitions
+from src.common.history_partitions import from_local_text
+from tests.support import create_db
+
+LEGACY_ROWS = [(1, 1.5, "2024-01-01 12:00:00"), (1, 2.5, "2024-01-01 12:00:30"), (2, 7.0, "2024-01-01 12:01:00")]
+
+
+class MigrateHistoryTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+
+    def legacy_db(self, statements):
+        with contextlib.closing(sqlite3.connect(os.path.join(self.dir, "gateway.sqlite"))) as conn:
+            for sql, params in statements:
+                conn.executemany(sql, params or [()])
+            conn.commit()
+
+    def migrate(self):
+        path = create_db(self.dir)
+        conn = sqlite3.connect(path)
+        self.addCleanup(conn.close)
+        return conn
+
+    def history(self, conn):
+        names = [row[0] for row in conn.execute(history_partitions.LIST_SQL)]
+        sql, params = history_partitions.union_sql(names)
+        return sorted(conn.execute(sql, params).fetchall())
+
+    def expected(self, rows):
+        return sorted((item_id, from_local_text(text), value) for item_id, value, text in rows)
+
+    def test_history_table_moves_to_epoch_partitions(self):
+        self.legacy_db([
+            ("CREATE TABLE history (id INTEGER PRIMARY KEY, item_id INTEGER, value REAL, timestamp DATETIME)", None),
+            ("INSERT INTO history (item_id, value, timestamp) VALUES (?, ?, ?)", LEGACY_ROWS),
+        ])
+        conn = self.migrate()
+        self.assertEqual(self.history(conn), self.expected(LEGACY_ROWS))
+        self.assertEqual(conn.execute("SELECT name FROM sqlite_master WHERE name = 'history'").fetchall(), [])
+        # 時刻は整数、パーティションは WITHOUT ROWID
+        for (sql,) in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name GLOB 'history_p*'"):
+            self.assertIn("WITHOUT ROWID", sql)
+        name = history_partitions.partition_name(self.expected(LEGACY_ROWS)[0][1])
+        self.assertEqual(conn.execute(f"SELECT DISTINCT typeof(ts) FROM {name}").fetchall(), [("integer",)])
+
+    def test_text_partition_is_renamed_and_moved(self):
+        self.legacy_db([
+            ("CREATE TABLE history_p2024010112 (item_id INTEGER, value REAL, timestamp DATETIME)", None),
+            ("INSERT INTO history_p2024010112 (item_id, value, timestamp) VALUES (?, ?, ?)", LEGACY_ROWS),
+        ])
+        conn = self.migrate()
+        self.assertEqual(self.history(conn), self.expected(LEGACY_ROWS))
+        self.assertEqual(conn.execute("SELECT name FROM sqlite_master WHERE name GLOB 'legacy_*'").fetchall(), [])
+
+    def test_text_rollups_are_rebuilt(self):
+        self.legacy_db([
+            ("CREATE TABLE history (id INTEGER PRIMARY KEY, item_id INTEGER, value REAL, timestamp DATETIME)", None),
+            ("INSERT INTO history (item_id, value, timestamp) VALUES (?, ?, ?)", LEGACY_ROWS),
+            ("CREATE TABLE history_1m (item_id INTEGER, bucket TEXT, value_count INTEGER)", None),
+            ("INSERT INTO history_1m VALUES (1, '2024-01-01 12:00', 99)", None),
+        ])
+        conn = self.migrate()
+        # 区間が文字列の旧形式は捨て、移した履歴から集計し直す
+        rows = conn.execute("SELECT item_id, bucket, value_count, value_sum FROM history_1m ORDER BY item_id").fetchall()
+        self.assertEqual(rows, [(1, from_local_text("2024-01-01 12:00:00"), 2, 4.0),
+                                (2, from_local_text("2024-01-01 12:01:00"), 1, 7.0)])
+
+    def test_current_db_is_left_alone(self):
+        path = create_db(self.dir)
+        name = history_partitions.partition_name(1_700_000_000_000)
+        with contextlib.closing(sqlite3.connect(path)) as conn:
+            for sql in history_partitions.create_sql(name):
+                conn.execute(sql)
+            conn.execute(history_partitions.insert_sql(name), (1, 1_700_000_000_000, 3.0))
+            conn.commit()
+        conn = self.migrate()
+        self.assertEqual(self.history(conn), [(1, 1_700_000_000_000, 3.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# Web側の SQLite 接続プール (src/web/db_pool.py ConnectionPool) のテスト
+import asyncio
+import sqlite3
+import tempfile
+import unittest
+
+from src.web.db_pool import ConnectionPool
+from tests.support import create_db, execute
+
+
+class ConnectionPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = create_db(directory.name, hosts=[("PLC1", "127.0.0.1", 502)])
+        self.pool = ConnectionPool(self.db_path, readers=2, mmap_size_mb=8, cache_size_mb=2)
+        await self.pool.open()
+        self.addAsyncCleanup(self.pool.close)
+
+    async def pragma(self, db, name):
+        cursor = await db.execute(f"PRAGMA {name}")
+        return (await cursor.fetchone())[0]
+
+    async def test_readers_are_configured_once_and_read_only(self):
+        async with self.pool.reader() as db:
+            self.assertEqual(await self.pragma(db, "query_only"), 1)
+            self.assertEqual(await self.pragma(db, "mmap_size"), 8 * 1024 * 1024)
+            self.assertEqual(await self.pragma(db, "cache_size"), -2 * 1024)
+            cursor = await db.execute("SELECT display_name FROM hosts")
+            self.assertEqual((await cursor.fetchone())["display_name"], "PLC1")
+            with self.assertRaises(sqlite3.OperationalError):
+                await db.execute("DELETE FROM hosts")
+
+    async def test_readers_wait_for_a_free_connection(self):
+        async with self.pool.reader() as first, self.pool.reader() as second:
+            self.assertIsNot(first, second)
+            self.assertEqual(self.pool.read_in_use.value, 2)
+            waiting = asyncio.create_task(self._borrow())
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiting.done())
+        # 返した接続を使い回す（新しく開かない）
+        self.assertIn(await asyncio.wait_for(waiting, 1), (first, second))
+        self.assertEqual(self.pool.read_in_use.value, 0)
+        self.assertEqual(len(self.pool.connections), 2)
+
+    async def _borrow(self):
+        async with self.pool.reader() as db:
+            return db
+
+    async def test_writer_is_serialized(self):
+        order = []
+
+        async def write(name):
+            async with self.pool.writer() as db:
+                order.append(f"{name} start")
+                await db.execute("UPDATE hosts SET display_name = ?", (name,))
+                await asyncio.sleep(0.02)
+                await db.commit()
+                order.append(f"{name} end")
+
+        await asyncio.gather(write("A"), write("B"))
+        self.assertEqual(order, ["A start", "A end", "B start", "B end"])
+        self.assertEqual(execute(self.db_path, "SELECT display_name FROM hosts"), [("B",)])
+
+    async def test_uncommitted_write_is_rolled_back(self):
+        with self.assertRaises(RuntimeError):
+            async with self.pool.writer() as db:
+                await db.execute("UPDATE hosts SET display_name = 'broken'")
+                raise RuntimeError("request failed")
+        self.assertFalse(self.pool.write_connection.in_transaction)
+        self.assertEqual(execute(self.db_path, "SELECT display_name FROM hosts"), [("PLC1",)])
+
+    async def test_data_version_changes_on_commit_by_others(self):
+        before = await self.pool.data_version()
+        self.assertEqual(await self.pool.data_version(), before)
+        execute(self.db_path, "UPDATE hosts SET display_name = 'Line 1'")
+        self.assertNotEqual(await self.pool.data_version(), before)
+
+    async def test_close(self):
+        await self.pool.close()
+        self.assertEqual(self.pool.connections, [])
+        self.assertIsNone(self.pool.write_connection)
+        self.assertIsNone(self.pool.monitor_connection)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+# ブロックの一括デコード (src/engine/decoder.py) のテスト
+import math
+import struct
+import unittest
+
+from src.engine.decoder import format_value, word_count
+from src.engine.read_planner import PlanItem, ReadBlock
+
+
+def words(fmt, value):
+    """値をビッグエンディアンのレジスタ列にする"""
+    data = struct.pack(">" + fmt, value)
+    return list(struct.unpack(f">{len(data) // 2}H", data))
+
+
+def decode(items, registers):
+    return [value for _, value in ReadBlock.from_items(items).decode(registers)]
+
+
+class BlockDecoderTest(unittest.TestCase):
+    def test_integer_types(self):
+        items = [
+            PlanItem(1, 1, 0, data_type="uint16"),
+            PlanItem(2, 1, 1, data_type="int16"),
+            PlanItem(3, 1, 2, count=2, data_type="int32"),
+            PlanItem(4, 1, 4, count=4, data_type="uint64"),
+        ]
+        registers = [65535, 65535] + words("i", -123456) + words("Q", 2 ** 63 + 5)
+        self.assertEqual(decode(items, registers), [65535, -1, -123456, 2 ** 63 + 5])
+
+    def test_little_word_order(self):
+        items = [PlanItem(1, 1, 0, count=2, data_type="uint32", word_order="little")]
+        self.assertEqual(decode(items, [0x5678, 0x1234]), [0x12345678])
+
+    def test_float32_keeps_unpacked_value(self):
+        items = [PlanItem(1, 1, 0, count=2, data_type="float32")]
+        value = decode(items, words("f", 1.1))[0]
+        # 表示用に丸めた 1.1 ではなく、float32 の値そのもの
+        self.assertEqual(value, struct.unpack(">f", struct.pack(">f", 1.1))[0])
+        self.assertNotEqual(value, 1.1)
+
+    def test_float64(self):
+        items = [PlanItem(1, 1, 0, count=4, data_type="float64")]
+        self.assertEqual(decode(items, words("d", 0.1)), [0.1])
+
+    def test_scale_and_offset_only_where_set(self):
+        items = [PlanItem(1, 1, 0), PlanItem(2, 1, 1, scale=0.1, offset=-5.0), PlanItem(3, 1, 2, offset=2.0)]
+        self.assertEqual(decode(items, [100, 100, 100]), [100, 100 * 0.1 - 5.0, 102.0])
+
+    def test_gap_words_are_skipped(self):
+        items = [PlanItem(1, 1, 0), PlanItem(2, 1, 3)]
+        self.assertEqual(decode(items, [1, 2, 3, 4]), [1, 4])
+
+    def test_single_item(self):
+        self.assertEqual(decode([PlanItem(1, 1, 7)], [42]), [42])
+
+    def test_coils(self):
+        items = [PlanItem(i, 1, i, reg_type="coil", data_type="float32") for i in range(3)]
+        self.assertEqual(decode(items, [1, 0, 1]), [1, 0, 1])
+
+
+class WordCountTest(unittest.TestCase):
+    def test_word_count(self):
+        self.assertEqual(word_count("float32"), 2)
+        self.assertEqual(word_count("int64"), 4)
+        self.assertEqual(word_count(None), 1)
+        self.assertEqual(word_count("unknown"), 1)
+        self.assertEqual(word_count("float64", "discrete"), 1)
+
+
+class FormatValueTest(unittest.TestCase):
+    def test_none(self):
+        self.assertEqual(format_value(None), "--")
+
+    def test_float32_shortest_digits(self):
+        for text in ("1.1", "0.1", "123.456", "-3.3", "1e-05"):
+            value = struct.unpack("<f", struct.pack("<f", float(text)))[0]
+            self.assertEqual(format_value(value), repr(float(text)))
+
+    def test_float64_not_representable_as_float32(self):
+        value = 0.1 + 0.2
+        self.assertEqual(format_value(value), str(value))
+
+    def test_integers_and_specials(self):
+        self.assertEqual(format_value(5), "5")
+        self.assertEqual(format_value(2.0), "2.0")
+        self.assertEqual(format_value(math.nan), "nan")
+        self.assertEqual(format_value(1e300), "1e+300")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+# ダッシュボードの表の描画キャッシュ (src/web/fragment_cache.py) のテスト
+import asyncio
+import types
+import unittest
+from unittest import mock
+
+from starlette.requests import Request
+
+from src.web import app as web_app
+from src.web.fragment_cache import FragmentCache, etag, matches
+
+
+class EtagTest(unittest.TestCase):
+    def test_etag_depends_on_version_and_key(self):
+        tag = etag((1700000000000, 5, 3), ("", "all"))
+        self.assertTrue(tag.startswith('"1700000000000-5-3-') and tag.endswith('"'))
+        self.assertEqual(tag, etag((1700000000000, 5, 3), ("", "all")))
+        self.assertNotEqual(tag, etag((1700000000000, 6, 3), ("", "all")))
+        self.assertNotEqual(tag, etag((1700000000000, 5, 4), ("", "all")))
+        self.assertNotEqual(tag, etag((1700000000000, 5, 3), ("PLC", "all")))
+
+    def test_matches(self):
+        tag = etag((1, 2), ("",))
+        self.assertTrue(matches(tag, tag))
+        self.assertTrue(matches(f'"other", W/{tag}', tag))
+        self.assertTrue(matches("*", tag))
+        self.assertFalse(matches('"other"', tag))
+        self.assertFalse(matches(None, tag))
+        self.assertFalse(matches("", tag))
+
+
+class FragmentCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = FragmentCache(limit=2)
+        self.renders = []
+
+    def renderer(self, text, delay=0):
+        async def render():
+            self.renders.append(text)
+            await asyncio.sleep(delay)
+            return text
+        return render
+
+    async def test_reuses_result_for_same_version_and_key(self):
+        self.assertEqual(await self.cache.get(1, "a", self.renderer("A1")), "A1")
+        self.assertEqual(await self.cache.get(1, "a", self.renderer("A2")), "A1")
+        self.assertEqual(await self.cache.get(1, "b", self.renderer("B1")), "B1")
+        # 版が変わったら全件捨てる
+        self.assertEqual(await self.cache.get(2, "a", self.renderer("A3")), "A3")
+        self.assertEqual(list(self.cache.entries), ["a"])
+        self.assertEqual(self.renders, ["A1", "B1", "A3"])
+
+    async def test_concurrent_requests_share_one_render(self):
+        results = await asyncio.gather(*(self.cache.get(1, "a", self.renderer(f"A{i}", 0.02)) for i in range(5)))
+        self.assertEqual(results, ["A0"] * 5)
+        self.assertEqual(self.renders, ["A0"])
+
+    async def test_oldest_key_is_evicted(self):
+        for key in ("a", "b", "a", "c"):
+            await self.cache.get(1, key, self.renderer(key))
+        # 最近使った a は残り、b が捨てられる
+        self.assertEqual(list(self.cache.entries), ["a", "c"])
+
+    async def test_failed_render_is_not_cached(self):
+        async def broken():
+            raise RuntimeError("render failed")
+
+        with self.assertRaises(RuntimeError):
+            await self.cache.get(1, "a", broken)
+        self.assertEqual(await self.cache.get(1, "a", self.renderer("A")), "A")
+
+    async def test_cancelled_request_does_not_cancel_render(self):
+        waiter = asyncio.create_task(self.cache.get(1, "a", self.renderer("A", 0.05)))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        # 切断したリクエストの描画は、後から来たリクエストが受け取る
+        self.assertEqual(await self.cache.get(1, "a", self.renderer("A2")), "A")
+        self.assertEqual(self.renders, ["A"])
+
+
+class DashboardFragmentTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.state = types.SimpleNamespace(
+            change_feed=types.SimpleNamespace(epoch=1700000000000, sequence=1),
+            live_view=types.SimpleNamespace(data_version=7),
+        )
+        self.renders = 0
+
+        async def render(app, *args):
+            self.renders += 1
+            return f"<table>{self.renders}</table>"
+
+        for patcher in (mock.patch.object(web_app, "render_dashboard_fragment", render),
+                        mock.patch.object(web_app, "dashboard_cache", FragmentCache())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def get(self, if_none_match=None, search=""):
+        headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+        request = Request({"type": "http", "method": "GET", "path": "/api/dashboard_fragment", "headers": headers,
+                           "query_string": b"", "app": types.SimpleNamespace(state=self.state)})
+        return await web_app.get_dashboard_fragment(request, search=search)
+
+    async def test_not_modified_until_version_changes(self):
+        response = await self.get()
+        self.assertEqual((response.status_code, response.body), (200, b"<table>1</table>"))
+        tag = response.headers["etag"]
+        self.assertEqual(response.headers["cache-control"], "no-cache")
+
+        self.assertEqual((await self.get(tag)).status_code, 304)
+        # 別の条件は描画し、ETag を持たない閲覧者には同じ条件の描画済みの結果を返す
+        self.assertEqual((await self.get(tag, search="T1")).status_code, 200)
+        self.assertEqual((await self.get()).body, b"<table>1</table>")
+        self.assertEqual(self.renders, 2)
+
+        # 値の変化・履歴のコミットで版が変わる
+        self.state.change_feed.sequence = 2
+        response = await self.get(tag)
+        self.assertEqual((response.status_code, response.body), (200, b"<table>3</table>"))
+        tag = response.headers["etag"]
+        self.state.live_view.data_version = 8
+        self.assertEqual((await self.get(tag)).status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+# 履歴のアーカイブ (src/common/history_archive.py) のテスト
+import math
+import os
+import random
+import sqlite3
+import struct
+import tempfile
+import unittest
+
+from src.common import history_archive, history_partitions
+from src.common.history_archive import (
+    ArchiveFile, decode_timestamps, decode_values, encode_timestamps, encode_values,
+)
+
+
+def bits(values):
+    """-0.0 と 0.0 を区別して比べるためのビット列（None は None のまま）"""
+    return [None if value is None else struct.pack(">d", value) for value in values]
+
+
+class TimestampCodecTest(unittest.TestCase):
+    def round_trip(self, timestamps):
+        decoded = decode_timestamps(encode_timestamps(timestamps), 0, len(timestamps))
+        self.assertEqual(decoded, timestamps)
+
+    def test_regular_interval(self):
+        self.round_trip([1_700_000_000_000 + i * 1000 for i in range(100)])
+
+    def test_single_timestamp(self):
+        self.round_trip([1_700_000_000_000])
+
+    def test_jitter_in_every_bucket(self):
+        # 差分の差分が 1bit / 7bit / 9bit / 12bit / 64bit の各範囲の端に入るように揺らす
+        timestamps = [1_700_000_000_000, 1_700_000_001_000]
+        for dod in (0, 64, -63, 256, -255, 2048, -2047, 2049, -2048, 0):
+            timestamps.append(2 * timestamps[-1] - timestamps[-2] + dod)
+        self.round_trip(timestamps)
+
+    def test_large_delta_of_delta(self):
+        base = 1_700_000_000_000
+        self.round_trip([base, base + 1000, base + 10 ** 12, base + 10 ** 12 + 1000, base + 10 ** 12 + 2000])
+        self.round_trip([0, 2 ** 62, 2 ** 62 + 1, 2])
+
+    def test_negative_timestamps(self):
+        self.round_trip([-5000, -4000, -3000, 10])
+
+    def test_end_stops_decoding_early(self):
+        timestamps = [i * 1000 for i in range(10)]
+        data = encode_timestamps(timestamps)
+        decoded = decode_timestamps(data, 0, len(timestamps), end=4500)
+        # end 以上の最初の時刻まで復号して止まる（呼び出し側が bisect で切り落とす）
+        self.assertEqual(decoded, timestamps[:6])
+        self.assertEqual(decode_timestamps(data, 0, len(timestamps), end=0), [0])
+        self.assertEqual(decode_timestamps(data, 0, len(timestamps), end=10 ** 6), timestamps)
+
+    def test_decode_from_offset(self):
+        timestamps = [1000, 2000, 3500]
+        data = b"\xff" * 3 + encode_timestamps(timestamps)
+        self.assertEqual(decode_timestamps(data, 3, 3), timestamps)
+
+
+class ValueCodecTest(unittest.TestCase):
+    def round_trip(self, values):
+        decoded = decode_values(encode_values(values), 0, len(values))
+        self.assertEqual(bits(decoded), bits(values))
+
+    def test_repeated_values(self):
+        self.round_trip([1.5] * 50)
+
+    def test_nan_and_none_decode_as_none(self):
+        values = [1.0, None, float("nan"), 2.0, None]
+        decoded = decode_values(encode_values(values), 0, len(values))
+        self.assertEqual(decoded, [1.0, None, None, 2.0, None])
+
+    def test_leading_none(self):
+        self.round_trip([None, None, 3.0])
+
+    def test_special_values(self):
+        self.round_trip([0.0, -0.0, math.inf, -math.inf, 5e-324, 1.7976931348623157e308, -1e300, 1.0])
+
+    def test_random_walk(self):
+        rng = random.Random(1)
+        values = [20.0]
+        for _ in range(2000):
+            values.append(values[-1] + rng.gauss(0, 0.5) if rng.random() < 0.7 else values[-1])
+        self.round_trip(values)
+
+    def test_integers_as_floats(self):
+        self.round_trip([float(i % 17) for i in range(500)])
+
+
+class ArchiveFileTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        self.db_path = os.path.join(self.dir, "gateway.sqlite")
+        self.archive_dir = os.path.join(self.dir, "archive")
+        self.name = history_partitions.partition_name(1_700_002_800_000, history_partitions.HOUR)
+
+    def seal(self, rows):
+        conn = sqlite3.connect(self.db_path)
+        for sql in history_partitions.create_sql(self.name):
+            conn.execute(sql)
+        conn.executemany(history_partitions.insert_sql(self.name), rows)
+        conn.commit()
+        conn.close()
+        return history_archive.seal_partition(self.db_path, self.name, self.archive_dir)
+
+    def open(self):
+        return ArchiveFile(history_archive.archive_file(self.archive_dir, self.name))
+
+    def test_read_range(self):
+        first, _ = history_partitions.partition_range(self.name)
+        rows = [(1, first + i * 1000, float(i)) for i in range(100)]
+        rows += [(2, first + 500, None), (2, first + 1500, 7.25)]
+        total, size = self.seal(rows)
+        self.assertEqual(total, 102)
+        self.assertGreater(size, 0)
+
+        archive = self.open()
+        self.assertEqual(archive.item_ids, [1, 2])
+        self.assertEqual(archive.read(1), [(ts, value) for _, ts, value in rows[:100]])
+        self.assertEqual(archive.read(2), [(first + 500, None), (first + 1500, 7.25)])
+        # [start, end) で切り出す
+        self.assertEqual(archive.read(1, first + 10_000, first + 12_000),
+                         [(first + 10_000, 10.0), (first + 11_000, 11.0)])
+        self.assertEqual(archive.read(1, first + 10_500, first + 10_900), [])
+        self.assertEqual(archive.read(1, end=first), [])
+        self.assertEqual(archive.read(1, start=first + 10 ** 6), [])
+        self.assertEqual(archive.read(3), [])
+
+    def test_reseal_merges_late_rows(self):
+        first, _ = history_partitions.partition_range(self.name)
+        self.seal([(1, first, 1.0), (1, first + 2000, 3.0)])
+        # 再送で後から届いた行だけを封印し直しても、既存の行と合わせて残る
+        self.seal([(1, first + 1000, 2.0), (1, first + 2000, 30.0), (4, first, 4.0)])
+        archive = self.open()
+        self.assertEqual(archive.read(1), [(first, 1.0), (first + 1000, 2.0), (first + 2000, 30.0)])
+        self.assertEqual(archive.read(4), [(first, 4.0)])
+
+    def partitions(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return [row[0] for row in conn.execute(history_partitions.LIST_SQL)]
+        finally:
+            conn.close()
+
+    def test_seal_drops_partition(self):
+        first, _ = history_partitions.partition_range(self.name)
+        self.seal([(1, first, 1.0)])
+        self.assertEqual(self.partitions(), [])
+
+    def test_seal_waits_for_writers(self):
+        first, _ = history_partitions.partition_range(self.name)
+        self.seal([(1, first, 1.0)])
+        conn = sqlite3.connect(self.db_path)
+        for sql in history_partitions.create_sql(self.name):
+            conn.execute(sql)
+        conn.commit()
+        # 書き込み中の接続がある間は封印も削除もしない（書き込み中の行を封印しないまま消さない）
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(history_partitions.insert_sql(self.name), (1, first + 1000, 2.0))
+        with self.assertRaises(sqlite3.OperationalError):
+            history_archive.seal_partition(self.db_path, self.name, self.archive_dir, timeout=0.1)
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.partitions(), [self.name])
+        self.assertEqual(self.open().read(1), [(first, 1.0)])
+
+        history_archive.seal_partition(self.db_path, self.name, self.archive_dir)
+        self.assertEqual(self.open().read(1), [(first, 1.0), (first + 1000, 2.0)])
+        self.assertEqual(self.partitions(), [])
+
+    def test_cache_forgets_removed_and_replaced_files(self):
+        first, end = history_partitions.partition_range(self.name)
+        path = history_archive.archive_file(self.archive_dir, self.name)
+        self.seal([(1, first, 1.0)])
+        archive = history_archive.open_archive(path)
+        self.assertIs(history_archive.open_archive(path), archive)
+
+        # 封印し直したファイルは開き直す
+        self.seal([(1, first + 1000, 2.0)])
+        self.assertNotIn(archive, [entry for _, entry in history_archive._cache.values()])
+        self.assertEqual(history_archive.open_archive(path).read(1), [(first, 1.0), (first + 1000, 2.0)])
+
+        # 期限切れで削除したファイルの mmap は持ち続けない
+        history_archive.drop_expired(self.archive_dir, end)
+        self.assertNotIn(path, history_archive._cache)
+
+        # 別のプロセスが削除した分は、次の読み出しの時に外す
+        self.seal([(1, first, 1.0)])
+        self.assertEqual(history_archive.read_range(self.archive_dir, 1), [(first, 1.0)])
+        self.assertIn(path, history_archive._cache)
+        os.remove(path)
+        self.assertEqual(history_archive.read_range(self.archive_dir, 1), [])
+        self.assertNotIn(path, history_archive._cache)
+
+    def test_set_aside_restore_and_discard(self):
+        first, _ = history_partitions.partition_range(self.name)
+        self.seal([(1, first, 1.0)])
+        aside = history_archive.set_aside(self.archive_dir)
+        self.assertEqual(history_archive.list_archives(self.archive_dir), [])
+        history_archive.restore(self.archive_dir, aside)
+        self.assertEqual(history_archive.list_archives(self.archive_dir), [self.name])
+        self.assertFalse(os.path.exists(aside))
+
+        aside = history_archive.set_aside(self.archive_dir)
+        history_archive.discard(aside)
+        self.assertFalse(os.path.exists(aside))
+        self.assertIsNone(history_archive.set_aside(self.archive_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
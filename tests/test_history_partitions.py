@@ -0,0 +1,119 @@
+# history の時間パーティション (src/common/history_partitions.py) のテスト
+import calendar
+import contextlib
+import sqlite3
+import tempfile
+import unittest
+
+import aiosqlite
+
+from src.common import history_partitions
+from src.common.history_partitions import (
+    DAY, HOUR, covering, expired, from_local_text, local_text, partition_name, partition_range, union_sql,
+)
+from tests.support import create_db
+
+# 2024-01-01 12:34:56 UTC
+T0 = calendar.timegm((2024, 1, 1, 12, 34, 56)) * 1000
+H = 3600 * 1000
+
+
+class NamingTest(unittest.TestCase):
+    def test_partition_name(self):
+        self.assertEqual(partition_name(T0, HOUR), "history_p2024010112")
+        self.assertEqual(partition_name(T0, DAY), "history_p20240101")
+        # 区切りは UTC
+        self.assertEqual(partition_name(calendar.timegm((2024, 1, 1, 23, 59, 59)) * 1000 + 999, DAY),
+                         "history_p20240101")
+        self.assertEqual(partition_name(calendar.timegm((2024, 1, 2, 0, 0, 0)) * 1000, DAY), "history_p20240102")
+
+    def test_partition_range(self):
+        start, end = partition_range("history_p2024010112")
+        self.assertEqual((start, end), (T0 - T0 % H, T0 - T0 % H + H))
+        start, end = partition_range("history_p20240101")
+        self.assertEqual(end - start, 24 * H)
+        # 範囲の中の時刻はそのパーティションに入る
+        self.assertEqual(partition_name(start, DAY), "history_p20240101")
+        self.assertEqual(partition_name(end - 1, DAY), "history_p20240101")
+        self.assertEqual(partition_name(end, DAY), "history_p20240102")
+
+    def test_covering_and_expired(self):
+        names = [partition_name(T0 + i * H, HOUR) for i in range(4)]  # 12時〜15時
+        self.assertEqual(covering(names), names)
+        self.assertEqual(covering(names, start=T0 + H), names[1:])
+        self.assertEqual(covering(names, end=partition_range(names[2])[0]), names[:2])
+        self.assertEqual(covering(names, T0 + H, T0 + H + 1), names[1:2])
+        # 期間の終わりが cutoff 以前のものだけ（途中の時刻では消さない）
+        self.assertEqual(expired(names, partition_range(names[1])[1]), names[:2])
+        self.assertEqual(expired(names, partition_range(names[1])[1] - 1), names[:1])
+
+    def test_union_sql(self):
+        sql, params = union_sql(["history_p2024010112", "history_p2024010113"], where="item_id = ?", params=(1,))
+        self.assertEqual(sql, "SELECT item_id, ts, value FROM history_p2024010112 WHERE item_id = ? "
+                              "UNION ALL SELECT item_id, ts, value FROM history_p2024010113 WHERE item_id = ?")
+        self.assertEqual(params, [1, 1])
+        # パーティションが無くても実行できる空の SELECT
+        sql, params = union_sql([])
+        with contextlib.closing(sqlite3.connect(":memory:")) as conn:
+            self.assertEqual(conn.execute(sql, params).fetchall(), [])
+
+
+class TimestampTest(unittest.TestCase):
+    def test_local_text_round_trip(self):
+        # 秒未満は切り捨てて表示する
+        self.assertEqual(from_local_text(local_text(T0 + 789)), T0)
+        # 旧形式の文字列に付いている秒未満は読み飛ばす
+        self.assertEqual(from_local_text("2024-01-01 12:00:00.123"), from_local_text("2024-01-01 12:00:00"))
+
+    def test_epoch_ms_ago(self):
+        now = history_partitions.now_ms()
+        ago = history_partitions.epoch_ms_ago(minutes=5)
+        self.assertAlmostEqual(now - ago, 5 * 60 * 1000, delta=1000)
+
+
+class PartitionQueryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db = await aiosqlite.connect(create_db(directory.name))
+        self.addAsyncCleanup(self.db.close)
+        # 12時〜14時のパーティションに 30分ごと。item 2 は 13時台だけ
+        rows = [(1, T0 + i * H // 2, float(i)) for i in range(5)] + [(2, T0 + H, 9.0)]
+        for item_id, ts, value in rows:
+            name = partition_name(ts, HOUR)
+            for sql in history_partitions.create_sql(name):
+                await self.db.execute(sql)
+            await self.db.execute(history_partitions.insert_sql(name), (item_id, ts, value))
+        await self.db.commit()
+
+    async def test_list_partitions(self):
+        self.assertEqual(await history_partitions.list_partitions(self.db),
+                         ["history_p2024010112", "history_p2024010113", "history_p2024010114"])
+
+    async def test_fetch_range_reads_covering_partitions_in_order(self):
+        rows = await history_partitions.fetch_range(self.db, 1)
+        self.assertEqual(rows, [(T0 + i * H // 2, float(i)) for i in range(5)])
+        rows = await history_partitions.fetch_range(self.db, 1, start=T0 + H // 2, end=T0 + 2 * H)
+        self.assertEqual([value for _, value in rows], [1.0, 2.0, 3.0])
+        self.assertEqual(await history_partitions.fetch_range(self.db, 2, start=T0 + 2 * H), [])
+
+    async def test_fetch_recent(self):
+        self.assertEqual(await history_partitions.fetch_recent(self.db, 1, 3),
+                         [(4.0, T0 + 2 * H), (3.0, T0 + 3 * H // 2), (2.0, T0 + H)])
+        self.assertEqual(await history_partitions.fetch_recent(self.db, 2, 10), [(9.0, T0 + H)])
+
+    async def test_same_timestamp_is_replaced(self):
+        name = partition_name(T0, HOUR)
+        await self.db.execute(history_partitions.insert_sql(name), (1, T0, 100.0))
+        self.assertEqual(await history_partitions.fetch_range(self.db, 1, end=T0 + 1), [(T0, 100.0)])
+
+    async def test_drop_expired(self):
+        dropped = await history_partitions.drop_expired(self.db, T0 - T0 % H + 2 * H)
+        self.assertEqual(dropped, ["history_p2024010112", "history_p2024010113"])
+        self.assertEqual(await history_partitions.list_partitions(self.db), ["history_p2024010114"])
+        self.assertEqual(await history_partitions.fetch_range(self.db, 1),
+                         [(T0 + 3 * H // 2, 3.0), (T0 + 2 * H, 4.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# 履歴のロールアップ (src/common/history_rollups.py) のテスト
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import aiosqlite
+
+from src.common import history_partitions, history_rollups
+from src.common.config_loader import config
+from src.common.history_rollups import RAW, aggregate, choose_resolution, minute_retention
+from tests.support import create_db
+
+MINUTE = 60 * 1000
+HOUR = 60 * MINUTE
+
+
+class AggregateTest(unittest.TestCase):
+    def test_buckets_per_resolution(self):
+        rows = [(1, 10 * HOUR + 5000, 3.0), (1, 10 * HOUR + 1000, 1.0), (1, 10 * HOUR + MINUTE, 5.0),
+                (2, 10 * HOUR, None)]
+        result = aggregate(rows)
+        # (item_id, bucket, min, max, sum, count, first, first_ts, last, last_ts)。値の無い行は数えない
+        self.assertEqual(sorted(result["history_1m"]), [
+            (1, 10 * HOUR, 1.0, 3.0, 4.0, 2, 1.0, 10 * HOUR + 1000, 3.0, 10 * HOUR + 5000),
+            (1, 10 * HOUR + MINUTE, 5.0, 5.0, 5.0, 1, 5.0, 10 * HOUR + MINUTE, 5.0, 10 * HOUR + MINUTE),
+        ])
+        self.assertEqual(result["history_1h"], [
+            (1, 10 * HOUR, 1.0, 5.0, 9.0, 3, 1.0, 10 * HOUR + 1000, 5.0, 10 * HOUR + MINUTE),
+        ])
+
+    def test_upsert_merges_batches(self):
+        conn = sqlite3.connect(":memory:")
+        for sql in history_rollups.create_sql():
+            conn.execute(sql)
+        for batch in ([(1, 2000, 4.0), (1, 3000, 6.0)], [(1, 1000, 8.0), (1, 4000, 2.0)]):
+            for table, params in aggregate(batch).items():
+                conn.executemany(history_rollups.UPSERT_SQL[table], params)
+        # 後から届いた古い時刻の値が first に、新しい時刻の値が last になる
+        self.assertEqual(conn.execute("SELECT * FROM history_1m").fetchall(),
+                         [(1, 0, 2.0, 8.0, 20.0, 4, 8.0, 1000, 2.0, 4000)])
+
+    def test_minute_retention(self):
+        self.assertEqual(minute_retention(5, 24), 24 * 60)
+        # 生の履歴より短くはしない
+        self.assertEqual(minute_retention(3 * 24 * 60, 24), 3 * 24 * 60)
+
+
+class ChooseResolutionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db = await aiosqlite.connect(create_db(directory.name))
+        self.addAsyncCleanup(self.db.close)
+        patcher = mock.patch.dict(config._data["system"], {"retention_minutes": 5, "rollup_1m_hours": 24})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 2時間前から1分ごとに60件ずつ（生データ 7200 点、1分粒度 120 点、1時間粒度 3 点）
+        now = history_partitions.now_ms()
+        start = now - 2 * HOUR
+        rows = [(1, start + i * 1000, float(i)) for i in range(0, 2 * 3600)]
+        for table, params in aggregate(rows).items():
+            await self.db.executemany(history_rollups.UPSERT_SQL[table], params)
+        await self.db.commit()
+        self.start = start
+
+    async def test_finest_resolution_that_fits(self):
+        self.assertEqual(await choose_resolution(self.db, 1, self.start, 10000), RAW)
+        self.assertEqual(await choose_resolution(self.db, 1, self.start, 2000), "1m")
+        self.assertEqual(await choose_resolution(self.db, 1, self.start, 100), "1h")
+
+    async def test_minute_rollups_outlive_raw_retention(self):
+        # start は retention_minutes (5分) より前だが、1分の集計は rollup_1m_hours の間残っているので使う
+        self.assertLess(self.start, history_partitions.epoch_ms_ago(minutes=5))
+        self.assertEqual(await choose_resolution(self.db, 1, self.start, 2000), "1m")
+
+    async def test_hourly_beyond_minute_retention(self):
+        with mock.patch.dict(config._data["system"], {"rollup_1m_hours": 1}):
+            self.assertEqual(await choose_resolution(self.db, 1, self.start, 2000), "1h")
+            self.assertEqual(await choose_resolution(self.db, 1, self.start, 10000), RAW)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# ホストごとの接続状態 (src/engine/host_state.py HostLink) のテスト
+import random
+import unittest
+
+from src.engine.host_state import CONNECTING, DEGRADED, OFFLINE, ONLINE, HostLink
+
+
+class UpperBound:
+    """uniform() が常に上限を返す乱数（待ち時間を確定させる）"""
+
+    def uniform(self, a, b):
+        return b
+
+
+class HostLinkTest(unittest.TestCase):
+    def test_initial_state(self):
+        link = HostLink(base_delay=2, rng=UpperBound())
+        self.assertEqual((link.state, link.failures), (CONNECTING, 0))
+        # 起動直後の接続も base_delay の範囲でずらす
+        self.assertEqual(link.wait_seconds(100.0), 2)
+
+    def test_backoff_doubles_up_to_max(self):
+        link = HostLink(base_delay=1, max_delay=5, offline_after=10, rng=UpperBound())
+        delays = []
+        for _ in range(5):
+            link.failed(100.0)
+            delays.append(link.wait_seconds(100.0))
+        self.assertEqual(delays, [1, 2, 4, 5, 5])
+        self.assertEqual(link.wait_seconds(103.0), 2)
+        self.assertEqual(link.wait_seconds(110.0), 0.0)
+
+    def test_jitter_stays_within_half_to_full_delay(self):
+        link = HostLink(base_delay=4, max_delay=60, rng=random.Random(1))
+        link.failures = 3
+        delays = [link.next_delay() for _ in range(200)]
+        self.assertGreaterEqual(min(delays), 8)
+        self.assertLessEqual(max(delays), 16)
+        self.assertGreater(max(delays) - min(delays), 4)
+
+    def test_transitions_report_changes_only(self):
+        link = HostLink(offline_after=3, rng=UpperBound())
+        self.assertTrue(link.succeeded())
+        self.assertEqual(link.state, ONLINE)
+        self.assertFalse(link.succeeded())
+        self.assertTrue(link.succeeded(degraded=True))
+        self.assertEqual(link.state, DEGRADED)
+        self.assertTrue(link.failed(0.0))
+        self.assertEqual(link.state, CONNECTING)
+        self.assertFalse(link.failed(0.0))
+        self.assertTrue(link.failed(0.0))
+        self.assertEqual(link.state, OFFLINE)
+        self.assertFalse(link.failed(0.0))
+
+    def test_success_resets_backoff(self):
+        link = HostLink(base_delay=1, offline_after=2, rng=UpperBound())
+        for _ in range(4):
+            link.failed(0.0)
+        self.assertEqual(link.state, OFFLINE)
+        self.assertTrue(link.succeeded())
+        self.assertEqual((link.state, link.failures), (ONLINE, 0))
+        link.failed(0.0)
+        self.assertEqual((link.state, link.wait_seconds(0.0)), (CONNECTING, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# アイテム設定キャッシュ (src/engine/item_cache.py) のテスト
+import tempfile
+import unittest
+
+from src.engine.item_cache import ItemConfigCache
+from tests.support import create_db, execute
+
+
+class ItemConfigCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = create_db(
+            directory.name,
+            hosts=[("PLC1", "127.0.0.1", 502), ("PLC2", "127.0.0.1", 503)],
+            items=[(1, "T0", 0), (1, "T1", 1), (2, "U0", 0)],
+        )
+        self.cache = ItemConfigCache(self.db_path)
+        await self.cache.open()
+        self.addAsyncCleanup(self.cache.close)
+
+    async def test_initial_load(self):
+        self.assertEqual(sorted(self.cache.hosts), [1, 2])
+        self.assertEqual([row["tag_name"] for row in self.cache.get(1).items()], ["T0", "T1"])
+        self.assertEqual([row["tag_name"] for row in self.cache.get(2).items()], ["U0"])
+        self.assertEqual(self.cache.reloads, 1)
+
+    async def test_no_commit_no_reload(self):
+        self.assertFalse(await self.cache.refresh())
+        self.assertEqual(self.cache.reloads, 1)
+
+    async def test_value_updates_do_not_reload(self):
+        # Poller が書く列の更新では config_version が変わらない
+        execute(self.db_path, "UPDATE items SET last_value = 5, updated_at = 'x', last_status = 1")
+        execute(self.db_path, "UPDATE hosts SET status = 'Offline'")
+        self.assertFalse(await self.cache.refresh())
+        self.assertEqual(self.cache.reloads, 1)
+
+    async def test_config_change_reloads_only_changed_host(self):
+        versions = {host_id: self.cache.get(host_id).version for host_id in (1, 2)}
+        execute(self.db_path, "UPDATE items SET address = 10 WHERE tag_name = 'T1'")
+        self.assertTrue(await self.cache.refresh())
+        self.assertEqual(self.cache.get(1).version, versions[1] + 1)
+        self.assertEqual(self.cache.get(2).version, versions[2])
+        self.assertEqual([row["address"] for row in self.cache.get(1).items()], [0, 10])
+        self.assertFalse(await self.cache.refresh())
+
+    async def test_inactive_host_and_triggers(self):
+        execute(self.db_path, "UPDATE hosts SET is_active = 0 WHERE id = 2")
+        execute(self.db_path, "INSERT INTO triggers (item_id, name, cond_op, cond_thr) VALUES (1, 'high', '>', 10)")
+        self.assertTrue(await self.cache.refresh())
+        self.assertEqual(sorted(self.cache.hosts), [1])
+        self.assertEqual([row["name"] for row in self.cache.triggers], ["high"])
+
+    async def test_deleted_items_bump_version(self):
+        version = self.cache.get(2).version
+        execute(self.db_path, "DELETE FROM items WHERE host_id = 2")
+        self.assertTrue(await self.cache.refresh())
+        self.assertEqual(self.cache.get(2).items(), [])
+        self.assertEqual(self.cache.get(2).version, version + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
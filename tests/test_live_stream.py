@@ -0,0 +1,133 @@
+# ダッシュボードへの現在値の配信 (src/web/live_stream.py ChangeFeed) のテスト
+import asyncio
+import json
+import unittest
+
+from src.web.live_stream import ChangeFeed
+
+
+class FakeLiveView:
+    """LiveView の代わり（共有メモリの表は無く、items をそのまま現在値として返す）"""
+
+    def __init__(self, values):
+        self.table = None
+        self.config_version = "1"
+        self.host_version = 0
+        self.items = []
+        self.set(values)
+
+    def set(self, values, threshold=50.0):
+        """item_id -> 値 で現在値を差し替える（一覧は作り直すので、ChangeFeed が変化を見比べる）"""
+        self.items = [
+            {"id": item_id, "tag_name": f"T{item_id}", "host_name": "PLC1", "last_value": value,
+             "updated_at": "2024-01-01 12:00:00", "last_status": 0, "alarm_enabled": 1, "alarm_threshold": threshold}
+            for item_id, value in values.items()
+        ]
+
+    def rows(self):
+        return self.items
+
+
+def parse(text):
+    """SSE の1メッセージ -> (event, id, data)"""
+    fields = dict(line.split(": ", 1) for line in text.strip().splitlines())
+    return fields["event"], fields["id"], json.loads(fields["data"])
+
+
+class ChangeFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.view = FakeLiveView({1: 10.0, 2: 20.0})
+        self.feed = ChangeFeed(self.view, history=3)
+
+    def test_first_poll_only_records_state(self):
+        self.assertEqual((self.feed.sequence, list(self.feed.log)), (0, []))
+        self.assertEqual(self.feed.stats, {"total": 2, "alarms": 0, "no_data": 0})
+        event, event_id, data = parse(self.feed.snapshot())
+        self.assertEqual((event, event_id), ("snapshot", f"{self.feed.epoch}:0"))
+        self.assertEqual([change["id"] for change in data["changes"]], [1, 2])
+
+    def test_delta_contains_changed_items_only(self):
+        self.view.set({1: 60.0, 2: 20.0})
+        self.assertTrue(self.feed.poll())
+        event, event_id, data = parse(self.feed.log[-1][1])
+        self.assertEqual((event, event_id), ("delta", f"{self.feed.epoch}:1"))
+        (change,) = data["changes"]
+        self.assertEqual((change["id"], change["value"], change["alarm"]), (1, 60.0, True))
+        self.assertEqual(change["previous"], {"value": 10.0, "alarm": False})
+        self.assertEqual(data["alarms"], [{"id": 1, "tag": "T1", "host": "PLC1", "alarm": True}])
+        self.assertEqual(data["stats"]["alarms"], 1)
+
+    def test_no_message_without_changes(self):
+        # 一覧が前回と同じオブジェクトなら見比べもしない
+        self.assertFalse(self.feed.poll())
+        # 作り直されても値が同じならメッセージは作らない
+        self.view.set({1: 10.0, 2: 20.0})
+        self.assertFalse(self.feed.poll())
+        self.assertEqual(self.feed.sequence, 0)
+
+    def test_reload_on_item_or_config_change(self):
+        self.view.set({1: 10.0, 2: 20.0, 3: 30.0})
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(parse(self.feed.log[-1][1])[0], "reload")
+        self.view.config_version = "2"
+        self.view.set({1: 10.0, 2: 20.0, 3: 30.0})
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(parse(self.feed.log[-1][1])[0], "reload")
+        self.view.host_version += 1
+        self.view.set({1: 10.0, 2: 20.0, 3: 30.0})
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(parse(self.feed.log[-1][1])[0], "reload")
+
+    def test_backlog(self):
+        for value in (11.0, 12.0, 13.0, 14.0):
+            self.view.set({1: value, 2: 20.0})
+            self.feed.poll()
+        epoch = self.feed.epoch
+        # 保持している (history=3) 直近の分だけ送り直せる
+        self.assertEqual([parse(text)[1] for text in self.feed.backlog(f"{epoch}:2")], [f"{epoch}:3", f"{epoch}:4"])
+        self.assertEqual(self.feed.backlog(f"{epoch}:4"), [])
+        self.assertEqual(len(self.feed.backlog(f"{epoch}:1")), 3)
+        self.assertIsNone(self.feed.backlog(f"{epoch}:0"))
+        # Web の再起動前の ID・未来の ID・不正な ID は送り直せない（全アイテム分を送る）
+        self.assertIsNone(self.feed.backlog(f"{epoch - 1}:2"))
+        self.assertIsNone(self.feed.backlog(f"{epoch}:5"))
+        self.assertIsNone(self.feed.backlog("garbage"))
+        self.assertIsNone(self.feed.backlog(None))
+
+
+class StreamTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.view = FakeLiveView({1: 10.0})
+        self.feed = ChangeFeed(self.view, interval=0.01)
+        self.runner = asyncio.create_task(self.feed.run())
+        self.addAsyncCleanup(self.stop)
+
+    async def stop(self):
+        self.runner.cancel()
+        await asyncio.gather(self.runner, return_exceptions=True)
+
+    async def test_snapshot_then_deltas(self):
+        stream = self.feed.stream()
+        self.addAsyncCleanup(stream.aclose)
+        self.assertEqual(parse(await anext(stream))[0], "snapshot")
+        self.assertEqual(self.feed.clients.value, 1)
+        self.view.set({1: 11.0})
+        event, _, data = parse(await asyncio.wait_for(anext(stream), 1))
+        self.assertEqual((event, data["changes"][0]["value"]), ("delta", 11.0))
+        await stream.aclose()
+        self.assertEqual(self.feed.clients.value, 0)
+
+    async def test_reconnect_resumes_after_last_event_id(self):
+        self.view.set({1: 11.0})
+        self.feed.poll()
+        last_event_id = self.feed.event_id()
+        self.view.set({1: 12.0})
+        self.feed.poll()
+        stream = self.feed.stream(last_event_id)
+        self.addAsyncCleanup(stream.aclose)
+        event, event_id, data = parse(await anext(stream))
+        self.assertEqual((event, event_id, data["changes"][0]["value"]), ("delta", self.feed.event_id(), 12.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
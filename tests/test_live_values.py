@@ -0,0 +1,84 @@
+# 現在値の共有メモリの表 (src/common/live_values.py) のテスト
+import os
+import tempfile
+import unittest
+
+from src.common.live_values import LiveValueTable, item_key
+
+
+class LiveValueTableTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "live_values.bin")
+        self.writer = LiveValueTable.create(self.path, 16)
+        self.addCleanup(self.writer.close)
+        self.reader = LiveValueTable.open(self.path)
+        self.addCleanup(self.reader.close)
+
+    def test_publish_and_read(self):
+        self.assertEqual(self.writer.publish([(1, 2.5, 1000, 0), (2, None, 1000, 1), (99, 1.0, 1000, 0)], 5000), 1)
+        self.assertEqual(self.reader.read(1)[:3], (2.5, 1000, 0))
+        self.assertEqual(self.reader.read(2)[:3], (None, 1000, 1))
+        self.assertIsNone(self.reader.read(3))
+        self.assertIsNone(self.reader.read(99))
+        self.assertEqual(self.reader.header(), (5000, 1))
+
+    def test_set_quality_keeps_value(self):
+        self.writer.publish([(1, 2.5, 1000, 0)], 5000)
+        self.writer.set_quality(1, 2, 6000)
+        self.assertEqual(self.reader.read(1)[:3], (2.5, 1000, 2))
+
+    def test_key_mismatch_reads_none(self):
+        key = item_key("PLC1", "T0")
+        self.writer.bind([(1, key)], 1000)
+        self.writer.publish([(1, 7.0, 1000, 0)], 1000)
+        self.assertEqual(self.reader.read(1, key)[0], 7.0)
+        self.assertIsNone(self.reader.read(1, item_key("PLC1", "T1")))
+
+    def test_reused_item_id_does_not_inherit_value(self):
+        # 全置き換えのインポートで item_id 1 が別のアイテムに振り直された
+        old, new = item_key("PLC1", "T0"), item_key("PLC1", "BAD")
+        self.writer.bind([(1, old), (2, item_key("PLC1", "T1"))], 1000)
+        self.writer.publish([(1, 7.0, 1000, 0), (2, 8.0, 1000, 0)], 1000)
+        sequence = self.reader.header()[1]
+
+        self.assertEqual(self.writer.bind([(1, new), (2, item_key("PLC1", "T1"))], 2000), 1)
+        self.assertIsNone(self.reader.read(1, new))
+        self.assertIsNone(self.reader.read(1))
+        self.assertEqual(self.reader.read(2)[0], 8.0)
+        self.assertEqual(self.reader.header(), (2000, sequence + 1))
+
+        self.writer.publish([(1, 9.0, 3000, 0)], 3000)
+        self.assertEqual(self.reader.read(1, new)[0], 9.0)
+
+    def test_bind_same_keys_changes_nothing(self):
+        keys = [(1, item_key("PLC1", "T0")), (40, item_key("PLC1", "T1"))]
+        self.writer.bind(keys, 1000)
+        self.writer.publish([(1, 7.0, 1000, 0)], 1000)
+        header = self.reader.header()
+        self.assertEqual(self.writer.bind(keys, 2000), 0)
+        self.assertEqual(self.reader.header(), header)
+        self.assertEqual(self.reader.read(1)[0], 7.0)
+
+    def test_item_key_is_never_zero(self):
+        self.assertNotEqual(item_key("", ""), 0)
+        self.assertNotEqual(item_key("PLC1", "T0"), item_key("PLC1", "T1"))
+        self.assertNotEqual(item_key("PLC1", "T0"), item_key("PLC", "1T0"))
+
+    def test_values_survive_reopen(self):
+        self.writer.publish([(3, 1.5, 1000, 0)], 1000)
+        reopened = LiveValueTable.create(self.path, 16)
+        self.addCleanup(reopened.close)
+        self.assertFalse(self.reader.replaced())
+        self.assertEqual(reopened.read(3)[0], 1.5)
+
+    def test_capacity_change_replaces_file(self):
+        recreated = LiveValueTable.create(self.path, 32)
+        self.addCleanup(recreated.close)
+        self.assertTrue(self.reader.replaced())
+        self.assertIsNone(recreated.read(3))
+
+
+if __name__ == "__main__":
+    unittest.main()
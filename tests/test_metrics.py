@@ -0,0 +1,104 @@
+# 実行時メトリクス (src/engine/metrics.py) のテスト
+import asyncio
+import unittest
+from unittest import mock
+
+from src.common.config_loader import config
+from src.engine import metrics
+from src.engine.metrics import REGISTRY, HostMetrics, Registry, start_metrics_server
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge(self):
+        requests = self.registry.counter("requests", "Requests sent", ("host",))
+        depth = self.registry.gauge("queue_depth", "Queue depth")
+        requests.labels("PLC1").inc()
+        requests.labels("PLC1").inc(2)
+        depth.labels().set_function(lambda: 7)
+        self.assertEqual(self.registry.render(), "\n".join([
+            "# HELP requests Requests sent",
+            "# TYPE requests counter",
+            'requests_total{host="PLC1"} 3',
+            "# HELP queue_depth Queue depth",
+            "# TYPE queue_depth gauge",
+            "queue_depth 7",
+        ]) + "\n")
+
+    def test_histogram_is_cumulative(self):
+        latency = self.registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+        child = latency.labels()
+        for value in (0.05, 0.1, 0.5, 3.0):
+            child.observe(value)
+        lines = self.registry.render().splitlines()[2:]
+        self.assertEqual(lines, [
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1.0"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            "latency_seconds_sum 3.65",
+            "latency_seconds_count 4",
+        ])
+
+    def test_labels_are_escaped(self):
+        family = self.registry.counter("c", "Counter", ("host",))
+        family.labels('Line "A"\\1').inc()
+        self.assertIn('c_total{host="Line \\"A\\"\\\\1"} 1', self.registry.render())
+
+    def test_remove_by_label(self):
+        failures = self.registry.counter("failures", "Failures", ("host", "kind"))
+        failures.labels("PLC1", "comm").inc()
+        failures.labels("PLC1", "connect").inc()
+        failures.labels("PLC2", "comm").inc()
+        self.registry.remove(host="PLC1")
+        self.assertEqual(list(failures.children), [("PLC2", "comm")])
+        # ラベルを持たない系列は対象外
+        self.registry.remove(table="history")
+        self.assertEqual(list(failures.children), [("PLC2", "comm")])
+
+
+class HostMetricsTest(unittest.TestCase):
+    def test_series_are_shared_and_removed(self):
+        host = HostMetrics("test-metrics")
+        self.addCleanup(host.remove)
+        host.requests.inc(5)
+        # 同じホストの系列は同じオブジェクト（ホストを起動し直しても数え続ける）
+        self.assertIs(HostMetrics("test-metrics").requests, host.requests)
+        self.assertIn('seg_modbus_requests_total{host="test-metrics"} 5', REGISTRY.render())
+        host.remove()
+        self.assertNotIn('host="test-metrics"', REGISTRY.render())
+
+
+class EndpointTest(unittest.IsolatedAsyncioTestCase):
+    async def fetch(self, port, path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    async def test_serves_registry_on_ephemeral_port(self):
+        with mock.patch.dict(config._data, {"metrics": {"enabled": True, "host": "127.0.0.1", "port": 0}}):
+            server = await start_metrics_server()
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+        self.assertNotEqual(port, 0)
+
+        response = await self.fetch(port, "/metrics")
+        self.assertTrue(response.startswith("HTTP/1.0 200 OK\r\n"))
+        self.assertIn("# TYPE seg_writer_queue_depth gauge", response)
+        self.assertTrue((await self.fetch(port, "/other")).startswith("HTTP/1.0 404"))
+
+    async def test_disabled(self):
+        with mock.patch.dict(config._data, {"metrics": {"enabled": False}}):
+            self.assertIsNone(await start_metrics_server())
+
+    async def test_bind_failure_does_not_raise(self):
+        with mock.patch.object(metrics.asyncio, "start_server", side_effect=OSError("in use")), \
+                mock.patch.dict(config._data, {"metrics": {"enabled": True, "port": 9108}}):
+            self.assertIsNone(await start_metrics_server())
+
+
+if __name__ == "__main__":
+    unittest.main()
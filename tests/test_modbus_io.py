@@ -0,0 +1,193 @@
+# パイプラインモードの読み出し (src/engine/modbus_io.py PipelinedModbusReader) のテスト
+import asyncio
+import struct
+import time
+import unittest
+
+from src.engine.modbus_io import ModbusReadError, PipelinedModbusReader
+from src.engine.read_planner import PlanItem, ReadBlock
+
+MBAP = struct.Struct(">HHHB")
+REQUEST = struct.Struct(">BHH")
+
+
+class FakeDevice:
+    """レジスタ n に値 n を返す Modbus TCP サーバー（要求ごとに振る舞いを変えられる）
+
+    serial_only: 応答待ちの要求がある間に届いた要求には応答しない（パイプライン非対応の機器）
+    drop       : 応答しない要求の通し番号 (1 から)
+    respond    : 要求の通し番号 -> 返す PDU（省略時は正しい応答）。不正な応答を返すのに使う
+    """
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.serial_only = False
+        self.drop = set()
+        self.respond = {}
+        self.requests = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        busy = 0
+        tasks = set()
+
+        async def answer(tid, unit, pdu):
+            nonlocal busy
+            await asyncio.sleep(self.delay)
+            busy -= 1
+            writer.write(MBAP.pack(tid, 0, len(pdu) + 1, unit) + pdu)
+
+        try:
+            while True:
+                tid, _, length, unit = MBAP.unpack(await reader.readexactly(MBAP.size))
+                function_code, address, count = REQUEST.unpack(await reader.readexactly(length - 1))
+                self.requests += 1
+                number = self.requests
+                if number in self.drop or (self.serial_only and busy):
+                    continue
+                if number in self.respond:
+                    pdu = self.respond[number]
+                else:
+                    pdu = struct.pack(f">BB{count}H", function_code, count * 2, *range(address, address + count))
+                busy += 1
+                task = asyncio.create_task(answer(tid, unit, pdu))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+
+def blocks(count=4):
+    return [ReadBlock.from_items([PlanItem(i, 1, i * 10, count=2)]) for i in range(count)]
+
+
+class PipelinedModbusReaderTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.device = FakeDevice()
+        self.port = await self.device.start()
+        self.addAsyncCleanup(self.device.stop)
+
+    async def connect(self, **kwargs):
+        reader = PipelinedModbusReader("127.0.0.1", self.port, window=8, timeout=0.3, **kwargs)
+        self.assertTrue(await reader.connect())
+        self.addCleanup(reader.close)
+        return reader
+
+    def assert_values(self, results):
+        self.assertEqual([values for _, values in results], [[i * 10, i * 10 + 1] for i in range(len(results))])
+
+    async def test_pipelined_reads(self):
+        reader = await self.connect()
+        started = time.monotonic()
+        results = await reader.read_blocks(blocks(8))
+        self.assert_values(results)
+        # 8 要求を同時に流すので、応答待ちは1回分で済む
+        self.assertLess(time.monotonic() - started, self.device.delay * 4)
+        self.assertEqual((reader.window, reader.fallbacks), (8, 0))
+
+    async def test_transient_timeout_keeps_pipelining(self):
+        reader = await self.connect()
+        self.device.drop = {2}
+        self.assert_values(await reader.read_blocks(blocks()))
+        self.assertEqual((reader.window, reader.pipeline_failures), (8, 1))
+        self.assert_values(await reader.read_blocks(blocks()))
+        self.assertEqual((reader.window, reader.pipeline_failures, reader.fallbacks), (8, 0, 0))
+
+    async def test_serial_only_device_falls_back_after_consecutive_failures(self):
+        reader = await self.connect(fallback_failures=3)
+        self.device.serial_only = True
+        for attempt in range(1, 3):
+            self.assert_values(await reader.read_blocks(blocks()))
+            self.assertEqual((reader.window, reader.pipeline_failures), (8, attempt))
+        self.assert_values(await reader.read_blocks(blocks()))
+        self.assertEqual((reader.window, reader.fallbacks), (1, 1))
+        # 直列モードでは再試行なしで読める
+        requests = self.device.requests
+        self.assert_values(await reader.read_blocks(blocks()))
+        self.assertEqual(self.device.requests, requests + 4)
+
+    async def test_failures_also_seen_in_serial_do_not_count(self):
+        reader = await self.connect(fallback_failures=1)
+        # 1回目 (パイプライン) と 直列での再試行 の両方で、2番目のブロックが応答しない
+        self.device.drop = {2, 5}
+        results = await reader.read_blocks(blocks())
+        self.assertIsInstance(results[1][1], asyncio.TimeoutError)
+        self.assertEqual((reader.window, reader.pipeline_failures, reader.fallbacks), (8, 0, 0))
+
+    async def test_probes_pipeline_again_after_cool_down(self):
+        reader = await self.connect(fallback_failures=1, probe_seconds=0.1)
+        self.device.serial_only = True
+        await reader.read_blocks(blocks())
+        self.assertEqual(reader.window, 1)
+        await reader.read_blocks(blocks())
+        self.assertEqual(reader.window, 1)
+
+        # 機器が直った後、待ち時間が過ぎたら元の window で読む
+        self.device.serial_only = False
+        await asyncio.sleep(0.15)
+        self.assert_values(await reader.read_blocks(blocks()))
+        self.assertEqual((reader.window, reader.fallbacks), (8, 1))
+
+    async def test_probe_falls_back_again_if_still_unsupported(self):
+        reader = await self.connect(fallback_failures=1, probe_seconds=0.05)
+        self.device.serial_only = True
+        await reader.read_blocks(blocks())
+        await asyncio.sleep(0.1)
+        self.assert_values(await reader.read_blocks(blocks()))
+        self.assertEqual((reader.window, reader.fallbacks), (1, 2))
+
+    async def test_exception_response(self):
+        reader = await self.connect()
+        self.device.respond = {1: bytes([0x83, 0x02])}
+        with self.assertRaises(ModbusReadError) as raised:
+            await reader.read(blocks(1)[0])
+        self.assertTrue(raised.exception.address_error)
+        self.assertTrue(reader.connected)
+
+    async def assert_malformed_fails_fast(self, pdu):
+        reader = await self.connect()
+        reader.timeout = 5
+        self.device.respond = {1: pdu}
+        started = time.monotonic()
+        results = await asyncio.wait_for(asyncio.gather(
+            reader._read_or_error(blocks(1)[0]), reader._read_or_error(blocks(2)[1])), 2)
+        # 壊れた応答を受け取った要求も、応答待ちの他の要求も、タイムアウトを待たずに失敗する
+        for result in results:
+            self.assertIsInstance(result, ConnectionError)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertFalse(reader.connected)
+        self.assertEqual(reader._pending, {})
+
+    async def test_short_register_payload(self):
+        await self.assert_malformed_fails_fast(bytes([0x03, 0x04, 0x00]))
+
+    async def test_empty_pdu(self):
+        await self.assert_malformed_fails_fast(b"")
+
+    async def test_truncated_exception_response(self):
+        await self.assert_malformed_fails_fast(bytes([0x83]))
+
+    async def test_reconnects_after_malformed_response(self):
+        reader = await self.connect()
+        self.device.respond = {1: b""}
+        with self.assertRaises(ConnectionError):
+            await reader.read(blocks(1)[0])
+        reader.close()
+        self.assertTrue(await reader.connect())
+        self.assert_values(await reader.read_blocks(blocks()))
+
+
+if __name__ == "__main__":
+    unittest.main()
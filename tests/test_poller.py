@@ -0,0 +1,232 @@
+# 収集ループ (src/engine/poller.py ModbusPoller) のテスト
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+from src.engine.host_state import HostLink
+from src.engine.item_cache import ItemConfigCache
+from src.engine.metrics import HostMetrics
+from src.engine.poller import ModbusPoller
+from src.engine.recovery import Quarantine
+from src.engine.scheduler import CycleTimer, IntervalScheduler
+from src.engine.writer import WriteSubmitter
+from tests.support import create_db, execute
+
+
+class RecordingWriter(WriteSubmitter):
+    def __init__(self):
+        self.messages = []
+
+    def _put(self, message):
+        self.messages.append(message)
+
+
+class SlowClient:
+    """1ブロックの読み出しに delay 秒かかる接続済みのクライアント"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.connected = True
+        self.requests = 0
+
+    async def read_blocks(self, blocks):
+        await asyncio.sleep(self.delay)
+        self.requests += len(blocks)
+        return [(block, list(range(block.start, block.end))) for block in blocks]
+
+    def close(self):
+        self.connected = False
+
+
+class PollLoopTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = create_db(directory.name, hosts=[("PLC1", "127.0.0.1", 502)],
+                                 items=[(1, "T0", 0), (1, "T1", 1)])
+        self.cache = ItemConfigCache(self.db_path)
+        await self.cache.open()
+        self.addAsyncCleanup(self.cache.close)
+        self.poller = ModbusPoller(writer=RecordingWriter())
+        # items.polling_interval の既定 (5秒) を1チックとして、毎サイクル全ブロックを読ませる
+        self.poller.scheduler = IntervalScheduler(base_interval=5)
+
+    async def test_read_stats_include_the_current_cycle(self):
+        timer = CycleTimer(0.05)
+        reported = []
+
+        def record(host_name, host_id, requests, naive, timer):
+            reported.append((requests, naive, timer.cycles, timer.last_duration))
+            self.poller.running = False
+
+        table = self.cache.get(1)
+        with mock.patch.object(self.poller, "record_read_stats", side_effect=record):
+            await asyncio.wait_for(self.poller._poll_loop(
+                1, "PLC1", SlowClient(0.02), timer, table, Quarantine(), HostLink(), HostMetrics("test-poller")), 2)
+
+        # 1回目の報告に、そのサイクル自身の所要時間が入っている
+        ((requests, naive, cycles, duration),) = reported
+        self.assertEqual((requests, naive, cycles), (1, 2, 1))
+        self.assertGreaterEqual(duration, 0.02)
+
+
+class ReconcileHostsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = create_db(directory.name, hosts=[("PLC1", "127.0.0.1", 502), ("PLC2", "127.0.0.1", 503)])
+        self.poller = ModbusPoller(writer=RecordingWriter())
+        self.poller.item_cache = ItemConfigCache(self.db_path)
+        await self.poller.item_cache.open()
+        self.addAsyncCleanup(self.poller.item_cache.close)
+        self.started = []   # 起動された poll_host の (host_id, port)
+        self.stopped = []   # 終了した poll_host の host_id
+        self.poller.poll_host = self.poll_host
+        self.addAsyncCleanup(self.stop_all)
+
+    async def poll_host(self, host_config):
+        self.started.append((host_config['id'], host_config['port']))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self.stopped.append(host_config['id'])
+
+    async def stop_all(self):
+        tasks = [task for task, _ in self.poller.host_tasks.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def reconcile(self):
+        await self.poller.item_cache.refresh()
+        await self.poller.reconcile_hosts()
+        await asyncio.sleep(0)  # 起動したタスクを1回動かす
+
+    async def test_starts_active_hosts(self):
+        await self.reconcile()
+        self.assertEqual(sorted(self.started), [(1, 502), (2, 503)])
+        # 変化が無ければ何もしない
+        await self.reconcile()
+        self.assertEqual(len(self.started), 2)
+        self.assertEqual(self.stopped, [])
+
+    async def test_added_and_removed_hosts(self):
+        await self.reconcile()
+        execute(self.db_path, "INSERT INTO hosts (display_name, ip_address, port) VALUES ('PLC3', '127.0.0.1', 504)")
+        execute(self.db_path, "UPDATE hosts SET is_active = 0 WHERE id = 1")
+        await self.reconcile()
+        self.assertEqual(sorted(self.started), [(1, 502), (2, 503), (3, 504)])
+        self.assertEqual(self.stopped, [1])
+        self.assertEqual(sorted(self.poller.host_tasks), [2, 3])
+
+    async def test_connection_change_restarts_host(self):
+        await self.reconcile()
+        execute(self.db_path, "UPDATE hosts SET port = 1502 WHERE id = 2")
+        await self.reconcile()
+        self.assertEqual(self.stopped, [2])
+        self.assertEqual(self.started[-1], (2, 1502))
+        # 接続に関係しない変更では起動し直さない
+        execute(self.db_path, "UPDATE hosts SET display_name = 'Line 2' WHERE id = 2")
+        await self.reconcile()
+        self.assertEqual(self.stopped, [2])
+
+    async def test_finished_task_is_restarted(self):
+        await self.reconcile()
+        task, _ = self.poller.host_tasks[1]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await self.reconcile()
+        self.assertEqual(sorted(self.started), [(1, 502), (1, 502), (2, 503)])
+
+    async def test_host_filter(self):
+        self.poller.host_filter = lambda host_id: host_id == 2
+        await self.reconcile()
+        self.assertEqual(self.started, [(2, 503)])
+        # 担当が変われば (--workers のワーカー停止など) 引き継ぐ
+        self.poller.host_filter = lambda host_id: True
+        await self.reconcile()
+        self.assertEqual(sorted(self.started), [(1, 502), (2, 503)])
+
+
+class CompressorForTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = create_db(directory.name, hosts=[("PLC1", "127.0.0.1", 502)],
+                                 items=[(1, "T0", 0), (1, "T1", 1)])
+        execute(self.db_path, "UPDATE items SET deadband = 5")
+        self.poller = ModbusPoller(writer=RecordingWriter())
+        self.poller.item_cache = ItemConfigCache(self.db_path)
+        await self.poller.item_cache.open()
+        self.addAsyncCleanup(self.poller.item_cache.close)
+
+    def item(self, item_id):
+        return self.poller.item_cache.get(1).rows[item_id]
+
+    def offer(self, item_id, t, value):
+        """値を渡し、履歴に残すと判定されたかを返す"""
+        _, record = self.poller.compressor_for(self.item(item_id), t).offer(t, value, t)
+        return record
+
+    async def test_unrelated_config_change_keeps_state(self):
+        self.assertTrue(self.offer(1, 0, 10.0))
+        execute(self.db_path, "UPDATE items SET alarm_threshold = 100 WHERE id = 1")
+        self.assertTrue(await self.poller.item_cache.refresh())
+        # 前回残した 10.0 から deadband 以内なので残さない
+        self.assertFalse(self.offer(1, 1, 12.0))
+
+    async def test_reused_item_id_starts_fresh(self):
+        self.assertTrue(self.offer(1, 0, 10.0))
+        # 上書きインポート: item_id 1 が別のタグ (前回値 50.0) に振り直される
+        execute(self.db_path, "DELETE FROM items")
+        execute(self.db_path, "INSERT INTO items (id, host_id, tag_name, address, deadband, last_value) "
+                              "VALUES (1, 1, 'U0', 7, 5, 50.0)")
+        self.assertTrue(await self.poller.item_cache.refresh())
+        # 前のアイテムの 10.0 ではなく、新しいアイテムの前回値 50.0 を起点に判定する
+        self.assertTrue(self.offer(1, 1, 12.0))
+        self.assertFalse(self.offer(1, 2, 14.0))
+
+
+class ReloadTriggersTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = create_db(directory.name, hosts=[("PLC1", "127.0.0.1", 502)], items=[(1, "T0", 0)])
+        execute(self.db_path, "UPDATE items SET alarm_enabled = 1, alarm_threshold = 50")
+        self.writer = RecordingWriter()
+        self.poller = ModbusPoller(writer=self.writer)
+        self.poller.item_cache = ItemConfigCache(self.db_path)
+        await self.poller.item_cache.open()
+        self.addAsyncCleanup(self.poller.item_cache.close)
+        self.poller.reload_triggers()
+
+    def events(self):
+        return [kind for message, payload in self.writer.messages if message == "events" for kind, _ in payload]
+
+    async def reload(self):
+        self.assertTrue(await self.poller.item_cache.refresh())
+        self.poller.reload_triggers()
+
+    async def test_threshold_change_keeps_state(self):
+        self.poller.evaluate_triggers("PLC1", self.poller.item_cache.get(1).rows, [(1, 90.0, "t0")])
+        execute(self.db_path, "UPDATE items SET alarm_threshold = 60")
+        await self.reload()
+        self.poller.evaluate_triggers("PLC1", self.poller.item_cache.get(1).rows, [(1, 90.0, "t1")])
+        self.assertEqual(self.events(), ["open"])
+
+    async def test_reused_item_id_closes_previous_alarm(self):
+        self.poller.evaluate_triggers("PLC1", self.poller.item_cache.get(1).rows, [(1, 90.0, "t0")])
+        # 上書きインポート: item_id 1 が別のタグに振り直される
+        execute(self.db_path, "DELETE FROM items")
+        execute(self.db_path, "INSERT INTO items (id, host_id, tag_name, address, alarm_enabled, alarm_threshold) "
+                              "VALUES (1, 1, 'U0', 7, 1, 50)")
+        await self.reload()
+        # 前のタグの発生中アラームは閉じ、新しいタグは改めて判定する
+        self.assertEqual(self.events(), ["open", "close"])
+        self.poller.evaluate_triggers("PLC1", self.poller.item_cache.get(1).rows, [(1, 90.0, "t1")])
+        self.assertEqual(self.events(), ["open", "close", "open"])
+
+
+if __name__ == "__main__":
+    unittest.main()
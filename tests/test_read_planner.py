@@ -0,0 +1,99 @@
+# 読み出し計画コンパイラ (src/engine/read_planner.py) のテスト
+import unittest
+
+from src.engine.read_planner import PlanItem, ReadBlock, build_read_plan
+
+
+def spans(blocks):
+    return [(block.host_id, block.reg_type, block.interval, block.start, block.count) for block in blocks]
+
+
+class BuildReadPlanTest(unittest.TestCase):
+    def test_contiguous_addresses_make_one_block(self):
+        items = [PlanItem(i, 1, 100 + i) for i in range(5)]
+        blocks = build_read_plan(items)
+        self.assertEqual(spans(blocks), [(1, "holding", 1, 100, 5)])
+        self.assertEqual([item.item_id for item in blocks[0].items], [0, 1, 2, 3, 4])
+
+    def test_gap_within_max_gap_is_merged(self):
+        items = [PlanItem(1, 1, 0), PlanItem(2, 1, 4)]
+        # 終端 1 からの差は 3
+        self.assertEqual(spans(build_read_plan(items, max_gap=3)), [(1, "holding", 1, 0, 5)])
+        self.assertEqual(spans(build_read_plan(items, max_gap=2)),
+                         [(1, "holding", 1, 0, 1), (1, "holding", 1, 4, 1)])
+
+    def test_split_by_interval_host_and_reg_type(self):
+        items = [
+            PlanItem(1, 1, 0),
+            PlanItem(2, 1, 1, interval=5),
+            PlanItem(3, 2, 2),
+            PlanItem(4, 1, 3, reg_type="input"),
+        ]
+        self.assertEqual(spans(build_read_plan(items, max_gap=10)), [
+            (1, "holding", 1, 0, 1),
+            (1, "input", 1, 3, 1),
+            (2, "holding", 1, 2, 1),
+            (1, "holding", 5, 1, 1),
+        ])
+
+    def test_block_never_exceeds_function_code_limit(self):
+        items = [PlanItem(i, 1, i) for i in range(300)]
+        blocks = build_read_plan(items)
+        self.assertEqual([block.count for block in blocks], [125, 125, 50])
+        blocks = build_read_plan(items, max_count=100)
+        self.assertEqual([block.count for block in blocks], [100, 100, 100])
+
+    def test_coils_use_bit_limit(self):
+        items = [PlanItem(i, 1, i, reg_type="coil") for i in range(2500)]
+        self.assertEqual([block.count for block in build_read_plan(items)], [2000, 500])
+
+    def test_multi_word_item_extends_block(self):
+        items = [PlanItem(1, 1, 10, count=2, data_type="float32"), PlanItem(2, 1, 12)]
+        blocks = build_read_plan(items)
+        self.assertEqual(spans(blocks), [(1, "holding", 1, 10, 3)])
+        self.assertEqual(blocks[0].end, 13)
+
+    def test_multi_word_item_does_not_straddle_limit(self):
+        items = [PlanItem(i, 1, i) for i in range(124)] + [PlanItem(999, 1, 124, count=2, data_type="float32")]
+        blocks = build_read_plan(items)
+        self.assertEqual([(block.start, block.count) for block in blocks], [(0, 124), (124, 2)])
+
+
+class PlanItemTest(unittest.TestCase):
+    def test_from_row_defaults(self):
+        row = {"id": 7, "host_id": 2, "address": 40, "polling_interval": None,
+               "reg_type": "", "data_type": "float32", "word_order": None, "scale": None, "value_offset": None}
+        item = PlanItem.from_row(row)
+        self.assertEqual((item.item_id, item.host_id, item.address), (7, 2, 40))
+        self.assertEqual((item.reg_type, item.interval, item.count), ("holding", 1, 2))
+        self.assertEqual((item.word_order, item.scale, item.offset), ("big", 1.0, 0.0))
+
+    def test_from_row_unknown_data_type_falls_back(self):
+        row = {"id": 1, "host_id": 1, "address": 0, "polling_interval": 5, "data_type": "bogus"}
+        item = PlanItem.from_row(row)
+        self.assertEqual((item.data_type, item.count, item.interval), ("uint16", 1, 5))
+
+    def test_coil_counts_one_bit(self):
+        row = {"id": 1, "host_id": 1, "address": 0, "polling_interval": 1, "reg_type": "coil", "data_type": "uint32"}
+        self.assertEqual(PlanItem.from_row(row).count, 1)
+
+
+class ReadBlockTest(unittest.TestCase):
+    def test_from_items_sorts_by_address(self):
+        block = ReadBlock.from_items([PlanItem(2, 1, 8), PlanItem(1, 1, 3)])
+        self.assertEqual((block.start, block.count), (3, 6))
+        self.assertEqual([item.item_id for item in block.items], [1, 2])
+
+    def test_decode_pairs_items_with_values(self):
+        block = ReadBlock.from_items([PlanItem(1, 1, 0), PlanItem(2, 1, 2, scale=0.5, offset=1.0)])
+        self.assertEqual([(item.item_id, value) for item, value in block.decode([10, 99, 20])], [(1, 10), (2, 11.0)])
+
+    def test_add_resets_decoder(self):
+        block = ReadBlock.from_items([PlanItem(1, 1, 0)])
+        self.assertEqual([value for _, value in block.decode([5])], [5])
+        block.add(PlanItem(2, 1, 1))
+        self.assertEqual([value for _, value in block.decode([5, 6])], [5, 6])
+
+
+if __name__ == "__main__":
+    unittest.main()
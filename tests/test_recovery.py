@@ -0,0 +1,118 @@
+# 段階的切り分けと一時除外 (src/engine/recovery.py, ModbusPoller.read_with_recovery) のテスト
+import unittest
+
+from src.engine.metrics import HostMetrics
+from src.engine.modbus_io import ILLEGAL_DATA_ADDRESS, ILLEGAL_DATA_VALUE, ModbusReadError
+from src.engine.poller import ModbusPoller
+from src.engine.read_planner import PlanItem, ReadBlock
+from src.engine.recovery import STATUS_ADDRESS_ERROR, Quarantine, step_down
+from src.engine.writer import WriteSubmitter
+
+SERVER_DEVICE_FAILURE = 0x04
+SERVER_DEVICE_BUSY = 0x06
+
+
+class FakeReader:
+    """bad のアドレスを含むブロックに exception_code の例外応答を返す機器"""
+
+    def __init__(self, bad=(), exception_code=ILLEGAL_DATA_ADDRESS):
+        self.bad = set(bad)
+        self.exception_code = exception_code
+        self.requests = 0
+
+    async def read_blocks(self, blocks):
+        results = []
+        for block in blocks:
+            self.requests += 1
+            if any(item.address in self.bad for item in block.items):
+                results.append((block, ModbusReadError(self.exception_code)))
+            else:
+                results.append((block, list(range(block.start, block.end))))
+        return results
+
+
+class RecordingWriter(WriteSubmitter):
+    def __init__(self):
+        self.messages = []
+
+    def _put(self, message):
+        self.messages.append(message)
+
+
+def make_block(addresses):
+    return ReadBlock.from_items([PlanItem(address, 1, address) for address in addresses])
+
+
+class ModbusReadErrorTest(unittest.TestCase):
+    def test_address_error(self):
+        self.assertTrue(ModbusReadError(ILLEGAL_DATA_ADDRESS).address_error)
+        self.assertTrue(ModbusReadError(ILLEGAL_DATA_VALUE).address_error)
+        for code in (0x01, SERVER_DEVICE_FAILURE, SERVER_DEVICE_BUSY, 0x0A, 0x0B, 0):
+            self.assertFalse(ModbusReadError(code).address_error)
+
+
+class StepDownTest(unittest.IsolatedAsyncioTestCase):
+    async def test_isolates_bad_address(self):
+        reader = FakeReader(bad={5})
+        recovered, bad_items = await step_down(reader, make_block(range(8)))
+        self.assertEqual([item.address for item in bad_items], [5])
+        read = sorted(item.address for block, _ in recovered for item in block.items)
+        self.assertEqual(read, [0, 1, 2, 3, 4, 6, 7])
+
+    async def test_illegal_data_value_is_bisected(self):
+        reader = FakeReader(bad={0, 7}, exception_code=ILLEGAL_DATA_VALUE)
+        _, bad_items = await step_down(reader, make_block(range(8)))
+        self.assertEqual(sorted(item.address for item in bad_items), [0, 7])
+
+    async def test_other_exception_codes_are_not_bisected(self):
+        for code in (SERVER_DEVICE_FAILURE, SERVER_DEVICE_BUSY):
+            reader = FakeReader(bad=range(8), exception_code=code)
+            recovered, bad_items = await step_down(reader, make_block(range(8)))
+            self.assertEqual((recovered, bad_items), ([], []))
+            # 半分ずつ1回読んだだけで、それ以上は切り分けない
+            self.assertEqual(reader.requests, 2)
+
+
+class ReadWithRecoveryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.writer = RecordingWriter()
+        self.poller = ModbusPoller(writer=self.writer)
+        self.metrics = HostMetrics("test-recovery")
+        self.quarantine = Quarantine()
+
+    async def read(self, reader, blocks):
+        return await self.poller.read_with_recovery(reader, "test", blocks, self.quarantine, self.metrics)
+
+    async def test_address_error_quarantines_item(self):
+        exceptions = self.metrics.exception_failures.value
+        succeeded, comm_errors = await self.read(FakeReader(bad={2}), [make_block(range(4))])
+        self.assertEqual(comm_errors, 0)
+        self.assertIn(2, self.quarantine)
+        self.assertEqual(len(self.quarantine), 1)
+        self.assertEqual(sorted(item.address for block, _ in succeeded for item in block.items), [0, 1, 3])
+        self.assertIn(("item_status", (STATUS_ADDRESS_ERROR, 2)), self.writer.messages)
+        self.assertEqual(self.metrics.exception_failures.value, exceptions + 1)
+
+    async def test_device_failure_counts_as_comm_failure(self):
+        comm = self.metrics.comm_failures.value
+        reader = FakeReader(bad={2}, exception_code=SERVER_DEVICE_FAILURE)
+        succeeded, comm_errors = await self.read(reader, [make_block(range(4)), make_block([10])])
+        self.assertEqual(comm_errors, 1)
+        self.assertEqual(len(succeeded), 1)
+        self.assertEqual(len(self.quarantine), 0)
+        self.assertEqual(self.writer.messages, [])
+        self.assertEqual(self.metrics.comm_failures.value, comm + 1)
+        self.assertEqual(reader.requests, 2)
+
+    async def test_connection_errors_count_as_comm_failure(self):
+        class Disconnected:
+            async def read_blocks(self, blocks):
+                return [(block, ConnectionError("connection lost")) for block in blocks]
+
+        _, comm_errors = await self.read(Disconnected(), [make_block([0]), make_block([10])])
+        self.assertEqual(comm_errors, 2)
+        self.assertEqual(len(self.quarantine), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+# 保持期間の処理 (src/engine/retention.py RetentionWorker) のテスト
+import asyncio
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import aiosqlite
+
+from src.common import history_archive, history_partitions, history_rollups
+from src.engine.retention import RetentionWorker
+from tests.support import create_db
+
+MINUTE = 60 * 1000
+HOUR = 60 * MINUTE
+
+
+def insert_history(conn, rows, span="hour"):
+    """[(item_id, ts, value), ...] をパーティションと集計に書き込む"""
+    for item_id, ts, value in rows:
+        name = history_partitions.partition_name(ts, span)
+        for sql in history_partitions.create_sql(name):
+            conn.execute(sql)
+        conn.execute(history_partitions.insert_sql(name), (item_id, ts, value))
+    for table, params in history_rollups.aggregate(rows).items():
+        conn.executemany(history_rollups.UPSERT_SQL[table], params)
+
+
+class PruneTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = create_db(directory.name)
+        self.now = history_partitions.now_ms()
+        self.worker = RetentionWorker(self.db_path, retention_minutes=10, chunk_rows=2, rollup_1m_hours=1)
+        self.db = await aiosqlite.connect(self.db_path)
+        self.addAsyncCleanup(self.db.close)
+
+    def populate(self, rows, events=()):
+        conn = sqlite3.connect(self.db_path)
+        insert_history(conn, rows)
+        conn.executemany("INSERT INTO event_logs (item_id, start_time, status) VALUES (1, ?, 'resolved')",
+                         [(history_partitions.local_text(ts),) for ts in events])
+        conn.commit()
+        conn.close()
+
+    async def count(self, sql, params=()):
+        cursor = await self.db.execute(sql, params)
+        return (await cursor.fetchone())[0]
+
+    async def prune(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return await self.worker.prune(self.db)
+
+    async def test_drops_expired_data(self):
+        old, recent = self.now - 3 * HOUR, self.now - 30 * MINUTE
+        self.populate([(1, old, 1.0), (1, recent, 2.0), (1, self.now, 3.0)],
+                      events=[old, old + 1000, old + 2000, self.now])
+        result = await self.prune()
+
+        # 期限を過ぎたパーティションだけを丸ごと消す
+        self.assertIn(history_partitions.partition_name(old, "hour"), result["partitions"])
+        self.assertEqual(await history_partitions.list_partitions(self.db),
+                         [history_partitions.partition_name(self.now, "hour")])
+        # 1分の集計は rollup_1m_hours (1時間) の間残る（生の履歴の保持期間 10分 を過ぎていても消さない）
+        cursor = await self.db.execute("SELECT bucket FROM history_1m ORDER BY bucket")
+        self.assertEqual([row[0] for row in await cursor.fetchall()],
+                         [history_rollups.bucket(ts, "1m") for ts in (recent, self.now)])
+        self.assertEqual(await self.count("SELECT COUNT(*) FROM history_1h WHERE bucket < ?",
+                                          (history_rollups.bucket(self.now - HOUR, "1h"),)), 0)
+        # event_logs は chunk_rows (2行) ずつ削除する
+        self.assertEqual(result["rows"]["event_logs"], 3)
+        self.assertEqual(await self.count("SELECT COUNT(*) FROM event_logs"), 1)
+        self.assertEqual(self.worker.stats["runs"], 1)
+
+    async def test_archives_expired_partitions(self):
+        self.worker.archive_path = os.path.join(os.path.dirname(self.db_path), "archive")
+        old = self.now - 3 * HOUR
+        self.populate([(1, old, 1.0), (1, old + 1000, 2.0), (1, self.now, 3.0)])
+        result = await self.prune()
+        name = history_partitions.partition_name(old, "hour")
+        self.assertEqual((result["partitions"], result["archived_rows"]), ([name], 2))
+        self.assertEqual(history_archive.read_range(self.worker.archive_path, 1), [(old, 1.0), (old + 1000, 2.0)])
+
+        # archive_days を過ぎたアーカイブファイルは消す
+        self.worker.archive_days = 0
+        result = await self.prune()
+        self.assertEqual(result["expired_archives"], [name])
+        self.assertEqual(history_archive.list_archives(self.worker.archive_path), [])
+
+    async def test_nothing_to_prune(self):
+        self.populate([(1, self.now, 1.0)])
+        result = await self.prune()
+        self.assertEqual((result["partitions"], sum(result["rows"].values())), ([], 0))
+
+    async def test_incremental_vacuum_returns_pages(self):
+        old = self.now - 3 * HOUR
+        self.populate([(item_id, old + i, float(i)) for item_id in range(1, 21) for i in range(500)])
+        result = await self.prune()
+        self.assertGreater(result["freed_pages"], 0)
+        self.assertEqual(await self.count("PRAGMA freelist_count"), 0)
+
+    async def test_without_incremental_vacuum(self):
+        self.populate([(1, self.now - 3 * HOUR, 1.0)])
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await self.worker.prune(self.db, incremental=False)
+        self.assertEqual(result["freed_pages"], 0)
+
+
+class RunTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.worker = RetentionWorker(create_db(directory.name), retention_minutes=10, interval=0)
+
+    async def run_until(self, calls, side_effect):
+        """prune が calls 回呼ばれるまで run() を動かし、(標準出力, 標準エラー) を返す"""
+        done = asyncio.Event()
+        attempts = []
+
+        async def prune(db, incremental=True):
+            attempts.append(incremental)
+            if len(attempts) >= calls:
+                done.set()
+            if len(attempts) <= len(side_effect):
+                raise side_effect[len(attempts) - 1]
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(self.worker, "prune", prune), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            task = asyncio.create_task(self.worker.run())
+            await asyncio.wait_for(done.wait(), 5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertEqual(len(attempts), calls)
+        return stdout.getvalue(), stderr.getvalue()
+
+    async def test_unexpected_error_keeps_looping(self):
+        stdout, stderr = await self.run_until(3, [RuntimeError("broken"), ValueError("bad row")])
+        self.assertIn("ERROR: Retention failed: RuntimeError('broken')", stdout)
+        self.assertIn("ERROR: Retention failed: ValueError('bad row')", stdout)
+        # 原因を追えるようにトレースバックも出す
+        self.assertIn("Traceback", stderr)
+
+    async def test_lock_timeout_is_a_warning(self):
+        stdout, stderr = await self.run_until(2, [sqlite3.OperationalError("database is locked")])
+        self.assertIn("WARNING: Retention skipped: database is locked", stdout)
+        self.assertEqual(stderr, "")
+
+
+if __name__ == "__main__":
+    unittest.main()
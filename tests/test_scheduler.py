@@ -0,0 +1,170 @@
+# 収集スケジューラ (src/engine/scheduler.py) のテスト
+import unittest
+from unittest import mock
+
+from src.engine.read_planner import PlanItem, ReadBlock
+from src.engine.scheduler import CycleTimer, IntervalScheduler, TimerWheel
+
+
+class FakeClock:
+    """time.time / time.monotonic の代わり（テストから進める）"""
+
+    def __init__(self, wall, mono):
+        self.wall = wall
+        self.mono = mono
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.mono
+
+    def advance(self, seconds):
+        self.wall += seconds
+        self.mono += seconds
+
+
+def block(address, interval):
+    return ReadBlock.from_items([PlanItem(address, 1, address, interval=interval)])
+
+
+class TimerWheelTest(unittest.TestCase):
+    def test_pop_due_only_returns_expired_entries(self):
+        wheel = TimerWheel(size=4)
+        wheel.schedule("a", 1)
+        wheel.schedule("b", 5)  # 同じスロットで1周先
+        self.assertEqual(wheel.pop_due(1), ["a"])
+        self.assertEqual(wheel.count, 1)
+        self.assertEqual(wheel.pop_due(5), ["b"])
+        self.assertEqual(wheel.count, 0)
+        self.assertEqual(wheel.entries(), [])
+
+    def test_pop_due_empty_slot(self):
+        self.assertEqual(TimerWheel(size=4).pop_due(3), [])
+
+
+class IntervalSchedulerTest(unittest.TestCase):
+    def test_blocks_fire_on_their_period(self):
+        scheduler = IntervalScheduler(base_interval=1, wheel_size=8)
+        fast, slow = block(0, 1), block(10, 5)
+        scheduler.load(0, [fast, slow], tick=100)
+        fired = {tick: scheduler.due(0, tick) for tick in range(100, 111)}
+        for tick, blocks in fired.items():
+            self.assertIn(fast, blocks)
+        self.assertEqual([tick for tick, blocks in fired.items() if slow in blocks], [100, 105, 110])
+
+    def test_same_period_blocks_are_spread_by_phase(self):
+        scheduler = IntervalScheduler(base_interval=1, wheel_size=8)
+        blocks = [block(address, 2) for address in (0, 10)]
+        scheduler.load(0, blocks, tick=100)
+        self.assertEqual(scheduler.due(0, 100), [blocks[0]])
+        self.assertEqual(scheduler.due(0, 101), [blocks[1]])
+
+    def test_catch_up_returns_skipped_deadlines_once(self):
+        scheduler = IntervalScheduler(base_interval=1, wheel_size=8)
+        slow = block(0, 5)
+        scheduler.load(0, [slow], tick=100)
+        self.assertEqual(scheduler.due(0, 100), [slow])
+        # 105 の期限を飛ばして 107 で回収する
+        self.assertEqual(scheduler.due(0, 107), [slow])
+        self.assertEqual(scheduler.due(0, 108), [])
+        self.assertEqual(scheduler.due(0, 110), [slow])
+
+    def test_without_catch_up_skipped_deadlines_are_dropped(self):
+        scheduler = IntervalScheduler(base_interval=1, wheel_size=8)
+        slow = block(0, 5)
+        scheduler.load(0, [slow], tick=100)
+        scheduler.due(0, 100)
+        self.assertEqual(scheduler.due(0, 107, catch_up=False), [])
+        self.assertEqual(scheduler.due(0, 110, catch_up=False), [slow])
+
+    def test_lag_longer_than_wheel(self):
+        scheduler = IntervalScheduler(base_interval=1, wheel_size=4)
+        fast = block(0, 1)
+        scheduler.load(0, [fast], tick=100)
+        self.assertEqual(scheduler.due(0, 150), [fast])
+        self.assertEqual(scheduler.due(0, 151), [fast])
+
+    def test_due_returns_blocks_in_address_order(self):
+        scheduler = IntervalScheduler(base_interval=1, wheel_size=8)
+        blocks = [block(20, 1), block(0, 1)]
+        scheduler.load(0, blocks, tick=100)
+        self.assertEqual(scheduler.due(0, 100), [blocks[1], blocks[0]])
+
+    def test_past_tick_and_unknown_host(self):
+        scheduler = IntervalScheduler(base_interval=1, wheel_size=8)
+        scheduler.load(0, [block(0, 1)], tick=100)
+        scheduler.due(0, 100)
+        self.assertEqual(scheduler.due(0, 100), [])
+        self.assertEqual(scheduler.due(1, 100), [])
+        scheduler.remove(0)
+        self.assertEqual(scheduler.due(0, 101), [])
+
+
+class CycleTimerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(wall=100.0, mono=1000.0)
+        patcher = mock.patch("src.engine.scheduler.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_start_is_not_jitter(self):
+        timer = CycleTimer(1.0)
+        self.clock.advance(0.3)
+        timer.start()
+        self.assertEqual(timer.max_jitter, 0.0)
+
+    def test_on_time_cycle(self):
+        timer = CycleTimer(1.0)
+        self.assertEqual(timer.tick, 100)
+        timer.start()
+        self.clock.advance(0.4)
+        self.assertAlmostEqual(timer.finish(), 0.6)
+        self.assertEqual((timer.tick, timer.overruns), (101, 0))
+        self.clock.advance(0.6 + 0.2)
+        timer.start()
+        self.assertAlmostEqual(timer.max_jitter, 0.2)
+
+    def test_compress_starts_next_cycle_immediately(self):
+        timer = CycleTimer(1.0, policy="compress")
+        timer.start()
+        self.clock.advance(3.6)
+        self.assertEqual(timer.finish(), 0.0)
+        self.assertEqual((timer.tick, timer.overruns, timer.skipped_ticks), (103, 1, 2))
+        self.assertTrue(timer.catch_up)
+
+    def test_skip_waits_for_next_deadline(self):
+        timer = CycleTimer(1.0, policy="skip")
+        timer.start()
+        self.clock.advance(3.6)
+        self.assertAlmostEqual(timer.finish(), 0.4)
+        self.assertEqual((timer.tick, timer.overruns, timer.skipped_ticks), (104, 1, 3))
+        self.assertFalse(timer.catch_up)
+
+    def test_resync_does_not_count_outage_as_jitter(self):
+        timer = CycleTimer(1.0)
+        timer.start()
+        self.clock.advance(0.1)
+        timer.finish()
+        # 再接続で 30 秒止まっていた
+        self.clock.advance(30.25)
+        timer.resync()
+        self.assertEqual(timer.tick, 130)
+        timer.start()
+        self.assertEqual((timer.jitter, timer.max_jitter), (0.0, 0.0))
+        self.clock.advance(0.1)
+        self.assertAlmostEqual(timer.finish(), 0.55)
+        self.assertEqual(timer.overruns, 0)
+
+    def test_stats(self):
+        timer = CycleTimer(1.0)
+        timer.start()
+        self.clock.advance(0.5)
+        timer.finish()
+        stats = timer.stats()
+        self.assertEqual(stats["cycles"], 1)
+        self.assertAlmostEqual(stats["avg_duration"], 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
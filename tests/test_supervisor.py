@@ -0,0 +1,98 @@
+# マルチプロセス実行のスーパーバイザー (src/engine/supervisor.py) のテスト
+import unittest
+from unittest import mock
+
+from src.engine import supervisor
+from src.engine.supervisor import RESTART_DELAY, STABLE_RUN_SECONDS, PollerSupervisor, shard_of
+
+
+class ShardOfTest(unittest.TestCase):
+    def test_every_host_has_one_worker(self):
+        slots = [0, 1, 2, 3]
+        owners = {host_id: shard_of(host_id, slots) for host_id in range(1, 401)}
+        self.assertEqual(set(owners.values()), set(slots))
+        # 同じ入力なら常に同じワーカー（プロセス間で担当が食い違わない）
+        self.assertEqual(owners, {host_id: shard_of(host_id, slots) for host_id in owners})
+
+    def test_only_hosts_of_removed_worker_move(self):
+        hosts = range(1, 401)
+        before = {host_id: shard_of(host_id, [0, 1, 2, 3]) for host_id in hosts}
+        after = {host_id: shard_of(host_id, [0, 1, 3]) for host_id in hosts}
+        moved = {host_id for host_id in hosts if before[host_id] != after[host_id]}
+        self.assertEqual(moved, {host_id for host_id in hosts if before[host_id] == 2})
+        # 落ちたワーカーが戻れば元の担当に戻る
+        self.assertEqual(before, {host_id: shard_of(host_id, [0, 1, 2, 3]) for host_id in hosts})
+
+
+class FakeProcess:
+    def __init__(self, exitcode=None):
+        self.exitcode = exitcode
+
+
+class CheckWorkersTest(unittest.TestCase):
+    def setUp(self):
+        # DBWriter は作らない（設定ファイルの DB・共有メモリに触れないように）
+        patcher = mock.patch.object(supervisor, "DBWriter")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.supervisor = PollerSupervisor(2)
+        self.now = 1000.0
+        self.started = []
+        for slot in self.supervisor.slots:
+            slot.process = FakeProcess()
+            slot.started_at = self.now
+
+        def start_worker(slot):
+            self.started.append(slot.index)
+            slot.process = FakeProcess()
+            slot.started_at = self.now
+            slot.restart_at = None
+            self.supervisor.alive[slot.index] = 1
+
+        self.supervisor.start_worker = start_worker
+
+    def check(self, now):
+        self.now = now
+        with mock.patch.object(supervisor.time, "monotonic", return_value=now):
+            self.supervisor.check_workers()
+
+    def test_crashed_worker_is_restarted_after_delay(self):
+        slot = self.supervisor.slots[1]
+        slot.process.exitcode = 1
+        self.check(1001.0)
+        # 再起動までの間は担当ホストを残りのワーカーが引き受ける
+        self.assertEqual(list(self.supervisor.alive), [1, 0])
+        self.assertEqual(slot.restart_at, 1001.0 + RESTART_DELAY)
+        self.check(1001.0 + RESTART_DELAY / 2)
+        self.assertEqual(self.started, [])
+        self.check(1001.0 + RESTART_DELAY)
+        self.assertEqual((self.started, slot.restarts), ([1], 1))
+        self.assertEqual(list(self.supervisor.alive), [1, 1])
+
+    def test_repeated_crashes_back_off(self):
+        slot = self.supervisor.slots[0]
+        now = 1000.0
+        delays = []
+        for _ in range(3):
+            slot.process.exitcode = -9
+            self.check(now + 1)
+            delays.append(slot.restart_at - (now + 1))
+            now = slot.restart_at
+            self.check(now)
+        self.assertEqual(delays, [RESTART_DELAY, RESTART_DELAY * 2, RESTART_DELAY * 4])
+
+        # しばらく安定して動いてから落ちた場合は待ち時間を初期値に戻す
+        slot.process.exitcode = 1
+        self.check(now + STABLE_RUN_SECONDS)
+        self.assertEqual(slot.restart_at - (now + STABLE_RUN_SECONDS), RESTART_DELAY)
+
+    def test_clean_exit_is_not_restarted(self):
+        self.supervisor.slots[0].process.exitcode = 0
+        self.check(1001.0)
+        self.check(5000.0)
+        self.assertEqual(self.started, [])
+        self.assertEqual(list(self.supervisor.alive), [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
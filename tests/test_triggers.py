@@ -0,0 +1,105 @@
+# トリガー判定エンジン (src/engine/triggers.py) のテスト
+import unittest
+
+from src.engine.triggers import STATUS_OK, STATUS_PROBLEM, TriggerDefinition, TriggerEngine, legacy_key
+
+
+def definition(key=1, item_id=10, cond_op=">", cond_thr=50.0, **kwargs):
+    return TriggerDefinition(key, key, item_id, f"trigger {key}", cond_op, cond_thr, **kwargs)
+
+
+def feed(engine, item_id, values):
+    """値を1サイクルずつ渡し、状態が変わったサイクルの番号と状態を返す"""
+    changes = []
+    for cycle, value in enumerate(values):
+        for status, _, _, _ in engine.evaluate([(item_id, value, cycle)]):
+            changes.append((cycle, status))
+    return changes
+
+
+class TriggerDefinitionTest(unittest.TestCase):
+    def test_default_recovery_is_negated_condition(self):
+        d = definition(cond_op=">=", cond_thr=5.0)
+        self.assertEqual((d.rect_op, d.rect_thr), (2, 5.0))  # '<'
+
+    def test_recovery_threshold_defaults_to_condition(self):
+        d = definition(rect_op="<")
+        self.assertEqual(d.rect_thr, 50.0)
+
+    def test_counts_are_at_least_one(self):
+        d = definition(problem_count=0, recovery_count=None)
+        self.assertEqual((d.problem_count, d.recovery_count), (1, 1))
+
+    def test_unknown_operator(self):
+        with self.assertRaises(ValueError):
+            definition(cond_op="=>")
+
+    def test_from_item(self):
+        d = TriggerDefinition.from_item({"id": 3, "tag_name": "T", "alarm_threshold": 80.0})
+        self.assertEqual((d.key, d.trigger_id, d.item_id, d.cond_thr), (legacy_key(3), None, 3, 80.0))
+
+
+class TriggerEngineTest(unittest.TestCase):
+    def test_fires_and_recovers(self):
+        engine = TriggerEngine()
+        engine.load([definition()])
+        self.assertEqual(feed(engine, 10, [10, 60, 70, 40]), [(1, STATUS_PROBLEM), (3, STATUS_OK)])
+
+    def test_problem_and_recovery_counts_suppress_chattering(self):
+        engine = TriggerEngine()
+        engine.load([definition(problem_count=3, recovery_count=2)])
+        values = [60, 60, 10, 60, 60, 60, 10, 60, 10, 10]
+        self.assertEqual(feed(engine, 10, values), [(5, STATUS_PROBLEM), (9, STATUS_OK)])
+
+    def test_hysteresis(self):
+        engine = TriggerEngine()
+        engine.load([definition(rect_op="<", rect_thr=30.0)])
+        self.assertEqual(feed(engine, 10, [60, 40, 35, 20]), [(0, STATUS_PROBLEM), (3, STATUS_OK)])
+
+    def test_none_values_and_other_items_are_ignored(self):
+        engine = TriggerEngine()
+        engine.load([definition(problem_count=2)])
+        self.assertEqual(feed(engine, 10, [60, None, 60]), [(2, STATUS_PROBLEM)])
+        self.assertEqual(engine.evaluate([(11, 100, 0)]), [])
+
+    def test_multiple_triggers_per_item(self):
+        engine = TriggerEngine()
+        engine.load([definition(1, cond_thr=50.0), definition(2, cond_thr=80.0)])
+        transitions = engine.evaluate([(10, 90, 0)])
+        self.assertEqual(sorted(d.key for _, d, _, _ in transitions), [1, 2])
+
+    def test_reload_keeps_state_and_reports_removed_problems(self):
+        engine = TriggerEngine()
+        engine.load([definition(1), definition(2, item_id=11)])
+        engine.evaluate([(10, 60, 0), (11, 60, 0)])
+        removed = engine.load([definition(1)])
+        self.assertEqual([d.key for d in removed], [2])
+        self.assertEqual(engine.status[engine.slots[1]], STATUS_PROBLEM)
+        # 状態を引き継いでいるので、発火し直さない
+        self.assertEqual(engine.evaluate([(10, 60, 1)]), [])
+
+    def test_reused_item_id_does_not_inherit_state(self):
+        engine = TriggerEngine()
+        before, after = ("PLC1", "T0", 0), ("PLC1", "U0", 7)
+        engine.load([definition(1, identity=before), definition(2, problem_count=2, identity=before)])
+        engine.evaluate([(10, 90, 0)])
+        self.assertEqual(list(engine.counts), [0, 1])
+        # 上書きインポートで item_id 10 (とトリガーID) が別のタグに振り直された
+        removed = engine.load([definition(1, identity=after), definition(2, problem_count=2, identity=after)])
+        # 前のアイテムで発生中だったイベントは閉じ、途中までの連続回数も引き継がない
+        self.assertEqual([d.key for d in removed], [1])
+        self.assertEqual((list(engine.status), list(engine.counts)), ([STATUS_OK, STATUS_OK], [0, 0]))
+        self.assertEqual(feed(engine, 10, [90, 90]), [(0, STATUS_PROBLEM), (1, STATUS_PROBLEM)])
+
+    def test_restore_and_forget(self):
+        engine = TriggerEngine()
+        engine.load([definition(1), definition(2, item_id=11)])
+        engine.restore([1, 2, 99])
+        self.assertEqual(list(engine.status), [STATUS_PROBLEM, STATUS_PROBLEM])
+        engine.forget([11])
+        self.assertEqual(list(engine.status), [STATUS_PROBLEM, STATUS_OK])
+        self.assertEqual(feed(engine, 10, [10]), [(0, STATUS_OK)])
+
+
+if __name__ == "__main__":
+    unittest.main()
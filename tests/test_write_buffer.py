@@ -0,0 +1,159 @@
+# DBWriter の書き込み待ちバッファ (src/engine/write_buffer.py) のテスト
+import json
+import os
+import tempfile
+import unittest
+
+from src.engine.write_buffer import SpillFile, WriteBuffer, message_rows
+
+
+def values(*item_ids):
+    return ["values", [[item_id, float(item_id), 1000 * item_id, True] for item_id in item_ids]]
+
+
+class MessageRowsTest(unittest.TestCase):
+    def test_rows(self):
+        self.assertEqual(message_rows(values(1, 2, 3)), 3)
+        self.assertEqual(message_rows(("events", [("open", ()), ("close", ())])), 2)
+        self.assertEqual(message_rows(("host_status", (1, "Online", "t"))), 1)
+
+
+class WriteBufferTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spill_path = os.path.join(directory.name, "spill", "writer.jsonl")
+
+    def test_drops_oldest_values_without_spill(self):
+        buffer = WriteBuffer(max_rows=3)
+        buffer.put_nowait(values(1, 2))
+        buffer.put_nowait(["events", [["open", [1]]]])
+        buffer.put_nowait(values(3, 4))
+        # イベントは捨てずに、古い収集値から捨てる
+        self.assertEqual(list(buffer.messages), [["events", [["open", [1]]]], values(3, 4)])
+        self.assertEqual((buffer.rows, buffer.dropped_rows), (3, 2))
+
+    def test_take_respects_max_rows(self):
+        buffer = WriteBuffer()
+        for item_id in range(5):
+            buffer.put_nowait(values(item_id))
+        batch, rows = buffer.take(3)
+        self.assertEqual((batch, rows), ([values(0), values(1), values(2)], 3))
+        self.assertEqual((buffer.qsize(), buffer.rows), (2, 2))
+
+    async def test_next_batch_after_stop(self):
+        buffer = WriteBuffer()
+        buffer.put_nowait(values(1))
+        buffer.put_nowait(None)
+        self.assertEqual(await buffer.next_batch(100, 10), ([values(1)], None))
+        self.assertIsNone(await buffer.next_batch(100, 10))
+
+    async def test_spill_and_replay_in_order(self):
+        buffer = WriteBuffer(max_rows=2, spill_path=self.spill_path)
+        for item_id in range(5):
+            buffer.put_nowait(values(item_id))
+        # 上限を超えた古い分だけがファイルへ移る
+        self.assertTrue(await buffer.spill_overflow())
+        self.assertEqual(list(buffer.messages), [values(3), values(4)])
+        self.assertEqual(buffer.spilled_rows, 3)
+
+        replayed = []
+        while True:
+            batch = await buffer.next_batch(2, 0)
+            messages, offset = batch
+            replayed.extend(messages)
+            if offset is None:
+                break
+            buffer.spill.consume(offset)
+        # ファイルの分を先に、メモリの分を後に返す
+        self.assertEqual(replayed, [values(item_id) for item_id in range(5)])
+        self.assertFalse(os.path.exists(self.spill_path))
+        self.assertFalse(buffer.spill.pending)
+
+    async def test_failed_batch_is_spilled_before_buffered_messages(self):
+        buffer = WriteBuffer(max_rows=10, spill_path=self.spill_path)
+        buffer.put_nowait(values(2))
+        await buffer.spill_overflow([values(1)])
+        messages, offset = await buffer.next_batch(10, 0)
+        self.assertEqual(messages, [values(1)])
+        buffer.spill.consume(offset)
+        self.assertEqual(await buffer.next_batch(10, 0), ([values(2)], None))
+
+    async def test_spill_overflow_without_spill_file(self):
+        buffer = WriteBuffer(max_rows=1)
+        self.assertFalse(await buffer.spill_overflow([values(1)]))
+
+    async def test_restart_resumes_from_offset(self):
+        buffer = WriteBuffer(max_rows=0, spill_path=self.spill_path)
+        for item_id in range(3):
+            buffer.put_nowait(values(item_id))
+        await buffer.spill_overflow()
+        messages, offset = await buffer.next_batch(1, 0)
+        self.assertEqual(messages, [values(0)])
+        buffer.spill.consume(offset)
+
+        # 再起動: 書き込み済みの位置から続きを読む
+        restarted = WriteBuffer(max_rows=0, spill_path=self.spill_path)
+        messages, _ = await restarted.next_batch(10, 0)
+        self.assertEqual(messages, [values(1), values(2)])
+
+
+class SpillFileTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "writer.jsonl")
+
+    def test_torn_last_line_is_discarded(self):
+        spill = SpillFile(self.path)
+        spill.append([values(1), values(2)])
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('["values", [[3, 3.0')
+        recovered = SpillFile(self.path)
+        self.assertEqual(recovered.read(10), ([values(1), values(2)], recovered.size))
+        self.assertEqual(recovered.size, spill.size)
+
+    def test_generation_header(self):
+        spill = SpillFile(self.path)
+        spill.append([values(1)])
+        spill.append([values(2)])
+        generation = spill.generation
+        self.assertIsNotNone(generation)
+        # 再起動しても同じファイルなら同じ世代。先頭行はメッセージとしては返さない
+        recovered = SpillFile(self.path)
+        self.assertEqual(recovered.generation, generation)
+        messages, offset = recovered.read(10)
+        self.assertEqual(messages, [values(1), values(2)])
+        # 全部書き終えてファイルを消したら、次のファイルは別の世代になる
+        recovered.consume(offset)
+        self.assertIsNone(recovered.generation)
+        recovered.append([values(3)])
+        self.assertNotEqual(recovered.generation, generation)
+
+    def test_file_without_generation(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(values(1)) + "\n")
+        spill = SpillFile(self.path)
+        self.assertIsNone(spill.generation)
+        self.assertEqual(spill.read(10)[0], [values(1)])
+
+    def test_broken_line_is_skipped(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(values(1)) + "\nnot json\n" + json.dumps(values(2)) + "\n")
+        messages, offset = SpillFile(self.path).read(10)
+        self.assertEqual(messages, [values(1), values(2)])
+        self.assertEqual(offset, os.path.getsize(self.path))
+
+    def test_read_stops_at_max_rows(self):
+        spill = SpillFile(self.path)
+        spill.append([values(1, 2), values(3), values(4)])
+        messages, offset = spill.read(2)
+        self.assertEqual(messages, [values(1, 2)])
+        spill.consume(offset)
+        self.assertTrue(spill.pending)
+        with open(spill.offset_path, encoding="utf-8") as f:
+            self.assertEqual(int(f.read()), offset)
+
+
+if __name__ == "__main__":
+    unittest.main()
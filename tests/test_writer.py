@@ -0,0 +1,189 @@
+# DB書き込みタスク (src/engine/writer.py) のテスト
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from src.common import db_handler, history_partitions
+from src.engine.writer import DBWriter
+
+
+class DBWriterTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        self.db_path = os.path.join(self.dir, "gateway.sqlite")
+        with mock.patch.object(db_handler, "DB_PATH", self.db_path):
+            db_handler.init_db()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO hosts (display_name, ip_address) VALUES ('PLC1', '127.0.0.1')")
+        conn.executemany("INSERT INTO items (host_id, tag_name, address) VALUES (1, ?, ?)",
+                         [(f"T{i}", i) for i in range(3)])
+        conn.commit()
+        conn.close()
+        self.now = history_partitions.now_ms()
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def history(self):
+        """history の全パーティションの (item_id, value)"""
+        names = [row[0] for row in self.query(history_partitions.LIST_SQL)]
+        if not names:
+            return []
+        return sorted(self.query(history_partitions.union_sql(names, "item_id, value")[0]))
+
+    def rollup_counts(self):
+        """history_1m の item_id ごとの件数（同じ値を二重に足し込んでいないかを見る）"""
+        return self.query("SELECT item_id, SUM(value_count) FROM history_1m GROUP BY item_id ORDER BY item_id")
+
+    async def run_until_stopped(self, writer):
+        task = asyncio.create_task(writer.run())
+        await writer.stop()
+        await task
+
+    def block_commits(self, writer, after_commit=False):
+        """次のコミットを止める。止まったら set される Event を返す（以後のコミットは通す）
+
+        after_commit: COMMIT を終えてから止める（キャンセルがコミットの完了と入れ違った場合）
+        """
+        started = asyncio.Event()
+        commit_batch = writer._commit_batch
+
+        async def blocked(*args, **kwargs):
+            writer._commit_batch = commit_batch
+            if after_commit:
+                await commit_batch(*args, **kwargs)
+            started.set()
+            await asyncio.sleep(3600)
+
+        writer._commit_batch = blocked
+        return started
+
+    async def cancel(self, task):
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+    async def test_stop_writes_everything_queued(self):
+        writer = DBWriter(self.db_path, max_batch=2, max_latency=10)
+        task = asyncio.create_task(writer.run())
+        for item_id in (1, 2, 3):
+            writer.submit_values([(item_id, float(item_id), self.now, True)])
+        writer.submit_item_status(2, 1)
+        await writer.stop()
+        await task
+        self.assertEqual(self.history(), [(1, 1.0), (2, 2.0), (3, 3.0)])
+        self.assertEqual(self.query("SELECT last_status FROM items WHERE id = 2"), [(1,)])
+
+    async def test_messages_from_all_hosts_share_one_commit(self):
+        writer = DBWriter(self.db_path, max_latency=10)
+        writer.submit_values([(1, 1.0, self.now, True)])
+        writer.submit_values([(2, 2.0, self.now, False)])
+        writer.submit_host_status(1, "Online", "2026-01-01 00:00:00")
+        await self.run_until_stopped(writer)
+        self.assertEqual(writer.stats["flushes"], 1)
+        # record_history が False の値は items だけに書く
+        self.assertEqual(self.history(), [(1, 1.0)])
+        self.assertEqual(self.query("SELECT id, last_value FROM items WHERE last_value IS NOT NULL"), [(1, 1.0), (2, 2.0)])
+        self.assertEqual(self.query("SELECT status FROM hosts WHERE id = 1"), [("Online",)])
+
+    async def test_events_open_and_close_in_order(self):
+        writer = DBWriter(self.db_path, max_latency=10)
+        writer.submit_events([("open", (1, None, "2026-01-01 00:00:00", 90.0, 80.0))])
+        writer.submit_events([("close", ("2026-01-01 00:00:05", 1, None)),
+                              ("open", (1, None, "2026-01-01 00:00:09", 95.0, 80.0))])
+        await self.run_until_stopped(writer)
+        self.assertEqual(
+            self.query("SELECT start_time, end_time, status FROM event_logs ORDER BY id"),
+            [("2026-01-01 00:00:00", "2026-01-01 00:00:05", "resolved"), ("2026-01-01 00:00:09", None, "active")],
+        )
+
+    async def test_rejected_message_is_dropped_and_counted(self):
+        writer = DBWriter(self.db_path, max_latency=0.2)
+        task = asyncio.create_task(writer.run())
+        writer.submit_values([(1, 5.0, self.now, True)])
+        writer.submit_values([(2, [1, 2], self.now, True)])  # SQLite に渡せない値
+        writer.submit_values([(3, 7.0, self.now, True)])
+        await writer.stop()
+        await task
+        self.assertEqual(self.history(), [(1, 5.0), (3, 7.0)])
+        self.assertEqual(writer.queue.dropped_rows, 1)
+        self.assertEqual(self.query("SELECT id, last_value FROM items ORDER BY id"), [(1, 5.0), (2, None), (3, 7.0)])
+        # 捨てたメッセージの分はロールアップにも入らない
+        self.assertEqual(self.rollup_counts(), [(1, 1), (3, 1)])
+
+    async def test_cancel_writes_inflight_batch(self):
+        writer = DBWriter(self.db_path, max_latency=0.01)
+        started = self.block_commits(writer)
+        task = asyncio.create_task(writer.run())
+        writer.submit_values([(1, 1.0, self.now, True), (2, 2.0, self.now, True)])
+        await started.wait()
+        await self.cancel(task)
+        self.assertEqual(self.history(), [(1, 1.0), (2, 2.0)])
+        self.assertIsNone(writer.inflight)
+
+    async def test_cancel_after_commit_does_not_rewrite_batch(self):
+        writer = DBWriter(self.db_path, max_latency=0.01)
+        started = self.block_commits(writer, after_commit=True)
+        task = asyncio.create_task(writer.run())
+        writer.submit_values([(1, 1.0, self.now, True)])
+        writer.submit_events([("open", (1, None, "2026-01-01 00:00:00", 90.0, 80.0))])
+        await started.wait()
+        await self.cancel(task)
+        # コミット済みのバッチは書き直さない（発生の行・ロールアップが二重にならない）
+        self.assertEqual(self.query("SELECT COUNT(*) FROM event_logs"), [(1,)])
+        self.assertEqual(self.rollup_counts(), [(1, 1)])
+
+    async def test_cancel_leaves_spilled_batch_in_file(self):
+        spill_path = os.path.join(self.dir, "spill.jsonl")
+        writer = DBWriter(self.db_path, max_latency=0.01, spill_path=spill_path)
+        await writer.queue.spill_overflow([("values", [(1, 1.0, self.now, True)])])
+        started = self.block_commits(writer)
+        task = asyncio.create_task(writer.run())
+        await started.wait()
+        await self.cancel(task)
+        # 退避ファイルから読んだバッチは書き直さない（ファイルに残っていて次の起動で書く）
+        self.assertEqual(self.history(), [])
+
+        restarted = DBWriter(self.db_path, max_latency=0.01, spill_path=spill_path)
+        await self.run_until_stopped(restarted)
+        self.assertEqual(self.history(), [(1, 1.0)])
+        self.assertFalse(os.path.exists(spill_path))
+
+    async def test_spilled_batch_committed_before_crash_is_not_replayed(self):
+        spill_path = os.path.join(self.dir, "spill.jsonl")
+        writer = DBWriter(self.db_path, max_latency=0.01, spill_path=spill_path)
+        await writer.queue.spill_overflow([
+            ("values", [(1, 1.0, self.now, True)]),
+            ("events", [("open", (1, None, "2026-01-01 00:00:00", 90.0, 80.0))]),
+        ])
+        await writer.queue.spill_overflow([("values", [(2, 2.0, self.now, True)])])
+
+        # コミットした後、読み出し位置 (.offset) を進める前に落ちる
+        def crash(offset):
+            raise OSError("crashed before consuming the spill file")
+
+        writer.queue.spill.consume = crash
+        with self.assertRaises(OSError):
+            await asyncio.wait_for(writer.run(), 5)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM event_logs"), [(1,)])
+
+        restarted = DBWriter(self.db_path, max_latency=0.01, spill_path=spill_path)
+        await self.run_until_stopped(restarted)
+        # コミット済みの分は書き直さず、残りだけを書く
+        self.assertEqual(self.query("SELECT COUNT(*) FROM event_logs"), [(1,)])
+        self.assertEqual(self.rollup_counts(), [(1, 1), (2, 1)])
+        self.assertEqual(self.history(), [(1, 1.0), (2, 2.0)])
+        self.assertFalse(os.path.exists(spill_path))
+
+
+if __name__ == "__main__":
+    unittest.main()